@@ -1,21 +1,44 @@
-import geoip2.database
-from flask import Blueprint, Flask, jsonify, request
+from flask import Blueprint, Flask, Response, jsonify, request
 from flask_cors import CORS
-from supabase import create_client, Client
 from dotenv import load_dotenv
 import os
+import threading
+import time
 from flasgger import Swagger
 from datetime import datetime, timedelta
-from collections import defaultdict
 from datetime import datetime, timezone
+from collections import Counter
+from geoip_cache import GeoIPResolver
+from login_state import RecentLogins
+from shared_ip_index import SharedIPIndex
+from prefix_index import PrefixIndex
+from background import start_background, start_periodic
+import metrics
+from repository import AsyncBackend, default_backend
+from pagination import ListQuery, NEXT_CURSOR_HEADER, parse_bool, parse_timestamp
+from response_cache import ResponseCache
+from transaction_columns import TransactionColumns
+from transaction_rules import RULES, RuleContext, RuleEngine, build_rules
+from transaction_scoring import TransactionScorer
+from transaction_checks import IncrementalTransactionChecker, parse_epoch
+from dashboard_stats import REASON_PREFIXES, DashboardStats
+from event_hub import EventHub, stream as event_stream
+from fund_trace import FundTraceIndex
+from columnar_export import EXPORT_TABLES, EXTENSIONS, MEDIA_TYPES, export as columnar_export, parse_export
+from profile_cache import COLUMNS as PROFILE_COLUMNS, ProfileCache
+from trust_scores import run_trust_shard
+from job_runner import Job, JobRunner
+from write_behind import WriteBehindBuffer
 # ------------------------------
 # Setup
 # ------------------------------
 
 load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Supabase by default; STORAGE_BACKEND=sqlite runs against a local database
+db = default_backend()
+# Non-blocking access to the same backend for async views
+storage = AsyncBackend(db)
+db.stats.add_listener(metrics.record_storage_call)
 
 app = Flask(__name__)
 
@@ -33,16 +56,189 @@ swagger_template = {
   "host": "localhost:8080",
   "basePath": "/",
   "schemes": ["http"],
+  # Shared by the paginated list endpoints
+  "parameters": {
+    "after_id": {
+      "name": "after_id",
+      "in": "query",
+      "type": "integer",
+      "required": False,
+      "description": "Keyset cursor: only return rows whose key is greater than this. Use the X-Next-After-Id header of the previous page.",
+    },
+    "limit": {
+      "name": "limit",
+      "in": "query",
+      "type": "integer",
+      "required": False,
+      "default": 1000,
+      "description": "Page size (1-1000). In ndjson mode, the size of each page fetched while streaming.",
+    },
+    "columns": {
+      "name": "columns",
+      "in": "query",
+      "type": "string",
+      "required": False,
+      "description": "Comma-separated list of columns to return. The key column is always included.",
+    },
+    "format": {
+      "name": "format",
+      "in": "query",
+      "type": "string",
+      "enum": ["json", "ndjson"],
+      "required": False,
+      "default": "json",
+      "description": "json returns one page; ndjson streams every matching row, one JSON object per line.",
+    },
+    "since": {
+      "name": "since",
+      "in": "query",
+      "type": "string",
+      "format": "date-time",
+      "required": False,
+      "description": "Only rows at or after this timestamp",
+    },
+    "until": {
+      "name": "until",
+      "in": "query",
+      "type": "string",
+      "format": "date-time",
+      "required": False,
+      "description": "Only rows at or before this timestamp",
+    },
+  },
 }
 
 Swagger(app, template=swagger_template)
-CORS(app)
-geo_reader = geoip2.database.Reader("backend/GeoLite2-City.mmdb")
+CORS(app, expose_headers=[NEXT_CURSOR_HEADER, "ETag"])
+
+# Short-TTL cache for the dashboard read endpoints, invalidated by the write paths below
+response_cache = ResponseCache(default_ttl=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "5")))
+
+
+def load_profiles(user_ids):
+    return db.table("user_profiles").select(", ".join(PROFILE_COLUMNS)).in_("user_id", user_ids).execute().data or []
+
+
+# trust_score / transaction_limit / is_verified per user, updated by the profile write paths below
+profile_cache = ProfileCache(load_profiles, ttl=float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "600")))
+
+geo_resolver = GeoIPResolver(
+    os.getenv("GEOIP_DB_PATH", "backend/GeoLite2-City.mmdb"),
+    cache_size=int(os.getenv("GEOIP_CACHE_SIZE", "100000")),
+)
+
+# Last 30 minutes of logins per user, answered from memory in /ip/ipcheck
+recent_logins = RecentLogins(window_seconds=30 * 60)
+
+# Hourly aggregates behind /stats/summary, updated by the write paths below
+dashboard_stats = DashboardStats(live_since=datetime.now(timezone.utc).timestamp())
+
+
+# New suspicious activity pushed to /events/stream clients
+event_hub = EventHub(
+    history=int(os.getenv("EVENTS_HISTORY", "10000")),
+    client_buffer=int(os.getenv("EVENTS_CLIENT_BUFFER", "1000")),
+    max_clients=int(os.getenv("EVENTS_MAX_CLIENTS", "100")),
+)
+
+
+# ip_logs rows are written behind the request in bulk inserts
+def insert_ip_logs(rows):
+    inserted = db.bulk_insert("ip_logs", rows)
+    response_cache.invalidate("ip_logs")
+    dashboard_stats.record_logins(rows)
+    event_hub.publish_many("suspicious_login", [row for row in inserted if row.get("is_suspicious")])
+
+
+ip_log_buffer = WriteBehindBuffer(
+    insert_ip_logs,
+    name="ip_logs",
+    max_rows=int(os.getenv("IP_LOG_BUFFER_MAX_ROWS", "10000")),
+    batch_size=int(os.getenv("IP_LOG_BUFFER_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("IP_LOG_BUFFER_FLUSH_SECONDS", "1.0")),
+)
+
 
-ip_blueprint = Blueprint("ip", __name__)
-user_profile_blueprint = Blueprint("user", __name__)
-trust_log_blueprint = Blueprint("trust_log", __name__)
-transaction_blueprint = Blueprint("transaction", __name__)
+def warm_recent_logins():
+    """Seed recent_logins from ip_logs so a restart does not forget the last 30 mins."""
+    since = datetime.utcnow() - timedelta(minutes=30)
+    try:
+        rows = (
+            db.table("ip_logs")
+            .select("user_id, ip_address, country, checked_at")
+            .gte("checked_at", since.isoformat())
+            .execute()
+            .data
+        )
+    except Exception as e:
+        print(f"Failed to warm recent logins: {e}")
+        return
+    recent_logins.warm(rows or [])
+
+
+# Users per IP within a sliding window; compacted into current_connected_ip periodically
+SHARED_IP_THRESHOLD = 5
+# ip_logs.remarks of suspicious logins, by reason (the reason filter of /ip/mark_safe/bulk)
+LOGIN_REASONS = {
+    "shared_ip": "Multiple users from same IP",
+    "location_change": "User login from different IP and country within 30 mins",
+}
+# Local testing on a LAN: resolve every login as coming from this routable address instead
+LOGIN_IP_OVERRIDE = os.getenv("LOGIN_IP_OVERRIDE")
+# Subnet/range view of the same active (ip, user) pairs
+ip_prefixes = PrefixIndex()
+shared_ips = SharedIPIndex(
+    window_seconds=int(os.getenv("SHARED_IP_WINDOW_SECONDS", "3600")),
+    suspicious_threshold=SHARED_IP_THRESHOLD,
+    listeners=[ip_prefixes],
+)
+
+
+def warm_shared_ips():
+    page_size = 1000
+    start = 0
+    try:
+        while True:
+            rows = (
+                db.table("current_connected_ip")
+                .select("ip_address, user_ids, is_suspicious")
+                .order("id")
+                .range(start, start + page_size - 1)
+                .execute()
+                .data
+            )
+            shared_ips.warm(rows or [])
+            if not rows or len(rows) < page_size:
+                break
+            start += page_size
+    except Exception as e:
+        print(f"Failed to warm shared IP index: {e}")
+
+
+def compact_shared_ips():
+    # Single upsert per chunk; requires a unique constraint on current_connected_ip.ip_address
+    def upsert(rows):
+        written = db.bulk_upsert("current_connected_ip", rows, on_conflict="ip_address")
+        event_hub.publish_many("suspicious_ip", [row for row in written if row.get("is_suspicious")])
+
+    upserted, deleted = shared_ips.compact(
+        upsert,
+        lambda ips: db.table("current_connected_ip").delete().in_("ip_address", ips).execute(),
+    )
+    if upserted or deleted:
+        response_cache.invalidate("current_connected_ip")
+    return upserted, deleted
+
+
+# Every blueprint is timed for /metrics
+ip_blueprint = metrics.instrument(Blueprint("ip", __name__))
+user_profile_blueprint = metrics.instrument(Blueprint("user", __name__))
+trust_log_blueprint = metrics.instrument(Blueprint("trust_log", __name__))
+transaction_blueprint = metrics.instrument(Blueprint("transaction", __name__))
+job_blueprint = metrics.instrument(Blueprint("jobs", __name__))
+stats_blueprint = metrics.instrument(Blueprint("stats", __name__))
+events_blueprint = metrics.instrument(Blueprint("events", __name__))
+export_blueprint = metrics.instrument(Blueprint("export", __name__))
 
 # ------------------------------
 # IP Monitoring Functions
@@ -80,13 +276,15 @@ def log_ip():
               type: string
               example: "User login from different IP and country within 30 mins"
       400:
-        description: Missing required parameters
+        description: Missing or non-integer user_id
         schema:
           type: object
           properties:
             error:
               type: string
               example: "user_id is required"
+      503:
+        description: Too many logins waiting to be written (storage is slow); retry after the Retry-After seconds
       500:
         description: Internal server error
         schema:
@@ -97,87 +295,40 @@ def log_ip():
               example: "Failed to log IP"
     """
 
-    user_id = request.args.get("user_id")
-    if not user_id:
+    if not request.args.get("user_id"):
         return jsonify({"error": "user_id is required"}), 400
+    user_id = request.args.get("user_id", type=int)
+    if user_id is None:
+        return jsonify({"error": "user_id must be an integer"}), 400
+    # Under ASGI this view runs on the event loop, so it sheds logins rather than wait for a
+    # slow flush to make room in the buffer (which would stall every connection on the loop)
+    if ip_log_buffer.full():
+        return login_backlog_response()
 
     # Get client IP
-    ip_address = request.remote_addr
-    ip_address = "30.6.250.1"
-    # GeoIP lookup
-    try:
-        response = geo_reader.city(ip_address)
-        country = response.country.name
-        region = response.subdivisions.most_specific.name
-        city = response.city.name
-        latitude = response.location.latitude
-        longitude = response.location.longitude
-    except Exception:
-        country = region = city = None
-        latitude = longitude = None
+    ip_address = LOGIN_IP_OVERRIDE or request.remote_addr
+    # GeoIP lookup (cached, memory-mapped)
+    with metrics.timed(metrics.GEOIP_SECONDS, "single", stage="geoip"):
+        country, region, city, latitude, longitude = geo_resolver.resolve(ip_address)
 
     # Initialize flag
     is_suspicious = False
     remarks = "Normal login"
     now = datetime.utcnow()
 
-    # 1️⃣ Check recent logs from same IP
-    # Check if this IP exists in current_connected_ip
-    current_ip_record = (
-        supabase.table("current_connected_ip")
-        .select("*")
-        .eq("ip_address", ip_address)
-        .execute()
-        .data
-    )
-
-    user_id_int = int(user_id)  # convert to int
+    # 1️⃣ Check other users on the same IP (in-memory, expiring), unless a moderator cleared it
+    active_users = shared_ips.touch(ip_address, user_id)
+    if active_users > SHARED_IP_THRESHOLD and not shared_ips.is_reviewed(ip_address):
+        is_suspicious = True
+        remarks = LOGIN_REASONS["shared_ip"]
 
-    if current_ip_record:
-        record = current_ip_record[0]
-        existing_users = record["user_ids"]  # already a list of integers
-        if user_id_int not in existing_users:
-            existing_users.append(user_id_int)
+    # 2️⃣ Check recent logins from same user (in-memory 30 min window)
+    if recent_logins.check_and_record(user_id, ip_address, country, now):
+        is_suspicious = True
+        remarks = LOGIN_REASONS["location_change"]
 
-        supabase.table("current_connected_ip").update(
-            {
-                "user_ids": existing_users,  # pass list of ints
-                "is_suspicious": True if len(existing_users) > 5 else False,
-            }
-        ).eq("id", record["id"]).execute()
-
-        if len(existing_users) > 5:
-            is_suspicious = True
-            remarks = "Multiple users from same IP"
-
-    else:
-        # New record
-        supabase.table("current_connected_ip").insert(
-            {
-                "ip_address": ip_address,
-                "user_ids": [user_id_int],  # list of integers
-                "is_suspicious": False,
-            }
-        ).execute()
-
-    # 2️⃣ Check recent logs from same user
-    recent_user_logs = (
-        supabase.table("ip_logs")
-        .select("*")
-        .eq("user_id", user_id)
-        .gte("checked_at", (now - timedelta(minutes=30)).isoformat())
-        .execute()
-        .data
-    )
-
-    for log in recent_user_logs:
-        if log["ip_address"] != ip_address and log["country"] != country:
-            is_suspicious = True
-            remarks = "User login from different IP and country within 30 mins"
-            break  # stop after first anomaly detected
-
-    # Write log to Supabase
-    supabase.table("ip_logs").insert(
+    # Queue log for bulk insert into Supabase
+    queued = ip_log_buffer.offer(
         {
             "user_id": user_id,
             "ip_address": ip_address,
@@ -190,7 +341,9 @@ def log_ip():
             "checked_at": now.isoformat(),
             "remarks": remarks,
         }
-    ).execute()
+    )
+    if not queued:
+        return login_backlog_response()
 
     return jsonify(
         {
@@ -201,22 +354,381 @@ def log_ip():
     )
 
 
+def login_backlog_response():
+    return jsonify({"error": "Too many logins waiting to be logged, retry shortly"}), 503, {"Retry-After": "1"}
+
+
+@ip_blueprint.route("/shared_ips", methods=["GET"])
+def get_shared_ips():
+    """
+    IPs shared by many users
+    ---
+    description: Returns IPs with more than `min_users` distinct users seen within the last `within_minutes`, answered from the in-memory shared-IP index without scanning `current_connected_ip`.
+    tags:
+      - Security
+    parameters:
+      - name: min_users
+        in: query
+        type: integer
+        required: false
+        default: 5
+        minimum: 1
+        description: Only return IPs with more than this many distinct users
+      - name: within_minutes
+        in: query
+        type: integer
+        required: false
+        default: 60
+        description: Only count users seen within this many minutes (capped at the index window)
+    responses:
+      200:
+        description: Shared IPs, most users first
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              ip_address:
+                type: string
+                example: "30.6.250.1"
+              user_count:
+                type: integer
+                example: 7
+      400:
+        description: min_users is below 1
+    """
+    min_users = request.args.get("min_users", default=SHARED_IP_THRESHOLD, type=int)
+    within_minutes = request.args.get("within_minutes", default=60, type=int)
+    # The index only examines IPs with 2+ users, so "more than 0" cannot be answered from it
+    if min_users < 1:
+        return jsonify({"error": "min_users must be at least 1"}), 400
+
+    results = shared_ips.ips_with_more_than(min_users, within_seconds=within_minutes * 60)
+    return jsonify([{"ip_address": ip, "user_count": count} for ip, count in results])
+
+
+@ip_blueprint.route("/prefix_stats", methods=["GET"])
+def get_prefix_stats():
+    """
+    Shared access by subnet / IP range
+    ---
+    description: |
+      Distinct active users per CIDR prefix, from the in-memory prefix index kept up to date by `/ip/ipcheck`.
+      - With `prefix`, returns the users and IPs active under that prefix.
+      - Otherwise returns the heaviest prefixes at `length` (or at /16, /24, /48 and /64 if omitted).
+    tags:
+      - Security
+    parameters:
+      - name: prefix
+        in: query
+        type: string
+        required: false
+        description: CIDR prefix to look up
+        example: "30.6.250.0/24"
+      - name: length
+        in: query
+        type: integer
+        required: false
+        description: Prefix length for the heaviest-prefixes query
+        example: 24
+      - name: family
+        in: query
+        type: integer
+        required: false
+        default: 4
+        description: Address family (4 or 6) for the heaviest-prefixes query
+      - name: top
+        in: query
+        type: integer
+        required: false
+        default: 10
+        description: Number of prefixes to return per length
+      - name: min_users
+        in: query
+        type: integer
+        required: false
+        default: 2
+        description: Skip prefixes with fewer distinct users
+    responses:
+      200:
+        description: Prefix statistics
+        schema:
+          type: object
+          properties:
+            prefix:
+              type: string
+              example: "30.6.250.0/24"
+            user_count:
+              type: integer
+              example: 12
+            ip_count:
+              type: integer
+              example: 4
+      400:
+        description: Invalid prefix or length
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              example: "Invalid prefix"
+    """
+    prefix = request.args.get("prefix")
+    if prefix:
+        try:
+            return jsonify(ip_prefixes.prefix_stats(prefix))
+        except ValueError:
+            return jsonify({"error": "Invalid prefix"}), 400
+
+    top = request.args.get("top", default=10, type=int)
+    min_users = request.args.get("min_users", default=2, type=int)
+    length = request.args.get("length", type=int)
+    family = request.args.get("family", default=4, type=int)
+    if family not in (4, 6):
+        return jsonify({"error": "family must be 4 or 6"}), 400
+
+    if length is None:
+        queries = [(4, 16), (4, 24), (6, 48), (6, 64)]
+    else:
+        queries = [(family, length)]
+
+    try:
+        heaviest = {
+            f"ipv{fam}/{plen}": ip_prefixes.heaviest(plen, family=fam, top=top, min_users=min_users)
+            for fam, plen in queries
+        }
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"totals": ip_prefixes.stats(), "heaviest": heaviest})
+
+
+@ip_blueprint.route("/geolocate", methods=["POST"])
+def geolocate_ips():
+    """
+    Bulk resolve IP addresses to locations
+    ---
+    description: Resolves a list of IP addresses against the GeoLite2 database in one call. Intended for backfills of ip_logs; results do not displace the hot login cache.
+    tags:
+      - IP Logging (User)
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            ips:
+              type: array
+              items:
+                type: string
+              example: ["30.6.250.1", "8.8.8.8"]
+    responses:
+      200:
+        description: Location per IP address
+        schema:
+          type: object
+          additionalProperties:
+            type: object
+            properties:
+              country:
+                type: string
+              region:
+                type: string
+              city:
+                type: string
+              latitude:
+                type: number
+              longitude:
+                type: number
+      400:
+        description: Missing required parameters
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              example: "ips must be a list of IP addresses"
+    """
+    data = request.get_json(silent=True) or {}
+    ips = data.get("ips")
+    if not isinstance(ips, list):
+        return jsonify({"error": "ips must be a list of IP addresses"}), 400
+
+    with metrics.timed(metrics.GEOIP_SECONDS, "batch", stage="geoip"):
+        results = geo_resolver.resolve_many(str(ip) for ip in ips)
+    return jsonify({ip: result.to_dict() for ip, result in results.items()})
+
+
 # ------------------------------
 # CRUD APIs
 # ------------------------------
 
 
+def _int_list(record, field):
+    # Postgres int8[] may come back null; normalise to a list of ints
+    if field in record:
+        record[field] = [int(v) for v in record[field]] if record[field] is not None else []
+    return record
+
+
+user_profiles_query = ListQuery(
+    "user_profiles",
+    key="user_id",
+    columns=["user_id", "created_at", "is_verified", "last_ip", "last_login", "trust_score", "transaction_limit"],
+    filters={
+        "is_verified": ("is_verified", "eq", parse_bool),
+        "min_trust": ("trust_score", "gte", int),
+        "max_trust": ("trust_score", "lte", int),
+    },
+)
+
+trust_logs_query = ListQuery(
+    "trust_logs",
+    key="id",
+    columns=["id", "user_id", "added_trust", "remarks", "created_at"],
+    filters={
+        "user_id": ("user_id", "eq", int),
+        "since": ("created_at", "gte", parse_timestamp),
+        "until": ("created_at", "lte", parse_timestamp),
+    },
+)
+
+ip_logs_query = ListQuery(
+    "ip_logs",
+    key="id",
+    columns=[
+        "id", "user_id", "ip_address", "is_suspicious", "country", "region",
+        "city", "latitude", "longitude", "checked_at", "remarks",
+    ],
+    filters={
+        "suspicious": ("is_suspicious", "eq", parse_bool),
+        "user_id": ("user_id", "eq", int),
+        "ip_address": ("ip_address", "eq", str),
+        "country": ("country", "eq", str),
+        "since": ("checked_at", "gte", parse_timestamp),
+        "until": ("checked_at", "lte", parse_timestamp),
+    },
+)
+
+transactions_query = ListQuery(
+    "transactions",
+    key="transaction_id",
+    columns=["transaction_id", "from_user_id", "to_user_id", "amount", "status", "created_at"],
+    filters={
+        "from_user_id": ("from_user_id", "eq", int),
+        "to_user_id": ("to_user_id", "eq", int),
+        "status": ("status", "eq", str),
+        "since": ("created_at", "gte", parse_timestamp),
+        "until": ("created_at", "lte", parse_timestamp),
+    },
+)
+
+flagged_transactions_query = ListQuery(
+    "flagged_transaction",
+    key="flagged_transaction_id",
+    columns=["flagged_transaction_id", "created_at", "transaction_ids", "is_resolved", "reason"],
+    filters={
+        "resolved": ("is_resolved", "eq", parse_bool),
+        "since": ("created_at", "gte", parse_timestamp),
+    },
+    transform=lambda record: _int_list(record, "transaction_ids"),
+)
+
+connected_ips_query = ListQuery(
+    "current_connected_ip",
+    key="id",
+    columns=["id", "ip_address", "user_ids", "is_suspicious"],
+    filters={
+        "suspicious": ("is_suspicious", "eq", parse_bool),
+        "ip_address": ("ip_address", "eq", str),
+    },
+    transform=lambda record: _int_list(record, "user_ids"),
+)
+
+
+def warm_dashboard_stats():
+    """
+    Count the last STATS_WARM_DAYS of stored rows once. Rows written after
+    the cutoff are counted by the write paths instead, so none is counted twice;
+    changes to stored rows reported meanwhile are held by dashboard_stats until
+    it knows whether the warm-up read them before or after the change.
+    """
+    cutoff = datetime.fromtimestamp(dashboard_stats.live_since, timezone.utc)
+    since = cutoff - timedelta(days=int(os.getenv("STATS_WARM_DAYS", "30")))
+    window = [("gte", since.isoformat()), ("lt", cutoff.isoformat())]
+    checked_at = [("checked_at", op, value) for op, value in window]
+    created_at = [("created_at", op, value) for op, value in window]
+    try:
+        for rows in ip_logs_query.iter_pages(db, ["id", "checked_at", "country", "is_suspicious"], checked_at):
+            dashboard_stats.record_logins(rows, warm=True)
+        for rows in flagged_transactions_query.iter_pages(
+            db, ["flagged_transaction_id", "created_at", "reason", "is_resolved"], created_at
+        ):
+            dashboard_stats.record_flags(rows, warm=True)
+        for row in trust_logs_query.iter_rows(db, ["id", "created_at", "added_trust"], created_at):
+            dashboard_stats.record_trust_changes({row["added_trust"]: 1}, row["created_at"])
+    except Exception as e:
+        print(f"Failed to warm dashboard stats: {e}")
+    finally:
+        dashboard_stats.finish_warm(since.timestamp())
+
+    try:
+        # The trust job reports its moves in one go when it finishes; holding it off makes the
+        # snapshot either include all of a run's moves or none
+        with job_runner.hold("tabulate_trust"):
+            dashboard_stats.record_trust_scores(
+                (
+                    (row["user_id"], row["trust_score"])
+                    for row in user_profiles_query.iter_rows(db, ["user_id", "trust_score"], [])
+                ),
+                cutoff,
+            )
+    except Exception as e:
+        print(f"Failed to warm dashboard trust scores: {e}")
+
+
+
+def warm_profile_cache():
+    try:
+        profile_cache.warm(user_profiles_query.iter_pages(db, PROFILE_COLUMNS, []))
+    except Exception as e:
+        print(f"Failed to warm profile cache: {e}")
+
+
+
 @user_profile_blueprint.route("/user_profiles", methods=["GET"])
+@response_cache.cached(tables=["user_profiles"])
 def get_user_profiles():
     """
-    Get all user profiles
+    Get user profiles
     ---
-    description: Retrieve all user profiles including user_id, created_at, verification status, last IP, trust score, and transaction limit.
+    description: Retrieve user profiles including user_id, created_at, verification status, last IP, trust score, and transaction limit. Paginated by user_id.
     tags:
       - CRUD APIs
+    parameters:
+      - $ref: '#/parameters/after_id'
+      - $ref: '#/parameters/limit'
+      - $ref: '#/parameters/columns'
+      - $ref: '#/parameters/format'
+      - name: is_verified
+        in: query
+        type: boolean
+        required: false
+        description: Filter by verification status
+      - name: min_trust
+        in: query
+        type: integer
+        required: false
+        description: Only users with trust_score >= min_trust
+      - name: max_trust
+        in: query
+        type: integer
+        required: false
+        description: Only users with trust_score <= max_trust
     responses:
       200:
-        description: A list of user profiles
+        description: A page of user profiles
         schema:
           type: array
           items:
@@ -236,24 +748,33 @@ def get_user_profiles():
               transaction_limit:
                 type: integer
     """
-    # Fetch all user profiles from Supabase
-    result = supabase.table("user_profiles").select("*").execute()
-    data = result.data if result.data else []
-
-    return jsonify(data)
+    return user_profiles_query.respond(db, request.args)
 
 
 @trust_log_blueprint.route("/trust_logs", methods=["GET"])
+@response_cache.cached(tables=["trust_logs"])
 def get_trust_logs():
     """
-    Get all trust log entries
+    Get trust log entries
     ---
-    description: Retrieve all trust logs including id, user_id, added_trust, remarks, and created_at.
+    description: Retrieve trust logs including id, user_id, added_trust, remarks, and created_at. Paginated by id.
     tags:
       - CRUD APIs
+    parameters:
+      - $ref: '#/parameters/after_id'
+      - $ref: '#/parameters/limit'
+      - $ref: '#/parameters/columns'
+      - $ref: '#/parameters/format'
+      - name: user_id
+        in: query
+        type: integer
+        required: false
+        description: Only logs for this user
+      - $ref: '#/parameters/since'
+      - $ref: '#/parameters/until'
     responses:
       200:
-        description: A list of trust log entries
+        description: A page of trust log entries
         schema:
           type: array
           items:
@@ -271,30 +792,48 @@ def get_trust_logs():
                 type: string
                 format: date-time
     """
-    # Fetch all trust logs from Supabase
-    result = supabase.table("trust_logs").select("*").execute()
-    data = result.data if result.data else []
-
-    return jsonify(data)
+    return trust_logs_query.respond(db, request.args)
 
 
 @ip_blueprint.route("/ip_logs", methods=["GET"])
+@response_cache.cached(tables=["ip_logs"])
 def get_ip_logs():
     """
     Get IP logs
     ---
-    description: Retrieve all IP logs including id, user_id, ip_address, is_suspicious, country, region, city, latitude, longitude, checked_at, and remarks.
+    description: Retrieve IP logs including id, user_id, ip_address, is_suspicious, country, region, city, latitude, longitude, checked_at, and remarks. Paginated by id.
     tags:
       - CRUD APIs
     parameters:
+      - $ref: '#/parameters/after_id'
+      - $ref: '#/parameters/limit'
+      - $ref: '#/parameters/columns'
+      - $ref: '#/parameters/format'
       - name: suspicious
         in: query
         type: boolean
         required: false
         description: Filter only suspicious logs if true
+      - name: user_id
+        in: query
+        type: integer
+        required: false
+        description: Only logs for this user
+      - name: ip_address
+        in: query
+        type: string
+        required: false
+        description: Only logs from this IP
+      - name: country
+        in: query
+        type: string
+        required: false
+        description: Only logs from this country
+      - $ref: '#/parameters/since'
+      - $ref: '#/parameters/until'
     responses:
       200:
-        description: A list of IP log entries
+        description: A page of IP log entries
         schema:
           type: array
           items:
@@ -324,24 +863,11 @@ def get_ip_logs():
               remarks:
                 type: string
     """
-    # Optional query parameter to filter suspicious logs
-    suspicious_filter = request.args.get("suspicious")
-
-    query = supabase.table("ip_logs").select("*")
-
-    if suspicious_filter is not None:
-        # Convert query param to boolean
-        is_suspicious = suspicious_filter.lower() == "true"
-        query = query.eq("is_suspicious", is_suspicious)
-
-    result = query.execute()
-    data = result.data if result.data else []
-
-    return jsonify(data)
+    return ip_logs_query.respond(db, request.args)
 
 
 @ip_blueprint.route("mark_safe/<int:log_id>", methods=["PUT"])
-def mark_ip_safe(log_id):
+async def mark_ip_safe(log_id):
     """
     Mark IP log as not suspicious
     ---
@@ -365,67 +891,284 @@ def mark_ip_safe(log_id):
             updated_id:
               type: integer
     """
-    # Update the record in Supabase
-    result = (
-        supabase.table("ip_logs")
-        .update({"is_suspicious": False, "remarks": "Marked safe after review"})
-        .eq("id", log_id)
-        .execute()
-    )
+    # Update the record in Supabase; only a log that was still suspicious changes the dashboard counts
+    update = {"is_suspicious": False, "remarks": "Marked safe after review"}
+    result = await storage.execute(db.table("ip_logs").update(update).eq("id", log_id).eq("is_suspicious", True))
+    if result.data:
+        dashboard_stats.record_login_marked_safe(result.data[0])
+        event_hub.publish("login_marked_safe", {"id": log_id})
+    else:
+        result = await storage.execute(db.table("ip_logs").update(update).eq("id", log_id))
 
     if result.data:
+        response_cache.invalidate("ip_logs")
         return jsonify({"message": "IP log updated successfully", "updated_id": log_id})
     else:
         return jsonify({"message": "IP log not found", "updated_id": log_id}), 404
 
 
-@transaction_blueprint.route("/transactions", methods=["GET"])
-def get_transactions():
+# Bulk moderator review: rows are selected and updated REVIEW_CHUNK_SIZE at a time
+REVIEW_CHUNK_SIZE = int(os.getenv("REVIEW_CHUNK_SIZE", "500"))
+REVIEW_MAX_IDS = 100_000
+
+
+def _one_of(choices):
+    def parse(value):
+        if value not in choices:
+            raise ValueError(f"expected one of {', '.join(choices)}")
+        return choices[value]
+
+    return parse
+
+
+def parse_review(body, review_filters):
     """
-    Get all transactions
-    ---
-    description: Retrieve all transactions including transaction_id, from_user_id, to_user_id, amount, status, and created_at.
-    tags:
-      - CRUD APIs
-    responses:
-      200:
-        description: A list of transaction records
-        schema:
-          type: array
-          items:
-            type: object
-            properties:
-              transaction_id:
-                type: integer
-              from_user_id:
-                type: integer
-              to_user_id:
-                type: integer
-              amount:
-                type: number
-              status:
-                type: string
-              created_at:
-                type: string
-                format: date-time
+    (ids, filters) of a bulk review body: either an "ids" list or at least one
+    of review_filters, which maps a body field to (column, operator, parser).
     """
-    # Fetch all transactions from Supabase
-    result = supabase.table("transactions").select("*").execute()
-    data = result.data if result.data else []
+    if not isinstance(body, dict):
+        raise ValueError("expected a JSON object")
+    filters = []
+    for param, (column, op, parser) in review_filters.items():
+        value = body.get(param)
+        if value is None or value == "":
+            continue
+        try:
+            filters.append((column, op, parser(str(value))))
+        except ValueError as e:
+            raise ValueError(f"invalid {param}: {e}")
+
+    ids = body.get("ids")
+    if ids is None:
+        if not filters:
+            raise ValueError(f"ids or at least one of {', '.join(review_filters)} is required")
+        return None, filters
+    if filters:
+        raise ValueError("give either ids or filters, not both")
+    if not isinstance(ids, list) or not ids or len(ids) > REVIEW_MAX_IDS:
+        raise ValueError(f"ids must be a list of 1 to {REVIEW_MAX_IDS} integers")
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ValueError("ids must be integers")
+    return sorted(set(ids)), filters
+
+
+def review_pages(query, columns, ids, filters, pending):
+    """
+    Pages of rows still pending review (the pending filter): the listed ids a
+    chunk at a time, or every row matching the filters, by keyset pages.
+    """
+    if ids is None:
+        yield from query.iter_pages(db, columns, filters + [pending], page_size=REVIEW_CHUNK_SIZE)
+        return
+    column, op, value = pending
+    for i in range(0, len(ids), REVIEW_CHUNK_SIZE):
+        select = db.table(query.table).select(",".join(columns)).in_(query.key, ids[i : i + REVIEW_CHUNK_SIZE])
+        rows = getattr(select, op)(column, value).execute().data
+        if rows:
+            yield [query.transform(row) for row in rows] if query.transform else rows
+
+
+IP_LOG_REVIEW_FILTERS = {
+    **{param: ip_logs_query.filters[param] for param in ("user_id", "ip_address", "country", "since", "until")},
+    "reason": ("remarks", "eq", _one_of(LOGIN_REASONS)),
+}
 
-    return jsonify(data)
 
+def clear_shared_ips(ip_addresses):
+    """
+    Moderator marked these shared IPs safe: the index stops flagging them (until
+    a new user appears) and their current_connected_ip rows are cleared now.
+    """
+    ip_addresses = sorted(ip_addresses)
+    shared_ips.mark_reviewed(ip_addresses)
+    cleared = []
+    for i in range(0, len(ip_addresses), REVIEW_CHUNK_SIZE):
+        cleared += (
+            db.table("current_connected_ip")
+            .update({"is_suspicious": False})
+            .in_("ip_address", ip_addresses[i : i + REVIEW_CHUNK_SIZE])
+            .eq("is_suspicious", True)
+            .execute()
+            .data
+            or []
+        )
+    if cleared:
+        response_cache.invalidate("current_connected_ip")
+        event_hub.publish_many("ip_marked_safe", [{"ip_address": row["ip_address"]} for row in cleared])
+    return len(cleared)
 
-@transaction_blueprint.route("/flagged_transactions", methods=["GET"])
-def get_flagged_transactions():
+
+@ip_blueprint.route("/mark_safe/bulk", methods=["POST"])
+def mark_ips_safe():
     """
-    Get flagged transactions
+    Mark many IP logs as not suspicious
     ---
-    description: Retrieve all flagged transactions including flagged_transaction_id, created_at, transaction_ids, is_resolved, and reason.
+    description: |
+      Moderator review of a backlog of suspicious logins in one request. Give either `ids`, or
+      filters (all given filters must match): `user_id`, `ip_address`, `country`, `reason`
+      (`shared_ip` or `location_change`), `since` / `until` (checked_at).
+
+      Matching logs that are still suspicious are updated `REVIEW_CHUNK_SIZE` (500) at a time, each
+      chunk in one conditional update, so logs marked safe concurrently are not counted twice.
+      Dashboard aggregates (`/stats/summary`) are adjusted and `login_marked_safe` events published.
+
+      IPs whose logs were flagged for sharing (`shared_ip`) are marked safe too: their
+      `current_connected_ip` rows are cleared and new logins from them are not flagged for sharing,
+      until a user who was not on the IP at review time logs in from it.
     tags:
-      - Transaction
+      - CRUD APIs
+    consumes:
+      - application/json
     parameters:
-      - name: resolved
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            ids:
+              type: array
+              items:
+                type: integer
+              example: [101, 102, 103]
+            user_id:
+              type: integer
+            ip_address:
+              type: string
+            country:
+              type: string
+            reason:
+              type: string
+              enum: ["shared_ip", "location_change"]
+            since:
+              type: string
+              format: date-time
+            until:
+              type: string
+              format: date-time
+    responses:
+      200:
+        description: Logs marked safe
+        schema:
+          type: object
+          properties:
+            updated:
+              type: integer
+              example: 3
+            requested:
+              type: integer
+              description: Number of distinct ids given (ids that were missing or already safe are not updated)
+              example: 3
+            shared_ips_cleared:
+              type: integer
+              example: 1
+      400:
+        description: Neither ids nor a filter given, or an invalid one
+    """
+    try:
+        ids, filters = parse_review(request.get_json(silent=True), IP_LOG_REVIEW_FILTERS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    ip_log_buffer.flush()  # logins of the last second are reviewable too
+    updated, shared = 0, set()
+    pages = review_pages(
+        ip_logs_query, ["id", "ip_address", "remarks"], ids, filters, ("is_suspicious", "eq", True)
+    )
+    for rows in pages:
+        reasons = {row["id"]: row["remarks"] for row in rows}
+        changed = (
+            db.table("ip_logs")
+            .update({"is_suspicious": False, "remarks": "Marked safe after review"})
+            .in_("id", list(reasons))
+            .eq("is_suspicious", True)
+            .execute()
+            .data
+            or []
+        )
+        for row in changed:
+            dashboard_stats.record_login_marked_safe(row)
+            if reasons[row["id"]] == LOGIN_REASONS["shared_ip"]:
+                shared.add(row["ip_address"])
+        event_hub.publish_many("login_marked_safe", [{"id": row["id"]} for row in changed])
+        updated += len(changed)
+
+    if updated:
+        response_cache.invalidate("ip_logs")
+    result = {"updated": updated, "shared_ips_cleared": clear_shared_ips(shared) if shared else 0}
+    if ids is not None:
+        result["requested"] = len(ids)
+    return jsonify(result)
+
+
+@transaction_blueprint.route("/transactions", methods=["GET"])
+@response_cache.cached(tables=["transactions"])
+def get_transactions():
+    """
+    Get transactions
+    ---
+    description: Retrieve transactions including transaction_id, from_user_id, to_user_id, amount, status, and created_at. Paginated by transaction_id.
+    tags:
+      - CRUD APIs
+    parameters:
+      - $ref: '#/parameters/after_id'
+      - $ref: '#/parameters/limit'
+      - $ref: '#/parameters/columns'
+      - $ref: '#/parameters/format'
+      - name: from_user_id
+        in: query
+        type: integer
+        required: false
+        description: Only transactions sent by this user
+      - name: to_user_id
+        in: query
+        type: integer
+        required: false
+        description: Only transactions received by this user
+      - name: status
+        in: query
+        type: string
+        required: false
+        description: Only transactions with this status
+        example: "pending"
+      - $ref: '#/parameters/since'
+      - $ref: '#/parameters/until'
+    responses:
+      200:
+        description: A page of transaction records
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              transaction_id:
+                type: integer
+              from_user_id:
+                type: integer
+              to_user_id:
+                type: integer
+              amount:
+                type: number
+              status:
+                type: string
+              created_at:
+                type: string
+                format: date-time
+    """
+    return transactions_query.respond(db, request.args)
+
+
+@transaction_blueprint.route("/flagged_transactions", methods=["GET"])
+@response_cache.cached(tables=["flagged_transaction"])
+def get_flagged_transactions():
+    """
+    Get flagged transactions
+    ---
+    description: Retrieve all flagged transactions including flagged_transaction_id, created_at, transaction_ids, is_resolved, and reason.
+    tags:
+      - Transaction
+    parameters:
+      - name: resolved
         in: query
         type: boolean
         required: false
@@ -455,7 +1198,7 @@ def get_flagged_transactions():
     # Optional query parameter to filter resolved status
     resolved_filter = request.args.get("resolved")
 
-    query = supabase.table("flagged_transaction").select("*")
+    query = db.table("flagged_transaction").select("*")
 
     if resolved_filter is not None:
         # Convert query param to boolean
@@ -476,14 +1219,149 @@ def get_flagged_transactions():
     return jsonify(data)
 
 
+FLAG_REVIEW_FILTERS = {
+    "reason": ("reason", "like", _one_of({category: f"{prefix}%" for prefix, category in REASON_PREFIXES})),
+    "since": ("created_at", "gte", parse_timestamp),
+    "until": ("created_at", "lte", parse_timestamp),
+    # Not a column: flags of transactions the user sent or received (matched below)
+    "user_id": ("user_id", None, int),
+}
+
+
+def user_transaction_ids(user_id):
+    ids = set()
+    for column in ("from_user_id", "to_user_id"):
+        for rows in transactions_query.iter_pages(db, ["transaction_id"], [(column, "eq", user_id)]):
+            ids.update(row["transaction_id"] for row in rows)
+    return ids
+
+
+@transaction_blueprint.route("/flagged_transactions/resolve", methods=["POST"])
+def resolve_flagged_transactions():
+    """
+    Resolve flagged transactions in bulk
+    ---
+    description: |
+      Moderator review of flagged transactions, e.g. clearing a backlog of false positives in one
+      request. Give either `ids` (one id resolves a single flag), or filters (all given filters must
+      match): `reason` (the rule: `circular_flow`, `huge_amount`, `pending_burst`), `since` / `until`
+      (created_at), `user_id` (flags involving a transaction the user sent or received).
+
+      Matching unresolved flags are resolved `REVIEW_CHUNK_SIZE` (500) at a time, each chunk in one
+      conditional update, so flags resolved concurrently are not counted twice. Dashboard aggregates
+      (`/stats/summary` unresolved counts) are adjusted and `flag_resolved` events published.
+    tags:
+      - Transaction
+    consumes:
+      - application/json
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            ids:
+              type: array
+              items:
+                type: integer
+              example: [12, 13]
+            reason:
+              type: string
+              enum: ["circular_flow", "huge_amount", "pending_burst"]
+            user_id:
+              type: integer
+            since:
+              type: string
+              format: date-time
+            until:
+              type: string
+              format: date-time
+    responses:
+      200:
+        description: Flags resolved
+        schema:
+          type: object
+          properties:
+            resolved:
+              type: integer
+              example: 2
+            requested:
+              type: integer
+              description: Number of distinct ids given (ids that were missing or already resolved are not updated)
+              example: 2
+      400:
+        description: Neither ids nor a filter given, or an invalid one
+    """
+    try:
+        ids, filters = parse_review(request.get_json(silent=True), FLAG_REVIEW_FILTERS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    user_filter = [value for column, _, value in filters if column == "user_id"]
+    filters = [f for f in filters if f[0] != "user_id"]
+    pages = review_pages(
+        flagged_transactions_query,
+        ["flagged_transaction_id", "transaction_ids"],
+        ids,
+        filters,
+        ("is_resolved", "eq", False),
+    )
+    if user_filter:
+        involved = user_transaction_ids(user_filter[0])
+        pages = ([row for row in rows if not involved.isdisjoint(row["transaction_ids"])] for rows in pages)
+
+    resolved = 0
+    for rows in pages:
+        if not rows:
+            continue
+        changed = (
+            db.table("flagged_transaction")
+            .update({"is_resolved": True})
+            .in_("flagged_transaction_id", [row["flagged_transaction_id"] for row in rows])
+            .eq("is_resolved", False)
+            .execute()
+            .data
+            or []
+        )
+        dashboard_stats.record_flags_resolved(changed)
+        event_hub.publish_many(
+            "flag_resolved", [{"flagged_transaction_id": row["flagged_transaction_id"]} for row in changed]
+        )
+        resolved += len(changed)
+
+    if resolved:
+        response_cache.invalidate("flagged_transaction")
+    result = {"resolved": resolved}
+    if ids is not None:
+        result["requested"] = len(ids)
+    return jsonify(result)
+
+
 @ip_blueprint.route("/current_connected_ips", methods=["GET"])
+@response_cache.cached(tables=["current_connected_ip"])
 def get_current_connected_ips():
     """
-    Fetch all current connected IP records
+    Fetch current connected IP records
     ---
-    description: Retrieves all records from the `current_connected_ip` table. Each record contains the IP address and list of connected user IDs. Ensures all `user_ids` are integers. Useful for monitoring suspicious activity or active connections.
+    description: Retrieves records from the `current_connected_ip` table, paginated by id. Each record contains the IP address and list of connected user IDs. Ensures all `user_ids` are integers. Useful for monitoring suspicious activity or active connections.
     tags:
       - Security
+    parameters:
+      - $ref: '#/parameters/after_id'
+      - $ref: '#/parameters/limit'
+      - $ref: '#/parameters/columns'
+      - $ref: '#/parameters/format'
+      - name: suspicious
+        in: query
+        type: boolean
+        required: false
+        description: Filter by is_suspicious
+      - name: ip_address
+        in: query
+        type: string
+        required: false
+        description: Only the record for this IP
     responses:
       200:
         description: Successfully retrieved IP records
@@ -515,19 +1393,7 @@ def get_current_connected_ips():
               type: string
               example: "Failed to fetch records"
     """
-
-    # Fetch all records from Supabase
-    result = supabase.table("current_connected_ip").select("*").execute()
-    data = result.data if result.data else []
-
-    # Ensure user_ids are integers
-    for record in data:
-        if record.get("user_ids") is None:
-            record["user_ids"] = []
-        else:
-            record["user_ids"] = [int(uid) for uid in record["user_ids"]]
-
-    return jsonify(data)
+    return connected_ips_query.respond(db, request.args)
 
 
 @transaction_blueprint.route("/check_transactions", methods=["GET"])
@@ -537,243 +1403,1044 @@ def check_transactions():
     ---
     description: |
       Batch processing to check suspicious transactions:
-      - Circular money flow between users A and B
+      - Circular money flow: time-ordered cycles (A -> B -> ... -> A) passing on roughly the same amount
       - Huge transaction amount way higher than trust limit
       - Multiple pending transactions from user A to B within 30 mins
 
       Flagged transactions are saved into `flagged_transaction` table if not flagged before.
+
+      The full check runs the rules enabled in `TRANSACTION_RULES` (see `/transaction/rules`)
+      in one pass over the window and reports hits and timing per rule.
+
+      The cycle search is bounded by `CYCLE_MAX_EXPANSIONS` edges examined per run
+      (`CYCLE_MAX_EXPANSIONS_PER_TRANSACTION` per transaction in incremental mode), so a
+      dense ring of accounts cannot stall the check. A search that hits the bound is
+      reported as `truncated` and may have missed cycles.
+
+      With `mode=incremental`, only transactions newer than the last processed
+      transaction_id are checked, against rolling per-pair state persisted between
+      runs, so the job can run every minute.
     tags:
       - Transaction
+    parameters:
+      - name: mode
+        in: query
+        type: string
+        enum: ["full", "incremental"]
+        required: false
+        default: full
+        description: full re-scans the last 24 hours; incremental resumes from the stored watermark
     responses:
       200:
         description: Batch check executed successfully
+        schema:
+          type: object
+          properties:
+            message:
+              type: string
+              example: "Executed successfully"
+            mode:
+              type: string
+              example: "incremental"
+            processed:
+              type: integer
+              description: Transactions checked in this run
+              example: 120
+            flagged:
+              type: integer
+              description: New flagged_transaction rows
+              example: 2
+            watermark:
+              type: integer
+              description: Last transaction_id processed (incremental mode)
+              example: 5321
+            truncated_cycle_searches:
+              type: integer
+              description: Per-transaction cycle searches that hit their bound (incremental mode)
+              example: 0
+            rules:
+              type: object
+              description: Hits, milliseconds, thresholds and whether the rule stopped early, per rule (full mode)
+              example: {"huge_amount": {"hits": 1, "ms": 0.4, "params": {"limit_multiplier": 10.0, "absolute_amount": 1000000.0}, "truncated": false}}
+      409:
+        description: An incremental run is already in progress
     """
     now = datetime.utcnow()
-    since = now - timedelta(hours=24)
+    mode = request.args.get("mode", "full")
+    if mode == "incremental":
+        return run_incremental_check(now)
+    if mode != "full":
+        return jsonify({"error": "mode must be full or incremental"}), 400
 
-    # 1️⃣ Get transactions in last 24hrs
-    transactions = (
-        supabase.table("transactions")
-        .select("*")
-        .gte("created_at", since.isoformat())
-        .execute()
-        .data
-    )
+    since = now - timedelta(hours=24)
 
-    # 2️⃣ Get existing flagged transactions
-    flagged = (
-        supabase.table("flagged_transaction")
-        .select("transaction_ids")
-        .gte("created_at", since.isoformat())
-        .execute()
-        .data
-    )
-    already_flagged_ids = set()
-    for f in flagged:
-        already_flagged_ids.update(f["transaction_ids"])  # ✅ f["transaction_ids"] is already list[int]
-
-    new_flags = []
-
-    # 3️⃣ Fraud detection logic
-    # Rule A: Circular money flow
-    by_user_pairs = {}
-    for tx in transactions:
-        key = tuple(sorted([tx["from_user_id"], tx["to_user_id"]]))
-        by_user_pairs.setdefault(key, []).append(tx)
-
-    for pair, txs in by_user_pairs.items():
-        if len(txs) >= 4:  # simple threshold
-            tx_ids = [tx["transaction_id"] for tx in txs]
-            if not set(tx_ids).intersection(already_flagged_ids):
-                new_flags.append(
-                    {
-                        "transaction_ids": tx_ids,  # ✅ no json.dumps, since DB column is int8[]
-                        "created_at": now.isoformat(),
-                        "is_resolved": False,
-                        "reason": f"Circular money flow between users {pair[0]} and {pair[1]}",
-                    }
-                )
-
-    # Rule B: Huge transaction way above trust limit
-    profiles = supabase.table("user_profiles").select("*").execute().data
-    user_limits = {str(p["user_id"]): p["transaction_limit"] for p in profiles}
-
-    for tx in transactions:
-        tx_id = tx["transaction_id"]
-        if tx_id in already_flagged_ids:
-            continue
-        limit = user_limits.get(str(tx["from_user_id"]), 1000)
-        if tx["amount"] > (limit * 10) or tx["amount"] > 1_000_000:
-            new_flags.append(
-                {
-                    "transaction_ids": [tx_id],  # ✅ int list
-                    "created_at": now.isoformat(),
-                    "is_resolved": False,
-                    "reason": f"Huge transaction amount ({tx['amount']})",
-                }
-            )
+    # 1️⃣ Load transactions in last 24hrs + existing flags, and run every enabled rule over them
+    cols, hits, report = evaluate_rules(build_rules(TRANSACTION_RULES), since)
 
-    # Rule C: Multiple pending transactions from User A -> User B within 30mins
-    grouped = defaultdict(list)
-    for tx in transactions:
-        if tx["status"] == "pending":
-            grouped[(tx["from_user_id"], tx["to_user_id"])].append(tx)
-
-    # 3️⃣ Check for >=5 pending within 30min
-    for (from_id, to_id), txs in grouped.items():
-        # sort by created_at
-        txs.sort(key=lambda x: datetime.fromisoformat(x["created_at"].replace("Z", "+00:00")))
-
-        # sliding window
-        window = []
-        for tx in txs:
-            created_at = datetime.fromisoformat(tx["created_at"].replace("Z", "+00:00"))
-            window = [w for w in window if (created_at - w).total_seconds() <= 1800]
-            window.append(created_at)
-
-            if len(window) >= 5:
-                # collect transaction_ids in this window
-                tx_ids = [str(t["transaction_id"]) for t in txs if datetime.fromisoformat(t["created_at"].replace("Z", "+00:00")) in window]
-
-                flagged.append({
-                    "created_at": created_at.isoformat(),
-                    "transaction_ids": tx_ids,   # int[] in Postgres
-                    "is_resolved": False,
-                    "reason": f"Multiple pending transactions from user {from_id} to {to_id}"
-                })
-                break  # stop after first flag for this pair
-
-
-    # 4️⃣ Insert new flagged transactions
+    # 2️⃣ Insert new flagged transactions
+    new_flags = [
+        {
+            "transaction_ids": hit.transaction_ids,  # ✅ int list, since DB column is int8[]
+            "created_at": now.isoformat(),
+            "is_resolved": False,
+            "reason": hit.reason,
+        }
+        for hit in hits
+    ]
+    with metrics.job_phase("check_transactions", "write_flags"):
+        inserted = db.bulk_insert("flagged_transaction", new_flags)
     if new_flags:
-        supabase.table("flagged_transaction").insert(new_flags).execute()
+        response_cache.invalidate("flagged_transaction")
+        dashboard_stats.record_flags(new_flags)
+        event_hub.publish_many("flagged_transaction", inserted)
 
-    return jsonify({"message": "Executed successfully"})
+    return jsonify(
+        {
+            "message": "Executed successfully",
+            "mode": "full",
+            "processed": len(cols),
+            "flagged": len(new_flags),
+            "rules": report["rules"],
+        }
+    )
 
 
+# Rules run by the full check; thresholds come from the env vars read in transaction_checks
+TRANSACTION_RULES = [
+    name.strip() for name in os.getenv("TRANSACTION_RULES", ",".join(RULES)).split(",") if name.strip()
+]
+build_rules(TRANSACTION_RULES)  # fail fast on unknown names
+rule_engine = RuleEngine()
 
-def calculate_transaction_limit(trust: int) -> int:
-    if trust <= 2:
-        return 500 * (2**trust)
-    elif 3 <= trust <= 5:
-        return 20000
-    else:
-        return 20000 * (2 ** ((trust - 5) // 2))
 
+def evaluate_rules(rules, since, until=None, ignore_existing_flags=False, record=True):
+    """
+    Load the window once into columns and run the rules over it. Returns (cols, hits, report).
+    With record=True, phase timings go to the check_transactions job metrics.
+    """
+    job = "check_transactions" if record else "dry_run"
+    filters = [("created_at", "gte", since.isoformat())]
+    if until is not None:
+        filters.append(("created_at", "lte", until.isoformat()))
+    with metrics.job_phase(job, "load_transactions"):
+        cols = TransactionColumns.from_pages(
+            transactions_query.iter_pages(db, transactions_query.columns, filters)
+        )
+    with metrics.job_phase(job, "load_flags"):
+        already_flagged_ids = set() if ignore_existing_flags else load_flagged_ids(since)
+    ctx = RuleContext(cols, already_flagged_ids, fetch_transaction_limits)
+    hits, report = rule_engine.run(rules, ctx, record=record)
+    for grouping, ms in report["groupings"].items():
+        metrics.observe_job_phase(job, f"grouping {grouping}", ms / 1000)
+    for rule, result in report["rules"].items():
+        metrics.observe_job_phase(job, f"rule {rule}", result["ms"] / 1000)
+    return cols, hits, report
+
+
+@transaction_blueprint.route("/rules", methods=["GET"])
+def get_transaction_rules():
+    """
+    List transaction fraud rules
+    ---
+    description: Rules known to the batch check, their thresholds, whether the full check runs them, and cumulative timings and hit counts since startup.
+    tags:
+      - Transaction
+    responses:
+      200:
+        description: Rule definitions and statistics
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              name:
+                type: string
+                example: "pending_burst"
+              description:
+                type: string
+              requires:
+                type: array
+                items:
+                  type: string
+                example: ["pending_by_pair", "already_flagged"]
+              params:
+                type: object
+                example: {"min_count": 5, "window_seconds": 1800}
+              enabled:
+                type: boolean
+              stats:
+                type: object
+                properties:
+                  runs:
+                    type: integer
+                  hits:
+                    type: integer
+                  total_ms:
+                    type: number
+    """
+    stats = rule_engine.stats()
+    return jsonify(
+        [
+            {
+                "name": name,
+                "description": rule.description,
+                "requires": list(rule.requires),
+                "params": rule.defaults,
+                "enabled": name in TRANSACTION_RULES,
+                "stats": stats.get(name, {"runs": 0, "hits": 0, "total_ms": 0.0}),
+            }
+            for name, rule in RULES.items()
+        ]
+    )
 
-@trust_log_blueprint.route("/tabulate_trust", methods=["GET"])
-def recalc_trust_scores():
+
+@transaction_blueprint.route("/rules/dry_run", methods=["POST"])
+def dry_run_transaction_rules():
     """
-    Recalculate trust scores for all users
+    Dry-run transaction fraud rules on historical data
     ---
     description: |
-      Batch process that recalculates trust scores and transaction limits:
-      - Deduct 1 trust point if no login in the past 3 months
-      - Add 1 trust point for yearly account age bonus (if eligible)
-      - Clamp trust score between 0 and 10
-      - Always insert a record in `trust_logs` (even if no change)
-      - Update `transaction_limit` using trust-based formula
-
-      The process is typically scheduled to run every 3 months.
+      Runs rules with optional threshold overrides over a past time range and reports
+      what they would flag. Nothing is written to `flagged_transaction`.
     tags:
-      - Trust
+      - Transaction
+    parameters:
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            since:
+              type: string
+              format: date-time
+              description: Start of the range (default 24 hours ago)
+            until:
+              type: string
+              format: date-time
+              description: End of the range (default now)
+            rules:
+              type: array
+              items:
+                type: string
+              description: Rules to run (default the enabled ones)
+              example: ["pending_burst"]
+            params:
+              type: object
+              description: Threshold overrides per rule
+              example: {"pending_burst": {"min_count": 3}}
+            ignore_existing_flags:
+              type: boolean
+              description: Also report transactions that are already flagged
+              default: false
+            sample:
+              type: integer
+              description: Number of would-be flags to return
+              default: 100
     responses:
       200:
-        description: Trust scores recalculated successfully
+        description: What the rules would flag
         schema:
           type: object
           properties:
-            updated_users:
+            processed:
               type: integer
-              description: Number of users whose trust scores were updated
-              example: 15
-            logs_created:
+              example: 120000
+            flagged:
               type: integer
-              description: Number of trust log entries created
-              example: 15
-            timestamp:
-              type: string
-              format: date-time
-              example: "2025-08-27T15:00:00Z"
-      401:
-        description: Unauthorized – only service/admin can trigger this function
-      500:
-        description: Internal server error
+              example: 42
+            groupings:
+              type: object
+              description: Milliseconds spent building each shared grouping
+            rules:
+              type: object
+              description: Hits, milliseconds, thresholds and whether the rule stopped early, per rule
+            flags:
+              type: array
+              items:
+                type: object
+                properties:
+                  rule:
+                    type: string
+                  transaction_ids:
+                    type: array
+                    items:
+                      type: integer
+                  reason:
+                    type: string
+      400:
+        description: Invalid range, rule name or threshold
     """
-    now = datetime.now(timezone.utc)
-    users = supabase.table("user_profiles").select("*").execute().data
+    data = request.get_json(silent=True) or {}
+    now = datetime.utcnow()
+    try:
+        since, until = data.get("since"), data.get("until")
+        since = datetime.fromisoformat(since.replace("Z", "+00:00")) if since else now - timedelta(hours=24)
+        until = datetime.fromisoformat(until.replace("Z", "+00:00")) if until else None
+        rules = build_rules(data.get("rules") or TRANSACTION_RULES, data.get("params"))
+        sample = int(data.get("sample", 100))
+    except (AttributeError, TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    cols, hits, report = evaluate_rules(
+        rules, since, until, ignore_existing_flags=bool(data.get("ignore_existing_flags")), record=False
+    )
+    return jsonify(
+        {
+            "processed": len(cols),
+            "flagged": len(hits),
+            "groupings": report["groupings"],
+            "rules": report["rules"],
+            "flags": [hit._asdict() for hit in hits[:sample]],
+        }
+    )
 
-    for user in users:
-        user_id = user["user_id"]
-        trust = user["trust_score"]
-        last_login = datetime.fromisoformat(user["last_login"].replace("Z", "+00:00"))
-        created_at = datetime.fromisoformat(user["created_at"].replace("Z", "+00:00"))
 
-        logs = (
-            supabase.table("trust_logs")
-            .select("*")
-            .eq("user_id", user_id)
-            .order("created_at", desc=True)
-            .limit(1)
-            .execute()
-            .data
-        )
-        last_log = logs[0] if logs else None
+# Local state (checker watermark, job checkpoints) defaults to backend/.state, wherever the service is started from
+STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".state")
 
-        change = 0
-        remarks = []
+# Rolling state for mode=incremental, kept in memory and persisted after each run
+TRANSACTION_STATE_PATH = os.getenv("TRANSACTION_STATE_PATH", os.path.join(STATE_DIR, "check_transactions.pkl"))
+incremental_checker = None
+incremental_checker_lock = threading.Lock()
 
-        # 1. Check 3 months inactivity
-        if (now - last_login).days >= 90:
-            change -= 1
-            remarks.append("No login for 3 months (-1)")
 
-        # 2. Check yearly age bonus (if no recent trust events except 0s)
-        account_age_years = (now - created_at).days // 365
-        if account_age_years >= 1:
-            if last_log and last_log["added_trust"] == 0:
-                change += 1
-                remarks.append("Account age yearly bonus (+1)")
+def load_flagged_ids(since):
+    """IDs already part of a flag raised since the given time."""
+    flagged_ids = set()
+    for record in flagged_transactions_query.iter_rows(
+        db, ["flagged_transaction_id", "transaction_ids"], [("created_at", "gte", since.isoformat())]
+    ):
+        flagged_ids.update(record["transaction_ids"])
+    return flagged_ids
 
-        # Ensure trust stays in [0, 10]
-        new_trust = max(0, min(10, trust + change))
 
-        # 3. If no change, log 0
-        if change == 0:
-            remarks.append("No change (0)")
+def fetch_transaction_limits(user_ids):
+    """transaction_limit for just the given users, keyed by str(user_id)."""
+    return {str(user_id): limit for user_id, limit in profile_cache.transaction_limits(user_ids).items()}
 
-        # 4. Update user_profiles
-        supabase.table("user_profiles").update(
-            {
-                "trust_score": new_trust,
-                "transaction_limit": calculate_transaction_limit(new_trust),
-            }
-        ).eq("user_id", user_id).execute()
 
-        # 5. Insert trust_log
-        supabase.table("trust_logs").insert(
-            {
-                "user_id": user_id,
-                "added_trust": change,
-                "remarks": ", ".join(remarks),
-                "created_at": now.isoformat(),
-            }
-        ).execute()
-    return jsonify({"message": "Executed successfully"})
+def run_incremental_check(now):
+    result = incremental_check(now)
+    if result is None:
+        return jsonify({"error": "Incremental check already running"}), 409
+    return jsonify({"message": "Executed successfully", "mode": "incremental", **result})
 
 
-@user_profile_blueprint.route("/verify", methods=["GET"])
-def verify_user():
-    """
-    Verify a user account and update trust score
-    ---
-    description: |
-      Marks a user as verified and updates their trust score **only if the user is not already verified**:
-      - Adds +5 trust points to `user_profiles.trust_score` (max 10)
+def incremental_check(now):
+    """One incremental run; returns its counts, or None if another run holds the lock."""
+    global incremental_checker
+
+    if not incremental_checker_lock.acquire(blocking=False):
+        return None
+    try:
+        if incremental_checker is None:
+            with metrics.job_phase("check_transactions_incremental", "load_state"):
+                incremental_checker = IncrementalTransactionChecker.load(TRANSACTION_STATE_PATH)
+                if incremental_checker.last_run_at is not None:
+                    # A run that crashed after inserting flags but before saving state is
+                    # replayed from the saved watermark; its flags must not be inserted twice
+                    since = datetime.fromisoformat(incremental_checker.last_run_at)
+                    incremental_checker.flagged.update(load_flagged_ids(since))
+        checker = incremental_checker
+        truncated_before = checker.truncated_searches
+
+        columns = transactions_query.columns
+        if checker.watermark is None:
+            # First run: seed from the last 24 hours and the flags already raised on them
+            since = now - timedelta(hours=24)
+            checker.flagged.update(load_flagged_ids(since))
+            pages = transactions_query.iter_pages(db, columns, [("created_at", "gte", since.isoformat())])
+        else:
+            pages = transactions_query.iter_pages(db, columns, [], after_id=checker.watermark)
+
+        processed = 0
+        new_flags = []
+        with metrics.job_phase("check_transactions_incremental", "process"):
+            for page in pages:
+                limits = fetch_transaction_limits(tx["from_user_id"] for tx in page)
+                new_flags.extend(checker.process(page, limits, now))
+                processed += len(page)
+
+        with metrics.job_phase("check_transactions_incremental", "write_flags"):
+            inserted = db.bulk_insert("flagged_transaction", new_flags)
+        if new_flags:
+            response_cache.invalidate("flagged_transaction")
+            dashboard_stats.record_flags(new_flags)
+            event_hub.publish_many("flagged_transaction", inserted)
+
+        with metrics.job_phase("check_transactions_incremental", "save_state"):
+            checker.save(TRANSACTION_STATE_PATH)
+    except Exception:
+        # Drop the in-memory state so the next run resumes from the last saved one
+        incremental_checker = None
+        raise
+    finally:
+        incremental_checker_lock.release()
+
+    return {
+        "processed": processed,
+        "flagged": len(new_flags),
+        "watermark": checker.watermark,
+        "truncated_cycle_searches": checker.truncated_searches - truncated_before,
+    }
+
+
+# Rolling state for /transaction/score, seeded from the last 24 hours on startup
+# Scoring never waits on the database: unknown senders get the default limit while they load
+transaction_scorer = TransactionScorer(
+    profile_cache.cached_transaction_limits, warm_limit_lookup=profile_cache.transaction_limits
+)
+
+
+def warm_transaction_scorer():
+    since = datetime.utcnow() - timedelta(hours=24)
+    try:
+        for page in transactions_query.iter_pages(
+            db, transactions_query.columns, [("created_at", "gte", since.isoformat())]
+        ):
+            transaction_scorer.warm(page)
+    except Exception as e:
+        print(f"Failed to warm transaction scorer: {e}")
+
+
+SCORE_REQUIRED_FIELDS = ("transaction_id", "from_user_id", "to_user_id", "amount", "status")
+
+
+@transaction_blueprint.route("/score", methods=["POST"])
+def score_transaction():
+    """
+    Score transactions in real time
+    ---
+    description: |
+      Evaluates each incoming transaction against in-memory rolling state, without
+      querying the database, using the same rules as `/transaction/check_transactions`:
+      - Circular money flow closed by this transaction
+      - Huge transaction amount way higher than trust limit
+      - Multiple pending transactions from user A to B within 30 mins
+
+      Decisions:
+      - **flag**: a batch rule matches; the next check_transactions run records it in `flagged_transaction`
+      - **review**: softer signals, e.g. close to the limit or to a pending burst, or a spike against the sender's recent amounts
+      - **allow**: nothing suspicious
+
+      The body may be a single transaction or an array of them, in the order they happened.
+      Resubmitting a transaction_id returns its original decision.
+
+      Trust limits come from the in-memory profile cache. A sender whose profile is not cached
+      yet is scored with the default limit, and loaded in the background for later transactions.
+    tags:
+      - Transaction
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required: [transaction_id, from_user_id, to_user_id, amount, status]
+          properties:
+            transaction_id:
+              type: integer
+              example: 5322
+            from_user_id:
+              type: integer
+              example: 12
+            to_user_id:
+              type: integer
+              example: 34
+            amount:
+              type: number
+              example: 250000
+            status:
+              type: string
+              enum: ["pending", "completed", "failed"]
+              example: "pending"
+            created_at:
+              type: string
+              format: date-time
+              description: Defaults to now
+              example: "2025-08-27T15:00:00Z"
+    responses:
+      200:
+        description: Decision per transaction (an array when the body was an array)
+        schema:
+          type: object
+          properties:
+            transaction_id:
+              type: integer
+              example: 5322
+            decision:
+              type: string
+              enum: ["allow", "review", "flag"]
+              example: "flag"
+            reasons:
+              type: array
+              items:
+                type: string
+              example: ["Huge transaction amount (250000)"]
+      400:
+        description: Missing or invalid fields
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              example: "transaction 0: missing amount"
+    """
+    data = request.get_json(silent=True)
+    transactions = data if isinstance(data, list) else [data]
+
+    now = datetime.now(timezone.utc).isoformat()
+    for i, tx in enumerate(transactions):
+        if not isinstance(tx, dict):
+            return jsonify({"error": f"transaction {i}: expected a JSON object"}), 400
+        missing = [field for field in SCORE_REQUIRED_FIELDS if tx.get(field) is None]
+        if missing:
+            return jsonify({"error": f"transaction {i}: missing {', '.join(missing)}"}), 400
+        tx.setdefault("created_at", now)
+        try:
+            int(tx["transaction_id"]), int(tx["from_user_id"]), int(tx["to_user_id"]), float(tx["amount"])
+            parse_epoch(tx["created_at"])
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"transaction {i}: {e}"}), 400
+
+    results = [transaction_scorer.score(tx) for tx in transactions]
+    return jsonify(results if isinstance(data, list) else results[0])
+
+
+# Transaction graph for /transaction/trace, loaded once and then topped up with new transactions
+_trace_days = int(os.getenv("TRACE_INDEX_DAYS", "90"))
+fund_trace_index = FundTraceIndex(retention_seconds=_trace_days * 86400 if _trace_days else None)
+TRACE_MAX_HOPS = int(os.getenv("TRACE_MAX_HOPS", "6"))
+TRACE_MAX_NODES = int(os.getenv("TRACE_MAX_NODES", "5000"))
+
+
+def warm_fund_trace_index():
+    filters = []
+    if fund_trace_index.retention_seconds is not None:
+        since = datetime.now(timezone.utc) - timedelta(seconds=fund_trace_index.retention_seconds)
+        filters.append(("created_at", "gte", since.isoformat()))
+    try:
+        fund_trace_index.load(transactions_query.iter_pages(db, transactions_query.columns, filters))
+    except Exception as e:
+        print(f"Failed to load fund trace index: {e}")
+
+
+def refresh_fund_trace_index():
+    if not fund_trace_index.ready:
+        return  # still loading
+    fund_trace_index.add(
+        transactions_query.iter_pages(
+            db, transactions_query.columns, [], after_id=fund_trace_index.max_transaction_id
+        )
+    )
+
+
+
+@transaction_blueprint.route("/trace/<int:user_id>", methods=["GET"])
+def trace_funds(user_id):
+    """
+    Trace money flows from or to a user over several hops
+    ---
+    description: |
+      Follows a user's money through the transaction graph, from an in-memory index (no database
+      queries per request):
+      - **forward**: who the user paid, who those users paid, ... (where did the money go)
+      - **backward**: who paid the user, who paid them, ... (where did it come from)
+
+      With `time_ordered` (default), a hop only follows transactions made after the money reached
+      that user (before it left, backward), so unrelated older payments are not mistaken for the
+      same funds moving on.
+
+      The result is the subgraph: users with their hop distance and amounts in/out, and one flow per
+      (sender, receiver) pair aggregating their transactions, largest first. When a user has more
+      counterparties than `max_nodes` leaves room for, the largest flows are kept and `truncated` is set.
+
+      The index covers the last `TRACE_INDEX_DAYS` (90) and picks up new transactions every
+      `TRACE_REFRESH_SECONDS` (30). Transaction status is as of when the transaction was indexed.
+    tags:
+      - Transaction
+    parameters:
+      - name: user_id
+        in: path
+        type: integer
+        required: true
+        example: 123
+      - name: direction
+        in: query
+        type: string
+        enum: ["forward", "backward"]
+        default: forward
+      - name: hops
+        in: query
+        type: integer
+        default: 3
+        description: Maximum path length (1 to TRACE_MAX_HOPS, 6 by default)
+      - name: since
+        in: query
+        type: string
+        format: date-time
+        required: false
+        description: Only transactions at or after this time
+      - name: until
+        in: query
+        type: string
+        format: date-time
+        required: false
+        description: Only transactions at or before this time
+      - name: min_amount
+        in: query
+        type: number
+        default: 0
+        description: Ignore smaller transactions
+      - name: time_ordered
+        in: query
+        type: boolean
+        default: true
+      - name: include_failed
+        in: query
+        type: boolean
+        default: false
+      - name: max_nodes
+        in: query
+        type: integer
+        default: 500
+        description: Maximum users in the result (up to TRACE_MAX_NODES)
+    responses:
+      200:
+        description: Traced subgraph
+        schema:
+          type: object
+          properties:
+            user_id:
+              type: integer
+            direction:
+              type: string
+            nodes:
+              type: array
+              items:
+                type: object
+                properties:
+                  user_id:
+                    type: integer
+                  hop:
+                    type: integer
+                  reached_at:
+                    type: string
+                    description: When the traced money first reached this user (forward) or last left it (backward)
+                  amount_in:
+                    type: number
+                  amount_out:
+                    type: number
+            flows:
+              type: array
+              items:
+                type: object
+                properties:
+                  from_user_id:
+                    type: integer
+                  to_user_id:
+                    type: integer
+                  transactions:
+                    type: integer
+                  amount:
+                    type: number
+                  first_at:
+                    type: string
+                  last_at:
+                    type: string
+                  transaction_ids:
+                    type: array
+                    items:
+                      type: integer
+                    description: The first few transactions of the flow
+            truncated:
+              type: boolean
+            took_ms:
+              type: number
+      400:
+        description: Invalid parameter
+      503:
+        description: The index is still loading
+    """
+    direction = request.args.get("direction", "forward")
+    if direction not in ("forward", "backward"):
+        return jsonify({"error": "direction must be forward or backward"}), 400
+    try:
+        hops = int(request.args.get("hops", 3))
+        max_nodes = int(request.args.get("max_nodes", 500))
+        min_amount = float(request.args.get("min_amount", 0))
+        since = parse_epoch(request.args["since"]) if "since" in request.args else None
+        until = parse_epoch(request.args["until"]) if "until" in request.args else None
+        time_ordered = parse_bool(request.args.get("time_ordered", "true"))
+        include_failed = parse_bool(request.args.get("include_failed", "false"))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
+    if not 1 <= hops <= TRACE_MAX_HOPS:
+        return jsonify({"error": f"hops must be between 1 and {TRACE_MAX_HOPS}"}), 400
+    if not 1 <= max_nodes <= TRACE_MAX_NODES:
+        return jsonify({"error": f"max_nodes must be between 1 and {TRACE_MAX_NODES}"}), 400
+    if not fund_trace_index.ready:
+        return jsonify({"error": "Trace index is still loading"}), 503
+
+    started = time.perf_counter()
+    result = fund_trace_index.trace(
+        user_id,
+        forward=direction == "forward",
+        hops=hops,
+        since=since,
+        until=until,
+        min_amount=min_amount,
+        include_failed=include_failed,
+        time_ordered=time_ordered,
+        max_nodes=max_nodes,
+    )
+    result["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(result)
+
+
+@trust_log_blueprint.route("/tabulate_trust", methods=["GET"])
+def recalc_trust_scores():
+    """
+    Recalculate trust scores for all users
+    ---
+    description: |
+      Batch process that recalculates trust scores and transaction limits:
+      - Deduct 1 trust point if no login in the past 3 months
+      - Add 1 trust point for yearly account age bonus (if eligible)
+      - Clamp trust score between 0 and 10
+      - Always insert a record in `trust_logs` (even if no change)
+      - Update `transaction_limit` using trust-based formula
+
+      Users are processed in pages: one query for the page's latest trust logs (those since
+      the previous run, which logged every user; older ones only for users it missed), then one
+      update of `trust_score` and `transaction_limit` per group of changed profiles and a
+      bulk insert of the new logs. An update only applies while the profile still has the
+      trust score that was read; users rescored or verified in the meantime are skipped
+      (no log) and picked up by the next run.
+
+      The process is typically scheduled to run every 3 months. It runs as the sharded
+      `tabulate_trust` background job (see `/jobs`); an interrupted run is resumed from its
+      checkpoints instead of starting over.
+    tags:
+      - Trust
+    parameters:
+      - name: async
+        in: query
+        type: boolean
+        required: false
+        default: false
+        description: Return 202 with the job run id right away instead of waiting for the result
+    responses:
+      200:
+        description: Trust scores recalculated successfully
+        schema:
+          type: object
+          properties:
+            updated_users:
+              type: integer
+              description: Number of users whose trust score or transaction limit changed
+              example: 15
+            logs_created:
+              type: integer
+              description: Number of trust log entries created
+              example: 15
+            skipped_users:
+              type: integer
+              description: Users left alone because their trust score changed during the run
+              example: 0
+            timestamp:
+              type: string
+              format: date-time
+              example: "2025-08-27T15:00:00Z"
+            run_id:
+              type: string
+              example: "20250827T150000-3fa2c1"
+      202:
+        description: Job started (async=true); poll `/jobs/runs/{run_id}`
+      409:
+        description: A trust recalculation is already running
+      401:
+        description: Unauthorized – only service/admin can trigger this function
+      500:
+        description: Internal server error
+    """
+    if request.args.get("async", "false").lower() == "true":
+        run, resumed = job_runner.start("tabulate_trust")
+        if run is None:
+            return jsonify({"error": "Trust recalculation already running"}), 409
+        return jsonify({"run_id": run["run_id"], "status": run["status"], "resumed": resumed}), 202
+
+    run, _ = job_runner.start("tabulate_trust", wait=True)
+    if run is None:
+        return jsonify({"error": "Trust recalculation already running"}), 409
+    if run["status"] != "done":
+        return jsonify({"error": run["error"], "run_id": run["run_id"]}), 500
+    return jsonify({**run["summary"], "run_id": run["run_id"]})
+
+
+# ------------------------------
+# Background jobs
+# ------------------------------
+
+job_runner = JobRunner(
+    os.getenv("JOB_STATE_DIR", os.path.join(STATE_DIR, "jobs")),
+    # Worker processes open their own backend; an in-memory database would not be shared
+    workers=int(os.getenv("JOB_WORKERS", str(min(4, os.cpu_count() or 1) if db.shared_across_processes else 1))),
+    # Finished runs kept on disk per job (with the default 60s check interval, about 100 minutes)
+    keep_runs=int(os.getenv("JOB_KEEP_RUNS", "100")),
+)
+
+
+def plan_trust_shards(params):
+    """
+    Split the user_id keyspace into JOB_SHARDS ranges; the outer ones are open-ended.
+    The previous run's time is passed on as since, so shards only read trust logs from then on.
+    """
+    params.setdefault("now", datetime.now(timezone.utc).isoformat())
+    if "since" not in params:
+        # Planned before this run is recorded, so the latest run is the previous (finished) one
+        previous = job_runner.latest_run("tabulate_trust")
+        params["since"] = previous["params"]["now"] if previous else None
+    shard_count = int(os.getenv("JOB_SHARDS", "8"))
+    first = db.table("user_profiles").select("user_id").order("user_id").limit(1).execute().data
+    last = db.table("user_profiles").select("user_id").order("user_id", desc=True).limit(1).execute().data
+    bounds = [None, None]
+    if first:
+        lo, hi = first[0]["user_id"], last[0]["user_id"] + 1
+        step = max(1, -(-(hi - lo) // shard_count))
+        bounds = [None] + list(range(lo + step, hi, step)) + [None]
+    return [
+        {"lo": lo, "hi": hi, "processed": 0, "updated": 0}
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def finish_trust_job(run, shards):
+    response_cache.invalidate("user_profiles", "trust_logs")
+    # The shards wrote profiles from worker processes: reload them all
+    profile_cache.invalidate()
+    start_background("warm-profile-cache", warm_profile_cache)
+    moves, added = Counter(), Counter()
+    for shard in shards:
+        for move, users in shard.get("trust_moves", {}).items():
+            old, new = move.split(">")
+            moves[int(old), int(new)] += users
+        for change, logs in shard.get("trust_added", {}).items():
+            added[int(change)] += logs
+    dashboard_stats.record_trust_moves(moves, run["params"]["now"])
+    dashboard_stats.record_trust_changes(added, run["params"]["now"])
+    summary = {
+        "updated_users": sum(shard["updated"] for shard in shards),
+        "logs_created": sum(shard["processed"] for shard in shards),
+        "skipped_users": sum(shard.get("skipped", 0) for shard in shards),
+        "timestamp": run["params"]["now"],
+    }
+    # One event per run rather than per user: clients re-fetch the trust lists
+    event_hub.publish("trust_recalculated", summary)
+    return summary
+
+
+def run_transaction_check_shard(checkpoint, shard):
+    result = incremental_check(datetime.utcnow())
+    if result is None:
+        raise RuntimeError("Incremental check already running")
+    shard["processed"] += result["processed"]
+    shard["flagged"] += result["flagged"]
+    shard["truncated_cycle_searches"] = shard.get("truncated_cycle_searches", 0) + result["truncated_cycle_searches"]
+    shard["cursor"] = result["watermark"]
+    checkpoint.save_shard(shard)
+    return shard
+
+
+job_runner.register(
+    Job(
+        "tabulate_trust",
+        plan_trust_shards,
+        run_trust_shard,
+        finish=finish_trust_job,
+        interval_seconds=int(os.getenv("TRUST_JOB_INTERVAL_SECONDS", "0")),
+    )
+)
+# The fraud rules look across users (cycles, pairs), so the transaction keyspace is not
+# split; the incremental check is a single shard that checkpoints its own watermark
+job_runner.register(
+    Job(
+        "check_transactions",
+        lambda params: [{"processed": 0, "flagged": 0, "truncated_cycle_searches": 0}],
+        run_transaction_check_shard,
+        finish=lambda run, shards: {"processed": shards[0]["processed"], "flagged": shards[0]["flagged"],
+                                    "truncated_cycle_searches": shards[0]["truncated_cycle_searches"],
+                                    "watermark": shards[0]["cursor"]},
+        interval_seconds=int(os.getenv("TRANSACTION_JOB_INTERVAL_SECONDS", "60")),
+        in_process=True,
+    )
+)
+
+
+@job_blueprint.route("", methods=["GET"])
+def list_jobs():
+    """
+    List background jobs
+    ---
+    description: Registered jobs, their schedule and their most recent runs.
+    tags:
+      - Jobs
+    responses:
+      200:
+        description: Jobs with recent runs
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              name:
+                type: string
+                example: "tabulate_trust"
+              interval_seconds:
+                type: integer
+                description: Scheduler interval, 0 if only started on demand
+                example: 0
+              running:
+                type: boolean
+                description: Running in this process
+              runs:
+                type: array
+                items:
+                  type: object
+    """
+    return jsonify(
+        [
+            {
+                "name": name,
+                "interval_seconds": job.interval_seconds,
+                "running": job_runner.is_running(name),
+                "runs": job_runner.runs(name, limit=request.args.get("limit", 5, type=int)),
+            }
+            for name, job in job_runner.jobs.items()
+        ]
+    )
+
+
+@job_blueprint.route("/runs/<run_id>", methods=["GET"])
+def get_job_run(run_id):
+    """
+    Get the status of a job run
+    ---
+    tags:
+      - Jobs
+    parameters:
+      - name: run_id
+        in: path
+        type: string
+        required: true
+        example: "20250827T150000-3fa2c1"
+    responses:
+      200:
+        description: Run status with per-shard progress
+        schema:
+          type: object
+          properties:
+            run_id:
+              type: string
+            job:
+              type: string
+              example: "tabulate_trust"
+            status:
+              type: string
+              enum: ["pending", "running", "done", "failed"]
+            shards_done:
+              type: integer
+              example: 6
+            shard_count:
+              type: integer
+              example: 8
+            shards:
+              type: array
+              items:
+                type: object
+                properties:
+                  index:
+                    type: integer
+                  status:
+                    type: string
+                  lo:
+                    type: integer
+                  hi:
+                    type: integer
+                  cursor:
+                    type: integer
+                    description: Last key processed
+                  processed:
+                    type: integer
+            summary:
+              type: object
+            error:
+              type: string
+      404:
+        description: Run not found
+    """
+    run = job_runner.status(run_id)
+    if run is None:
+        return jsonify({"error": "Run not found"}), 404
+    return jsonify(run)
+
+
+@job_blueprint.route("/<name>/start", methods=["POST"])
+def start_job(name):
+    """
+    Start or resume a background job
+    ---
+    description: Starts a new run, or resumes the latest run if it did not finish. Only one run of a job is active at a time.
+    tags:
+      - Jobs
+    parameters:
+      - name: name
+        in: path
+        type: string
+        required: true
+        enum: ["tabulate_trust", "check_transactions"]
+    responses:
+      202:
+        description: Run started or resumed
+        schema:
+          type: object
+          properties:
+            run_id:
+              type: string
+            status:
+              type: string
+            resumed:
+              type: boolean
+      404:
+        description: Unknown job
+      409:
+        description: The job is already running
+    """
+    if name not in job_runner.jobs:
+        return jsonify({"error": "Unknown job"}), 404
+    run, resumed = job_runner.start(name)
+    if run is None:
+        return jsonify({"error": f"{name} is already running"}), 409
+    return jsonify({"run_id": run["run_id"], "status": run["status"], "resumed": resumed}), 202
+
+
+@user_profile_blueprint.route("/verify", methods=["GET"])
+async def verify_user():
+    """
+    Verify a user account and update trust score
+    ---
+    description: |
+      Marks a user as verified and updates their trust score **only if the user is not already verified**:
+      - Adds +5 trust points to `user_profiles.trust_score` (max 10)
       - Updates `is_verified` flag to True
       - Inserts a trust log in `trust_logs` table with remarks "Verified account (+5)"
       - If user is already verified, no trust points are added
 
+      The profile is read from the shared profile cache; the update only applies if the
+      profile is still unverified with the trust score that was read, so a stale cache
+      entry or a concurrent verification cannot add the +5 twice.
+
       **Note:** This GET endpoint modifies data for demonstration purposes. Normally a POST/PUT is recommended.
     tags:
       - User
@@ -804,55 +2471,420 @@ def verify_user():
               example: "User already verified, no trust points added"
       404:
         description: User not found
+      409:
+        description: The profile kept changing while it was being verified; retry
       401:
         description: Unauthorized – only admin/service can trigger
       500:
         description: Internal server error
     """
     user_id = request.args.get("user_id", type=int)
-    now = datetime.now(timezone.utc)
-    # 1. Fetch user
-    user = (
-        supabase.table("user_profiles")
-        .select("*")
-        .eq("user_id", user_id)
-        .execute()
-        .data
-    )
-    if not user:
+    if user_id is None:
         return {"error": "User not found"}, 404
-    user = user[0]
-
-    # 2. Check if already verified
-    if user["is_verified"]:
-        return {
-            "user_id": user_id,
-            "new_trust": user["trust_score"],
-            "verified": True,
-            "message": "User already verified, no trust points added",
-        }
+    now = datetime.now(timezone.utc)
+    for _ in range(2):
+        # 1. Fetch user (from the profile cache; loaded off the loop on a miss)
+        user = profile_cache.peek(user_id) or await storage.call(profile_cache.get, user_id)
+        if user is None:
+            return {"error": "User not found"}, 404
+
+        # 2. Check if already verified
+        if user.is_verified:
+            return {
+                "user_id": user_id,
+                "new_trust": user.trust_score,
+                "verified": True,
+                "message": "User already verified, no trust points added",
+            }
 
-    # 3. Update trust score (+5), clamp to 10 max
-    new_trust = min(10, user["trust_score"] + 5)
+        # 3. Update trust score (+5), clamp to 10 max
+        new_trust = min(10, user.trust_score + 5)
 
-    # 4. Mark user verified
-    supabase.table("user_profiles").update(
-        {"trust_score": new_trust, "is_verified": True}
-    ).eq("user_id", user_id).execute()
+        # 4. Mark user verified, only if the profile is still the one read above
+        updated = await storage.execute(
+            db.table("user_profiles")
+            .update({"trust_score": new_trust, "is_verified": True})
+            .eq("user_id", user_id)
+            .eq("is_verified", False)
+            .eq("trust_score", user.trust_score)
+        )
+        if updated.data:
+            break
+        # Changed since it was cached (verified or rescored elsewhere): read it again
+        profile_cache.invalidate(user_id)
+    else:
+        return {"error": "Profile changed while verifying, try again"}, 409
 
     # 5. Log into trust_logs
-    supabase.table("trust_logs").insert(
+    await storage.execute(
+        db.table("trust_logs").insert(
+            {
+                "user_id": user_id,
+                "added_trust": 5,
+                "remarks": "Verified account (+5)",
+                "created_at": now.isoformat(),
+            }
+        )
+    )
+
+    profile_cache.update(user_id, trust_score=new_trust, is_verified=True)
+    response_cache.invalidate("user_profiles", "trust_logs")
+    dashboard_stats.record_trust_move(user_id, user.trust_score, new_trust, now)
+    dashboard_stats.record_trust_changes({5: 1}, now)
+    event_hub.publish(
+        "trust_change",
         {
             "user_id": user_id,
+            "old_trust": user.trust_score,
+            "new_trust": new_trust,
             "added_trust": 5,
             "remarks": "Verified account (+5)",
             "created_at": now.isoformat(),
-        }
-    ).execute()
+        },
+    )
 
     return {"user_id": user_id, "new_trust": new_trust, "verified": True}
 
 
+# ------------------------------
+# Dashboard Stats
+# ------------------------------
+
+
+@stats_blueprint.route("/summary", methods=["GET"])
+def get_stats_summary():
+    """
+    Dashboard summary over a time range
+    ---
+    description: |
+      Aggregates for the admin dashboard, read from counters the write paths keep up to date
+      (no rows are scanned, so any range costs the same). The range is widened to whole UTC
+      hours: `from` is rounded down and `to` up.
+      - logins and suspicious logins (by country) from `ip_logs`
+      - flagged transactions by rule, and how many are still unresolved
+      - the trust score histogram at the end of the range, and trust log entries by change
+    tags:
+      - Stats
+    parameters:
+      - name: from
+        in: query
+        type: string
+        format: date-time
+        required: false
+        description: Start of the range (ISO 8601). Defaults to 24 hours before `to`.
+      - name: to
+        in: query
+        type: string
+        format: date-time
+        required: false
+        description: End of the range (ISO 8601). Defaults to now.
+    responses:
+      200:
+        description: Aggregates for the range
+        schema:
+          type: object
+          properties:
+            from:
+              type: string
+            to:
+              type: string
+            hours:
+              type: integer
+            logins:
+              type: object
+              properties:
+                total:
+                  type: integer
+                suspicious:
+                  type: integer
+                suspicious_by_country:
+                  type: object
+                  example: {"US": 12, "Unknown": 3}
+            flagged_transactions:
+              type: object
+              properties:
+                total:
+                  type: integer
+                by_reason:
+                  type: object
+                  example: {"circular_flow": 4, "huge_amount": 9}
+                unresolved:
+                  type: integer
+                  description: Flags raised in the range that are still unresolved
+                unresolved_by_reason:
+                  type: object
+                unresolved_all_time:
+                  type: integer
+                  description: Unresolved flags raised up to the end of the range
+            trust:
+              type: object
+              properties:
+                histogram:
+                  type: object
+                  description: Users per trust score
+                  example: {"0": 40, "5": 310, "10": 25}
+                changes:
+                  type: object
+                  description: Trust log entries per added_trust
+                  example: {"-1": 6, "1": 120, "5": 14}
+      400:
+        description: Invalid timestamp
+    """
+    try:
+        end = parse_epoch(request.args["to"]) if "to" in request.args else datetime.now(timezone.utc).timestamp()
+        start = parse_epoch(request.args["from"]) if "from" in request.args else end - 24 * 3600
+    except (TypeError, ValueError):
+        return jsonify({"error": "from and to must be ISO 8601 timestamps"}), 400
+    if start >= end:
+        return jsonify({"error": "from must be before to"}), 400
+    # Round up so the hour containing `to` is included
+    return jsonify(dashboard_stats.summary(start, end + 3599))
+
+
+# ------------------------------
+# Event Stream
+# ------------------------------
+
+EVENT_KINDS = ("suspicious_login", "login_marked_safe", "suspicious_ip", "ip_marked_safe", "flagged_transaction",
+               "flag_resolved", "trust_change", "trust_recalculated")
+
+
+@events_blueprint.route("/stream", methods=["GET"])
+def stream_events():
+    """
+    Stream new suspicious activity (server-sent events)
+    ---
+    description: |
+      A `text/event-stream` of changes as they are written, instead of polling the list endpoints.
+      Event types (`event:` field), each with the written row or a summary as JSON `data`:
+      - `suspicious_login`: a new `ip_logs` row with is_suspicious = true
+      - `login_marked_safe`: `{"id": ...}` of an IP log marked safe
+      - `suspicious_ip`: a `current_connected_ip` row over the shared-IP threshold, when its users change
+      - `ip_marked_safe`: `{"ip_address": ...}` of a shared IP a moderator cleared
+      - `flagged_transaction`: a new `flagged_transaction` row
+      - `flag_resolved`: `{"flagged_transaction_id": ...}` of a flag resolved by a moderator
+      - `trust_change`: a user's trust changed outside the batch job (e.g. verification)
+      - `trust_recalculated`: a tabulate_trust run finished (counts only; re-fetch the trust lists)
+      - `reset`: the stream could not be resumed from Last-Event-ID (restart, or too far behind); re-fetch
+
+      Every event has an `id:`. A reconnecting `EventSource` sends the last one as `Last-Event-ID` and
+      receives what it missed, up to the last `EVENTS_HISTORY` events. A client that falls more than
+      `EVENTS_CLIENT_BUFFER` events behind is disconnected and catches up on reconnect. A comment line is sent
+      every `EVENTS_KEEPALIVE_SECONDS` (15) while quiet.
+
+      Events are fanned out within this process: behind several processes, route a client to one of them.
+    tags:
+      - Events
+    produces:
+      - text/event-stream
+    parameters:
+      - name: types
+        in: query
+        type: string
+        required: false
+        description: Comma-separated event types to receive (default all)
+        example: suspicious_login,flagged_transaction
+      - name: Last-Event-ID
+        in: header
+        type: string
+        required: false
+        description: Resume after this event id (sent automatically by EventSource on reconnect)
+      - name: last_event_id
+        in: query
+        type: string
+        required: false
+        description: Same as the Last-Event-ID header, for clients that cannot set headers
+    responses:
+      200:
+        description: Event stream
+      400:
+        description: Unknown event type
+      503:
+        description: Too many stream clients connected
+    """
+    kinds = None
+    if request.args.get("types"):
+        kinds = {kind.strip() for kind in request.args["types"].split(",") if kind.strip()}
+        unknown = kinds - set(EVENT_KINDS)
+        if unknown:
+            return jsonify({"error": f"Unknown event types: {', '.join(sorted(unknown))}"}), 400
+
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    subscribed = event_hub.subscribe(kinds, last_event_id)
+    if subscribed is None:
+        return jsonify({"error": "Too many event stream clients"}), 503
+
+    subscription = subscribed[0]
+    body = event_stream(*subscribed, keepalive_seconds=float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15")))
+    response = Response(
+        body, mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Also when the body is never iterated (the generator's own cleanup only runs once started)
+    response.call_on_close(subscription.close)
+    return response
+
+
+# ------------------------------
+# Columnar Export
+# ------------------------------
+
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "4"))
+_export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+@export_blueprint.route("/<table>", methods=["GET"])
+def export_table(table):
+    """
+    Export a table as Parquet or Arrow IPC
+    ---
+    description: |
+      Streams every matching row of `ip_logs`, `transactions` or `trust_logs` as one Parquet file or
+      Arrow IPC stream, for analysis ranges too large for the JSON list endpoints. The table is read
+      in key order one page at a time and written out one row group (`EXPORT_ROW_GROUP_ROWS`, 65536)
+      at a time, so the export is never held in memory.
+
+      Columns are typed: timestamps are int64 microseconds since the epoch (timestamp[us, UTC]),
+      IP addresses binary (packed 4 or 16 bytes), ids int64, amounts float64.
+
+      At most `EXPORT_MAX_CONCURRENT` (4) exports run at once. The same export is available from the
+      command line: `python backend/columnar_export.py <table> -o <file>`.
+    tags:
+      - Export
+    produces:
+      - application/vnd.apache.parquet
+      - application/vnd.apache.arrow.stream
+    parameters:
+      - name: table
+        in: path
+        type: string
+        required: true
+        enum: ["ip_logs", "transactions", "trust_logs"]
+      - name: format
+        in: query
+        type: string
+        enum: ["parquet", "arrow"]
+        required: false
+        default: parquet
+        description: parquet, or arrow for an Arrow IPC stream (pyarrow.ipc.open_stream)
+      - name: compression
+        in: query
+        type: string
+        enum: ["zstd", "snappy", "gzip", "lz4", "none"]
+        required: false
+        default: zstd
+        description: Column compression (arrow supports zstd, lz4 and none)
+      - $ref: '#/parameters/columns'
+      - $ref: '#/parameters/since'
+      - $ref: '#/parameters/until'
+      - $ref: '#/parameters/after_id'
+      - name: until_id
+        in: query
+        type: integer
+        required: false
+        description: Only rows whose key is at most this (with after_id, one key range of a split export)
+    responses:
+      200:
+        description: The exported file
+      400:
+        description: Unknown column, format or compression, or an invalid filter
+      404:
+        description: Not an exportable table
+      503:
+        description: Too many exports running
+    """
+    try:
+        params = parse_export(table, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400 if table in EXPORT_TABLES else 404
+
+    if not _export_slots.acquire(blocking=False):
+        return jsonify({"error": "Too many exports running"}), 503
+
+    body = columnar_export(
+        db, table, params, row_group_rows=int(os.getenv("EXPORT_ROW_GROUP_ROWS", "65536"))
+    )
+    filename = f"{table}{EXTENSIONS[params['format']]}"
+    response = Response(
+        body,
+        mimetype=MEDIA_TYPES[params["format"]],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"},
+    )
+    # Released when the response is closed: finished, abandoned, or never iterated
+    response.call_on_close(_export_slots.release)
+    return response
+
+
+# ------------------------------
+# Metrics
+# ------------------------------
+
+
+def collect_component_stats():
+    """Counters the components keep themselves, read at scrape time."""
+    geo = geo_resolver.stats()
+    buffer = ip_log_buffer.stats()
+    cache = response_cache.stats()
+    scorer = transaction_scorer.stats()
+    events = event_hub.stats()
+    trace = fund_trace_index.stats()
+    profiles = profile_cache.stats()
+    return [
+        ("antifraud_geoip_cache_hits_total", "counter", "GeoIP lookups served from the LRU", [({}, geo["hits"])]),
+        ("antifraud_geoip_cache_misses_total", "counter", "GeoIP lookups read from the mmdb", [({}, geo["misses"])]),
+        ("antifraud_write_behind_pending_rows", "gauge", "Rows buffered for bulk insert",
+         [({"buffer": buffer["name"]}, buffer["pending"])]),
+        ("antifraud_write_behind_flushed_rows_total", "counter", "Rows written by the write-behind buffer",
+         [({"buffer": buffer["name"]}, buffer["flushed"])]),
+        ("antifraud_write_behind_dropped_rows_total", "counter", "Rows the write-behind buffer failed to write",
+         [({"buffer": buffer["name"]}, buffer["dropped"])]),
+        ("antifraud_response_cache_hits_total", "counter", "Dashboard reads served from the response cache",
+         [({}, cache["hits"])]),
+        ("antifraud_response_cache_misses_total", "counter", "Dashboard reads that went to storage",
+         [({}, cache["misses"])]),
+        ("antifraud_profile_cache_size", "gauge", "Profiles held by the profile cache", [({}, profiles["size"])]),
+        ("antifraud_profile_cache_hits_total", "counter", "Profile reads served from the profile cache",
+         [({}, profiles["hits"])]),
+        ("antifraud_profile_cache_misses_total", "counter", "Profile reads that went to storage",
+         [({}, profiles["misses"])]),
+        ("antifraud_transactions_scored_total", "counter", "Transactions scored by /transaction/score",
+         [({"decision": decision}, count) for decision, count in scorer["decisions"].items()]),
+        ("antifraud_trace_index_edges", "gauge", "Transactions in the /transaction/trace index",
+         [({}, trace["edges"])]),
+        ("antifraud_event_stream_clients", "gauge", "Connected /events/stream clients", [({}, events["clients"])]),
+        ("antifraud_events_published_total", "counter", "Events published to /events/stream",
+         [({}, events["published"])]),
+        ("antifraud_event_stream_dropped_clients_total", "counter", "Stream clients disconnected for falling behind",
+         [({}, events["dropped_clients"])]),
+    ]
+
+
+metrics.registry.add_collector(collect_component_stats)
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Prometheus metrics
+    ---
+    description: |
+      Service metrics in the Prometheus text format:
+      - request latency histograms and status counts per route, for every blueprint
+      - storage calls, rows and latency per table and operation
+      - GeoIP lookup time, and cache and write-behind counters
+      - batch job phase durations (tabulate_trust, check_transactions, ...)
+
+      Set `SLOW_REQUEST_MS` to also log requests slower than that with a per-stage breakdown.
+    tags:
+      - Monitoring
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Metrics in the Prometheus text exposition format
+    """
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 # ------------------------------
 # Register Blueprints & Run App
 # ------------------------------
@@ -861,6 +2893,32 @@ app.register_blueprint(ip_blueprint, url_prefix="/ip")
 app.register_blueprint(trust_log_blueprint, url_prefix="/trust_log")
 app.register_blueprint(user_profile_blueprint, url_prefix="/user")
 app.register_blueprint(transaction_blueprint, url_prefix="/transaction")
+app.register_blueprint(job_blueprint, url_prefix="/jobs")
+app.register_blueprint(stats_blueprint, url_prefix="/stats")
+app.register_blueprint(events_blueprint, url_prefix="/events")
+app.register_blueprint(export_blueprint, url_prefix="/export")
+
+
+def start_background_work():
+    """Warm the in-memory state, then keep it fresh and run the scheduled jobs."""
+    geo_resolver.reload(force=True)
+    start_background("warm-recent-logins", warm_recent_logins)
+    start_background("warm-shared-ips", warm_shared_ips)
+    start_background("warm-dashboard-stats", warm_dashboard_stats)
+    start_background("warm-profile-cache", warm_profile_cache)
+    start_background("warm-transaction-scorer", warm_transaction_scorer)
+    start_background("warm-fund-trace", warm_fund_trace_index)
+    start_periodic("compact-shared-ips", float(os.getenv("SHARED_IP_COMPACT_SECONDS", "10")), compact_shared_ips)
+    start_periodic("sweep-profile-cache", profile_cache.ttl, profile_cache.sweep)
+    start_periodic("refresh-fund-trace", float(os.getenv("TRACE_REFRESH_SECONDS", "30")), refresh_fund_trace_index)
+    job_runner.start_scheduler(float(os.getenv("JOB_SCHEDULER_POLL_SECONDS", "30")))
+
+
+# Job runner workers are spawned, and re-import this module as __mp_main__ when the
+# service is run as a script. They only run the shard they were given: no warm-ups,
+# no periodic tasks and no scheduler of their own.
+if __name__ != "__mp_main__":
+    start_background_work()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080)
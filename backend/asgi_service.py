@@ -0,0 +1,228 @@
+"""
+ASGI serving mode for the anti-fraud service:
+
+    cd backend && uvicorn asgi_service:app --host 0.0.0.0 --port 8080
+
+Serves the same Flask app (blueprints, routes, Swagger UI at /apidocs) on
+an event loop instead of a thread per request:
+
+- async views (the storage-bound ones, e.g. /user/verify) are awaited on
+  the loop; their queries go through the non-blocking `storage` backend,
+  with independent queries in flight together
+- views answered from in-memory state (INLINE_ENDPOINTS, e.g. /ip/ipcheck)
+  run directly on the loop, so thousands of in-flight login checks need no
+  thread each; they must never block, e.g. /ip/ipcheck answers 503 instead
+  of waiting when its write-behind buffer is full
+- every other view runs on a bounded thread pool (ASGI_THREADS), as it would
+  under a WSGI server
+- long-lived streams (STREAM_ENDPOINTS: /events/stream, /export) are read on
+  their own pool, so connected dashboards and running exports never hold the
+  view threads, and are closed as soon as the client disconnects
+
+`python anti_fraud_service.py` still serves the app synchronously.
+"""
+
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from inspect import iscoroutinefunction
+
+from flask import request
+from werkzeug.exceptions import HTTPException
+
+import anti_fraud_service
+
+# Views that only touch in-memory indexes and buffers: cheaper to run on the loop than to hand off
+INLINE_ENDPOINTS = {"ip.log_ip", "ip.get_shared_ips", "ip.get_prefix_stats"}
+# Responses that stay open: one stream thread each, waiting for the next event or export page
+STREAM_ENDPOINTS = {"events.stream_events", "export.export_table"}
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope and its (already read) body."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+class AsyncFlask:
+    """ASGI application around a Flask app; see the module docstring for how views are run."""
+
+    def __init__(self, flask_app, inline_endpoints=(), threads=32, stream_endpoints=(), stream_threads=100):
+        self.flask_app = flask_app
+        self.inline_endpoints = set(inline_endpoints)
+        self.stream_endpoints = set(stream_endpoints)
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi-view")
+        self.stream_executor = ThreadPoolExecutor(stream_threads, thread_name_prefix="asgi-stream")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError(f"unsupported ASGI scope type {scope['type']!r}")
+
+        body = await read_body(receive)
+        if body is None:
+            return  # client went away before sending the whole request
+        environ = build_environ(scope, body)
+        endpoint = self._endpoint(environ)
+        view = self.flask_app.view_functions.get(endpoint)
+
+        if view is not None and iscoroutinefunction(view):
+            response = await self._dispatch_async(environ, view)
+            await self._send_wsgi(send, lambda start_response: response(environ, start_response), inline=True)
+        elif endpoint in self.stream_endpoints:
+            await self._send_stream(receive, send, lambda start_response: self.flask_app(environ, start_response))
+        else:
+            await self._send_wsgi(
+                send,
+                lambda start_response: self.flask_app(environ, start_response),
+                inline=endpoint in self.inline_endpoints,
+            )
+
+    def _endpoint(self, environ):
+        try:
+            endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None  # 404/405 and redirects are left to Flask
+        return endpoint
+
+    async def _dispatch_async(self, environ, view):
+        """Flask's request handling (hooks, error handlers, CORS) around an awaited view."""
+        app = self.flask_app
+        ctx = app.request_context(environ)
+        error = None
+        ctx.push()  # context-local, so concurrent requests on the loop stay apart
+        try:
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await view(**request.view_args)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            return app.finalize_request(rv)
+        except Exception as e:
+            error = e
+            return app.handle_exception(e)
+        finally:
+            ctx.pop(error)
+
+    async def _send_stream(self, receive, send, call):
+        """_send_wsgi on the stream pool, stopped once the client disconnects."""
+        disconnected = asyncio.Event()
+
+        async def watch():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await self._send_wsgi(send, call, inline=False, executor=self.stream_executor, stop=disconnected)
+        finally:
+            watcher.cancel()
+
+    async def _send_wsgi(self, send, call, inline, executor=None, stop=None):
+        """
+        Run a WSGI callable, on the loop or on a thread pool, and stream its
+        response; stop (an asyncio.Event) ends the stream after the current chunk.
+        """
+        loop = asyncio.get_running_loop()
+        executor = executor or self.executor
+
+        async def run(fn, *args):
+            if inline:
+                return fn(*args)
+            return await loop.run_in_executor(executor, fn, *args)
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]
+
+        iterable = await run(call, start_response)
+        try:
+            iterator = iter(iterable)
+            # start_response may only be called once the first chunk is produced
+            chunk = await run(next, iterator, None)
+            await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+            while chunk is not None and not (stop is not None and stop.is_set()):
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await run(next, iterator, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                await run(close)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # Buffered ip_logs rows would otherwise only be written at interpreter exit
+                await asyncio.get_running_loop().run_in_executor(
+                    self.executor, anti_fraud_service.ip_log_buffer.flush
+                )
+                self.executor.shutdown(wait=False)
+                self.stream_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+app = AsyncFlask(
+    anti_fraud_service.app,
+    inline_endpoints=INLINE_ENDPOINTS,
+    threads=int(os.getenv("ASGI_THREADS", "32")),
+    stream_endpoints=STREAM_ENDPOINTS,
+    # One per stream; /events/stream and /export turn clients away past their limits
+    stream_threads=int(os.getenv("EVENTS_MAX_CLIENTS", "100")) + anti_fraud_service.EXPORT_MAX_CONCURRENT,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=8080)
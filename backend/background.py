@@ -0,0 +1,33 @@
+"""
+Small helpers for background work in the anti-fraud service.
+"""
+
+import threading
+import time
+
+
+def start_background(name, fn):
+    """Run fn once on a daemon thread (e.g. warming in-memory state on startup)."""
+    threading.Thread(target=fn, name=name, daemon=True).start()
+
+
+def start_periodic(name, interval_seconds, fn):
+    """
+    Run fn every interval_seconds on a daemon thread.
+
+    Exceptions are printed and the loop keeps going, so one failed Supabase
+    call does not stop compaction/flushing for the life of the process.
+    Returns a threading.Event that stops the loop when set.
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval_seconds):
+            started = time.monotonic()
+            try:
+                fn()
+            except Exception as e:
+                print(f"[{name}] periodic task failed after {time.monotonic() - started:.2f}s: {e}")
+
+    threading.Thread(target=loop, name=name, daemon=True).start()
+    return stop
@@ -0,0 +1,514 @@
+"""
+Load test and benchmark for the anti-fraud API.
+
+Generates a synthetic data set (users with trust history, login sessions
+with shared and hopping IPs, and a day of transactions with planted rings,
+pending bursts and huge amounts), loads it into the local SQLite storage
+backend and drives the endpoints in-process through the Flask test client:
+
+- /ip/ipcheck from concurrent clients
+- /transaction/check_transactions (full mode), reporting recall of the planted patterns
+- /trust_log/tabulate_trust
+
+For every scenario it reports throughput, latency percentiles, memory and
+storage round trips per request (from the backend's query stats). Results
+can be saved as a named baseline and later runs compared against it:
+
+    python backend/benchmark.py --scale small --save-baseline main
+    python backend/benchmark.py --scale small --compare main
+
+benchmark_baselines/main.json is the committed baseline for the default
+(small) scale. Timings depend on the machine: save a local baseline before
+comparing on different hardware; round trips per request do not.
+
+Each simulated client logs in from its own address (LOGIN_IP_OVERRIDE is
+ignored), so /ip/ipcheck is measured across many IPs and users, with some
+shared and hopping ones, rather than on one hot IP.
+
+The service is always pointed at an in-memory SQLite database and a
+temporary state directory, never at the configured Supabase project.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baselines")
+
+SCALES = {
+    "small": {"users": 1_000, "transactions": 20_000, "logins": 5_000, "rings": 20, "bursts": 20, "huge": 20},
+    "medium": {"users": 10_000, "transactions": 200_000, "logins": 50_000, "rings": 100, "bursts": 100, "huge": 100},
+    "large": {"users": 100_000, "transactions": 1_000_000, "logins": 200_000, "rings": 500, "bursts": 500, "huge": 500},
+}
+
+SCENARIOS = ("ipcheck", "check_transactions", "tabulate_trust")
+
+# Metric -> True if higher is better, for baseline comparisons
+COMPARED_METRICS = {
+    "throughput_rps": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "round_trips_per_request": False,
+    "peak_memory_mb": False,
+}
+
+
+# ------------------------------
+# Synthetic data
+# ------------------------------
+
+
+def _ip(n):
+    return f"{10 + n // 65536 % 200}.{n // 256 % 256}.{n % 256}.{1 + n % 250}"
+
+
+class Dataset:
+    """Rows for user_profiles, trust_logs and transactions, plus logins and what was planted."""
+
+    def __init__(self, users, trust_logs, transactions, logins, planted):
+        self.users = users
+        self.trust_logs = trust_logs
+        self.transactions = transactions
+        self.logins = logins  # (user_id, ip_address) in request order
+        self.planted = planted  # {"rings": [[tx_id, ...]], "bursts": [[tx_id, ...]], "huge": [tx_id]}
+
+    def describe(self):
+        return {
+            "users": len(self.users),
+            "trust_logs": len(self.trust_logs),
+            "transactions": len(self.transactions),
+            "logins": len(self.logins),
+            **{f"planted_{kind}": len(items) for kind, items in self.planted.items()},
+        }
+
+
+def generate(users, transactions, logins, rings, bursts, huge, seed=1, now=None):
+    """Deterministic synthetic data set for the given sizes."""
+    from trust_scores import calculate_transaction_limit
+
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    day = 24 * 3600
+
+    # Users: accounts up to 3 years old, some inactive for months
+    profiles = []
+    trust_logs = []
+    for user_id in range(1, users + 1):
+        trust = rng.randint(0, 10)
+        profiles.append(
+            {
+                "user_id": user_id,
+                "created_at": (now - timedelta(days=rng.randint(0, 3 * 365))).isoformat(),
+                "is_verified": rng.random() < 0.3,
+                "last_ip": None,
+                "last_login": (now - timedelta(days=rng.expovariate(1 / 30))).isoformat(),
+                "trust_score": trust,
+                "transaction_limit": calculate_transaction_limit(trust),
+            }
+        )
+        for _ in range(rng.randint(0, 3)):
+            trust_logs.append(
+                {
+                    "user_id": user_id,
+                    "added_trust": rng.choice((0, 0, 0, 1, -1)),
+                    "remarks": "Synthetic history",
+                    "created_at": (now - timedelta(days=rng.randint(1, 400))).isoformat(),
+                }
+            )
+    limits = {p["user_id"]: p["transaction_limit"] for p in profiles}
+
+    # Logins: mostly from a home IP; some shared IPs (NAT, device farms) and travel
+    home_ip = {user_id: _ip(user_id) for user_id in range(1, users + 1)}
+    farm_ips = [_ip(users + 1 + i) for i in range(max(1, users // 200))]
+    login_rows = []
+    for _ in range(logins):
+        user_id = rng.randint(1, users)
+        roll = rng.random()
+        if roll < 0.05:
+            ip = rng.choice(farm_ips)
+        elif roll < 0.08:
+            ip = _ip(rng.randint(2 * users, 3 * users))
+        else:
+            ip = home_ip[user_id]
+        login_rows.append((user_id, ip))
+
+    # Background transactions over the last day, receivers skewed towards hubs
+    receivers = list(range(1, users + 1))
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(users)]
+    rng.shuffle(receivers)
+    cumulative = []
+    total = 0.0
+    for w in weights:
+        total += w
+        cumulative.append(total)
+    to_users = rng.choices(receivers, cum_weights=cumulative, k=transactions)
+    events = []  # (ts, from, to, amount, status, kind, group)
+    for to_id in to_users:
+        from_id = rng.randint(1, users)
+        if from_id == to_id:
+            from_id = from_id % users + 1
+        amount = round(min(rng.lognormvariate(4, 1.2), limits[from_id] * 2), 2)
+        status = "pending" if rng.random() < 0.1 else "completed"
+        events.append((now.timestamp() - rng.uniform(0, day - 600), from_id, to_id, amount, status, None, None))
+
+    # Rings: A -> B -> C ... -> A passing on roughly the same amount within hours
+    for ring in range(rings):
+        members = rng.sample(range(1, users + 1), rng.randint(3, 5))
+        ts = now.timestamp() - rng.uniform(3 * 3600, day - 3 * 3600)
+        amount = rng.uniform(1_000, 50_000)
+        for i, from_id in enumerate(members):
+            events.append((ts, from_id, members[(i + 1) % len(members)], round(amount, 2), "completed", "rings", ring))
+            ts += rng.uniform(60, 1800)
+            amount *= rng.uniform(0.9, 1.0)
+
+    # Bursts: 5-8 pending transfers between one pair within 20 minutes
+    for burst in range(bursts):
+        from_id, to_id = rng.sample(range(1, users + 1), 2)
+        ts = now.timestamp() - rng.uniform(3600, day - 3600)
+        for _ in range(rng.randint(5, 8)):
+            events.append((ts, from_id, to_id, round(rng.uniform(10, 200), 2), "pending", "bursts", burst))
+            ts += rng.uniform(30, 150)
+
+    # Huge amounts, far above the sender's limit
+    for item in range(huge):
+        from_id, to_id = rng.sample(range(1, users + 1), 2)
+        amount = float(limits[from_id] * rng.uniform(15, 50))
+        events.append((now.timestamp() - rng.uniform(600, day - 600), from_id, to_id, amount, "completed", "huge", item))
+
+    # transaction_id in time order, as the database would assign them
+    events.sort(key=lambda e: e[0])
+    transaction_rows = []
+    planted = {"rings": [[] for _ in range(rings)], "bursts": [[] for _ in range(bursts)], "huge": []}
+    for tx_id, (ts, from_id, to_id, amount, status, kind, group) in enumerate(events, start=1):
+        transaction_rows.append(
+            {
+                "transaction_id": tx_id,
+                "from_user_id": from_id,
+                "to_user_id": to_id,
+                "amount": amount,
+                "status": status,
+                "created_at": datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+            }
+        )
+        if kind == "huge":
+            planted["huge"].append(tx_id)
+        elif kind is not None:
+            planted[kind][group].append(tx_id)
+    return Dataset(profiles, trust_logs, transaction_rows, login_rows, planted)
+
+
+# ------------------------------
+# Measurement
+# ------------------------------
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # bytes on macOS, KiB on Linux
+
+
+class Measurement:
+    """Latencies, statuses and storage queries of one scenario."""
+
+    def __init__(self, db, trace_memory=False):
+        self.db = db
+        self.trace_memory = trace_memory
+        self.latencies = []
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._queries_before = self.db.stats.snapshot()
+        if self.trace_memory:
+            tracemalloc.start()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._started
+        self.peak_traced_mb = None
+        if self.trace_memory:
+            self.peak_traced_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        self._queries_after = self.db.stats.snapshot()
+
+    def request(self, send):
+        started = time.perf_counter()
+        response = send()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies.append(elapsed)
+            self.statuses[response.status_code] = self.statuses.get(response.status_code, 0) + 1
+        return response
+
+    def report(self):
+        latencies = sorted(ms * 1000 for ms in self.latencies)
+        requests = len(latencies)
+        queries = {}
+        for name, after in self._queries_after.items():
+            count = after["count"] - self._queries_before.get(name, {}).get("count", 0)
+            if count:
+                queries[name] = count
+        round_trips = sum(queries.values())
+        peak_rss = _peak_rss_mb()
+        return {
+            "requests": requests,
+            "seconds": round(self.seconds, 3),
+            "throughput_rps": round(requests / self.seconds, 2) if self.seconds else 0.0,
+            "mean_ms": round(sum(latencies) / requests, 3) if requests else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p90_ms": round(percentile(latencies, 90), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+            "statuses": {str(code): n for code, n in sorted(self.statuses.items())},
+            "round_trips": round_trips,
+            "round_trips_per_request": round(round_trips / requests, 3) if requests else 0.0,
+            "round_trips_by_query": queries,
+            "rss_mb": round(_rss_mb(), 1) if _rss_mb() is not None else None,
+            "peak_memory_mb": round(
+                self.peak_traced_mb if self.peak_traced_mb is not None else peak_rss or 0.0, 1
+            ),
+        }
+
+
+# ------------------------------
+# Scenarios
+# ------------------------------
+
+
+def load_service(state_dir, geoip_db=None):
+    """Import the service against an in-memory SQLite database and a throwaway state directory."""
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = ":memory:"
+    os.environ["JOB_STATE_DIR"] = os.path.join(state_dir, "jobs")
+    os.environ["TRANSACTION_STATE_PATH"] = os.path.join(state_dir, "check_transactions.pkl")
+    # Scheduled jobs would run in the middle of the measurements
+    os.environ["TRANSACTION_JOB_INTERVAL_SECONDS"] = "0"
+    os.environ["TRUST_JOB_INTERVAL_SECONDS"] = "0"
+    if geoip_db:
+        os.environ["GEOIP_DB_PATH"] = geoip_db
+    # Each simulated client logs in from its own address
+    os.environ.pop("LOGIN_IP_OVERRIDE", None)
+    import anti_fraud_service
+
+    return anti_fraud_service
+
+
+def load_dataset(service, dataset):
+    db = service.db
+    db.bulk_insert("user_profiles", dataset.users)
+    db.bulk_insert("trust_logs", dataset.trust_logs)
+    db.bulk_insert("transactions", dataset.transactions)
+    db.stats.reset()
+
+
+def run_ipcheck(service, dataset, concurrency, trace_memory):
+    logins = dataset.logins
+    chunks = [logins[i::concurrency] for i in range(concurrency)]
+
+    def client_loop(measurement, chunk):
+        client = service.app.test_client()
+        for user_id, ip in chunk:
+            measurement.request(
+                lambda: client.get(f"/ip/ipcheck?user_id={user_id}", environ_base={"REMOTE_ADDR": ip})
+            )
+
+    with Measurement(service.db, trace_memory) as measurement:
+        with ThreadPoolExecutor(concurrency) as pool:
+            for future in [pool.submit(client_loop, measurement, chunk) for chunk in chunks]:
+                future.result()
+        # Writes are buffered behind the requests; they are part of the cost
+        service.ip_log_buffer.flush()
+    return measurement.report()
+
+
+def planted_recall(service, dataset):
+    flags = service.db.table("flagged_transaction").select("transaction_ids, reason").execute().data
+    by_kind = {"rings": set(), "bursts": set(), "huge": set()}
+    for flag in flags:
+        kind = (
+            "rings" if flag["reason"].startswith("Circular")
+            else "bursts" if flag["reason"].startswith("Multiple pending")
+            else "huge"
+        )
+        by_kind[kind].update(flag["transaction_ids"])
+    planted = dataset.planted
+    return {
+        "rings": f"{sum(set(ring) <= by_kind['rings'] for ring in planted['rings'])}/{len(planted['rings'])}",
+        "bursts": f"{sum(bool(by_kind['bursts'].intersection(b)) for b in planted['bursts'])}/{len(planted['bursts'])}",
+        "huge": f"{sum(tx_id in by_kind['huge'] for tx_id in planted['huge'])}/{len(planted['huge'])}",
+    }
+
+
+def run_check_transactions(service, dataset, repeat, trace_memory):
+    client = service.app.test_client()
+    with Measurement(service.db, trace_memory) as measurement:
+        for _ in range(repeat):
+            measurement.request(lambda: client.get("/transaction/check_transactions"))
+    report = measurement.report()
+    report["planted_recall"] = planted_recall(service, dataset)
+    return report
+
+
+def run_tabulate_trust(service, dataset, repeat, trace_memory):
+    client = service.app.test_client()
+    with Measurement(service.db, trace_memory) as measurement:
+        for _ in range(repeat):
+            measurement.request(lambda: client.get("/trust_log/tabulate_trust"))
+    return measurement.report()
+
+
+# ------------------------------
+# Baselines
+# ------------------------------
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(baseline_path(name), "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results, baseline, tolerance):
+    """Rows of (scenario, metric, baseline, current, change, regressed)."""
+    rows = []
+    for scenario, current in results["scenarios"].items():
+        previous = baseline["scenarios"].get(scenario)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = previous.get(metric), current.get(metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else 0.0
+            worse = -change if higher_is_better else change
+            rows.append((scenario, metric, before, after, change, worse > tolerance))
+    return rows
+
+
+# ------------------------------
+# CLI
+# ------------------------------
+
+
+def print_report(results):
+    print(f"\nData set: {json.dumps(results['dataset'])}")
+    header = f"{'scenario':<20}{'reqs':>7}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'trips/req':>11}{'mem MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for scenario, r in results["scenarios"].items():
+        print(
+            f"{scenario:<20}{r['requests']:>7}{r['throughput_rps']:>10}{r['p50_ms']:>10}{r['p90_ms']:>10}"
+            f"{r['p99_ms']:>10}{r['max_ms']:>10}{r['round_trips_per_request']:>11}{r['peak_memory_mb']:>9}"
+        )
+    for scenario, r in results["scenarios"].items():
+        print(f"\n{scenario}: statuses {r['statuses']}, queries {r['round_trips_by_query']}")
+        if "planted_recall" in r:
+            print(f"{scenario}: planted patterns flagged {r['planted_recall']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    for size in SCALES["small"]:
+        parser.add_argument(f"--{size}", type=int, help=f"override the scale's number of {size}")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent /ip/ipcheck clients")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each batch endpoint")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--geoip-db", help="mmdb to resolve login IPs with (default: none, every lookup is empty)")
+    parser.add_argument("--trace-memory", action="store_true", help="report tracemalloc peaks instead of peak RSS (slower)")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--save-baseline", metavar="NAME", help=f"save the results as {BASELINE_DIR}/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare with a saved baseline; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before a regression")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    sizes = {size: getattr(args, size) or default for size, default in SCALES[args.scale].items()}
+
+    with tempfile.TemporaryDirectory(prefix="anti-fraud-bench-") as state_dir:
+        service = load_service(state_dir, args.geoip_db)
+        started = time.perf_counter()
+        dataset = generate(seed=args.seed, **sizes)
+        load_dataset(service, dataset)
+        print(f"Generated and loaded data in {time.perf_counter() - started:.1f}s")
+
+        runners = {
+            "ipcheck": lambda: run_ipcheck(service, dataset, args.concurrency, args.trace_memory),
+            "check_transactions": lambda: run_check_transactions(service, dataset, args.repeat, args.trace_memory),
+            "tabulate_trust": lambda: run_tabulate_trust(service, dataset, args.repeat, args.trace_memory),
+        }
+        results = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "config": {"scale": args.scale, "seed": args.seed, "concurrency": args.concurrency, "repeat": args.repeat},
+            "dataset": dataset.describe(),
+            "scenarios": {},
+        }
+        for scenario in scenarios:
+            print(f"Running {scenario}...")
+            results["scenarios"][scenario] = runners[scenario]()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+        print(f"\nSaved baseline {baseline_path(args.save_baseline)}")
+
+    if args.compare:
+        with open(baseline_path(args.compare)) as f:
+            baseline = json.load(f)
+        if baseline["config"] != results["config"] or baseline["dataset"] != results["dataset"]:
+            print("\nWarning: baseline was recorded with a different configuration or data set")
+        rows = compare(results, baseline, args.tolerance)
+        print(f"\nCompared with baseline {args.compare} ({baseline['created_at']}):")
+        for scenario, metric, before, after, change, regressed in rows:
+            marker = "  REGRESSION" if regressed else ""
+            print(f"  {scenario:<20}{metric:<26}{before:>12} -> {after:<12}{change:+.1%}{marker}")
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,350 @@
+"""
+Columnar bulk export of ip_logs, transactions and trust_logs, as Parquet or
+Arrow IPC, for ranges too large to pull through the JSON list endpoints.
+
+A table is read in key order, one keyset page at a time (optionally within a
+key range and a time range), converted to typed Arrow columns and written out
+one row group at a time, so memory stays bounded by a row group whatever the
+size of the export. The next page is fetched while the current one is
+converted.
+
+Column types:
+
+- integer keys and ids: int64; amounts and coordinates: float64; flags: bool
+- timestamps: int64 microseconds since the epoch (Arrow timestamp[us, UTC])
+- IP addresses: binary, the packed 4 (IPv4) or 16 (IPv6) bytes
+- other text: UTF-8 strings (dictionary-encoded in Parquet)
+
+Served at GET /export/<table>, and from the command line:
+
+    python backend/columnar_export.py ip_logs --since 2026-09-01T00:00:00Z -o ip_logs.parquet
+    python backend/columnar_export.py transactions --format arrow --compression lz4 -o tx.arrows
+"""
+
+import argparse
+import ipaddress
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from queue import Empty, Full, Queue
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from pagination import MAX_PAGE_SIZE, ListQuery, parse_timestamp
+from repository import TABLES, default_backend
+
+# Exported table -> its time column (the since/until filters)
+EXPORT_TABLES = {"ip_logs": "checked_at", "transactions": "created_at", "trust_logs": "created_at"}
+
+# Format -> (supported compressions, default), media type, file extension
+FORMATS = {
+    "parquet": (("zstd", "snappy", "gzip", "lz4", "none"), "zstd"),
+    "arrow": (("zstd", "lz4", "none"), "zstd"),
+}
+MEDIA_TYPES = {"parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.stream"}
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrows"}
+
+IP_COLUMNS = {"ip_address", "last_ip"}
+ROW_GROUP_ROWS = 65536
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+# ------------------------------
+# Typed columns
+# ------------------------------
+
+
+def epoch_micros(value):
+    """Supabase timestamp string or datetime -> int microseconds since the epoch (naive values are UTC)."""
+    ts = value if isinstance(value, datetime) else datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return (ts - _EPOCH) // _MICROSECOND
+
+
+def packed_ip(value):
+    """An IP address as its packed bytes; None if it does not parse."""
+    try:
+        return ipaddress.ip_address(value).packed
+    except ValueError:
+        return None
+
+
+def _arrow_type(column, kind):
+    if kind == "int":
+        return pa.int64()
+    if kind == "float":
+        return pa.float64()
+    if kind == "bool":
+        return pa.bool_()
+    if kind == "timestamp":
+        return pa.timestamp("us", tz="UTC")
+    if kind == "int[]":
+        return pa.list_(pa.int64())
+    return pa.binary() if column in IP_COLUMNS else pa.string()
+
+
+def _timestamp_array(values, type):
+    try:
+        # Arrow's own ISO 8601 parser; it rejects values without a zone offset
+        return pc.cast(pa.array(values, pa.string()), type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else epoch_micros(value) for value in values], type=type)
+
+
+def arrow_schema(table, columns):
+    kinds = TABLES[table].columns
+    return pa.schema([pa.field(column, _arrow_type(column, kinds[column])) for column in columns])
+
+
+def to_record_batch(rows, schema, table):
+    kinds = TABLES[table].columns
+    arrays = []
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        kind = kinds[field.name]
+        if kind == "timestamp":
+            arrays.append(_timestamp_array(values, field.type))
+            continue
+        if kind == "text" and field.name in IP_COLUMNS:
+            values = [None if value is None else packed_ip(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+# ------------------------------
+# Requests
+# ------------------------------
+
+
+def export_query(table):
+    """Keyset pages over every column of the table, with since/until on its time column."""
+    spec = TABLES[table]
+    time_column = EXPORT_TABLES[table]
+    return ListQuery(
+        table,
+        key=spec.key,
+        columns=list(spec.columns),
+        filters={
+            "since": (time_column, "gte", parse_timestamp),
+            "until": (time_column, "lte", parse_timestamp),
+        },
+    )
+
+
+def parse_export(table, args):
+    """
+    Validate export parameters (query args or CLI options): columns,
+    since/until, after_id (exclusive) / until_id (inclusive) key range,
+    format and compression. Raises ValueError.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"unknown table {table!r}, expected one of {', '.join(EXPORT_TABLES)}")
+    query = export_query(table)
+
+    columns = args.get("columns")
+    if columns:
+        selected = [c.strip() for c in columns.split(",") if c.strip()]
+        unknown = [c for c in selected if c not in query.columns]
+        if unknown:
+            raise ValueError(f"unknown columns: {', '.join(unknown)}")
+        if query.key not in selected:
+            selected.insert(0, query.key)  # the cursor column is always exported
+    else:
+        selected = list(query.columns)
+
+    filters = []
+    for param, (column, op, parser) in query.filters.items():
+        raw = args.get(param)
+        if raw:
+            try:
+                filters.append((column, op, parser(raw)))
+            except ValueError as e:
+                raise ValueError(f"invalid {param}: {e}")
+
+    key_range = {}
+    for param in ("after_id", "until_id"):
+        raw = args.get(param)
+        if raw not in (None, ""):
+            try:
+                key_range[param] = int(raw)
+            except ValueError:
+                raise ValueError(f"invalid {param}: expected an integer, got {raw!r}")
+    if "until_id" in key_range:
+        filters.append((query.key, "lte", key_range["until_id"]))
+
+    fmt = args.get("format") or "parquet"
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    compressions, default = FORMATS[fmt]
+    compression = args.get("compression") or default
+    if compression not in compressions:
+        raise ValueError(f"compression for {fmt} must be one of {', '.join(compressions)}")
+
+    return {
+        "query": query,
+        "columns": selected,
+        "filters": filters,
+        "after_id": key_range.get("after_id"),
+        "format": fmt,
+        "compression": compression,
+    }
+
+
+# ------------------------------
+# Writing
+# ------------------------------
+
+
+class _Chunks:
+    """Write-only file object that keeps what was written until drained."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def prefetch(pages, depth=2):
+    """Iterate pages while a background thread fetches up to depth pages ahead."""
+    queue = Queue(depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for page in pages:
+                if not put((page, None)):
+                    return  # the consumer went away
+            put((None, None))
+        except Exception as e:
+            put((None, e))
+
+    threading.Thread(target=produce, name="export-prefetch", daemon=True).start()
+    try:
+        while True:
+            try:
+                page, error = queue.get(timeout=0.5)
+            except Empty:
+                continue
+            if error is not None:
+                raise error
+            if page is None:
+                return
+            yield page
+    finally:
+        stop.set()
+
+
+def write_export(pages, table, columns, fmt, compression, row_group_rows=ROW_GROUP_ROWS):
+    """Yield the encoded file as bytes chunks, one per row group (plus header and footer)."""
+    schema = arrow_schema(table, columns)
+    sink = _Chunks()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression=compression)
+        write = writer.write_table
+    else:
+        options = pa.ipc.IpcWriteOptions(compression=None if compression == "none" else compression)
+        writer = pa.ipc.new_stream(sink, schema, options=options)
+        write = writer.write_table
+
+    batches, buffered = [], 0
+    try:
+        for rows in pages:
+            batches.append(to_record_batch(rows, schema, table))
+            buffered += len(rows)
+            if buffered >= row_group_rows:
+                write(pa.Table.from_batches(batches, schema).combine_chunks())
+                batches, buffered = [], 0
+                yield sink.drain()
+        if batches:
+            write(pa.Table.from_batches(batches, schema).combine_chunks())
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export(client, table, params, page_size=MAX_PAGE_SIZE, row_group_rows=ROW_GROUP_ROWS):
+    """The export described by parse_export(), as bytes chunks."""
+    pages = prefetch(
+        params["query"].iter_pages(client, params["columns"], params["filters"], params["after_id"], page_size)
+    )
+    try:
+        yield from write_export(
+            pages, table, params["columns"], params["format"], params["compression"], row_group_rows
+        )
+    finally:
+        pages.close()  # stops the fetch thread when the export is abandoned
+
+
+# ------------------------------
+# Command line
+# ------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("table", choices=EXPORT_TABLES)
+    parser.add_argument("-o", "--output", help="file to write (default: stdout)")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--compression", help="zstd (default), snappy, gzip, lz4 or none (arrow: zstd, lz4, none)")
+    parser.add_argument("--columns", help="comma-separated subset of columns (the key is always exported)")
+    parser.add_argument("--since", help="only rows at or after this ISO 8601 timestamp")
+    parser.add_argument("--until", help="only rows at or before this ISO 8601 timestamp")
+    parser.add_argument("--after-id", help="only rows whose key is greater than this")
+    parser.add_argument("--until-id", help="only rows whose key is at most this")
+    parser.add_argument("--row-group-rows", type=int, default=ROW_GROUP_ROWS)
+    args = parser.parse_args(argv)
+
+    try:
+        params = parse_export(args.table, vars(args))
+    except ValueError as e:
+        parser.error(str(e))
+
+    load_dotenv()
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export(default_backend(), args.table, params, row_group_rows=args.row_group_rows):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@ from datetime import datetime
 from videoToText import videoToText
 from hateMentalPipeline import getLabelsScores
 from clickbaitPipeline import clickBait
+from segmentedTranscription import TranscriptionPool
 import whisper
 from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
@@ -12,20 +13,41 @@ from adapters import AutoAdapterModel
 
 load_dotenv()
 
-# Initialize Whisper model
-whisper_model = whisper.load_model("base")  
-
-# Load HateBERT model
-filter_model = AutoAdapterModel.from_pretrained("GroNLP/hateBERT")
-filter_tokenizer = AutoTokenizer.from_pretrained("GroNLP/hateBERT")
-
-# Initialize Gemini model
-gemini = ChatGoogleGenerativeAI(
-    model="gemini-1.5-flash",
-    temperature=0.4,
-    max_output_tokens=200,
-    convert_system_message_to_human=True
-)
+WHISPER_MODEL = "base"
+
+# Long-audio mode: videos longer than LONG_AUDIO_SECONDS are split into segments of at most
+# SEGMENT_SECONDS at pauses and transcribed on TRANSCRIBE_WORKERS processes (0 turns it off)
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", str(min(4, os.cpu_count() or 1))))
+SEGMENT_SECONDS = float(os.getenv("SEGMENT_SECONDS", "60"))
+LONG_AUDIO_SECONDS = float(os.getenv("LONG_AUDIO_SECONDS", "120"))
+
+# Transcription workers are spawned and import this file again as __mp_main__: they load
+# their own Whisper model only, not the models below
+if __name__ != "__mp_main__":
+    # Initialize Whisper model
+    whisper_model = whisper.load_model(WHISPER_MODEL)
+
+    # Whisper worker processes for long videos
+    transcription_pool = None
+    if TRANSCRIBE_WORKERS > 0:
+        transcription_pool = TranscriptionPool(
+            WHISPER_MODEL,
+            workers=TRANSCRIBE_WORKERS,
+            segment_seconds=SEGMENT_SECONDS,
+            long_audio_seconds=LONG_AUDIO_SECONDS,
+        )
+
+    # Load HateBERT model
+    filter_model = AutoAdapterModel.from_pretrained("GroNLP/hateBERT")
+    filter_tokenizer = AutoTokenizer.from_pretrained("GroNLP/hateBERT")
+
+    # Initialize Gemini model
+    gemini = ChatGoogleGenerativeAI(
+        model="gemini-1.5-flash",
+        temperature=0.4,
+        max_output_tokens=200,
+        convert_system_message_to_human=True
+    )
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -52,7 +74,7 @@ def checkContent():
             return jsonify({'error': 'Video URL not provided'}), 400
         
         # Get transcript
-        transcript = videoToText(whisper_model, url)
+        transcript = videoToText(whisper_model, url, transcription_pool)
         
         if transcript is None:
             return jsonify({'error': 'Failed to transcribe video'}), 400
@@ -0,0 +1,240 @@
+import multiprocessing
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import whisper
+
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE  # 16 kHz mono, as decoded by whisper.load_audio
+FRAME_SECONDS = 0.03
+MIN_SILENCE_SECONDS = 0.3
+SILENCE_MARGIN_DB = 10.0  # above the noise floor
+SPEECH_DROP_DB = 35.0  # below the loud parts
+QUIET_DB = -60.0  # always silence, e.g. digital silence throughout
+
+# Worker process state: its own copy of the model, loaded once by the pool initializer
+_worker_model = None
+
+
+def loadWorkerModel(model_name, threads):
+    """
+    Pool initializer: load the Whisper model once per worker process
+
+    Args:
+        model_name (str): Whisper model name, e.g. "base"
+        threads (int): Torch threads for this worker, so workers do not oversubscribe the cores
+    """
+    global _worker_model
+    import torch
+
+    torch.set_num_threads(threads)
+    _worker_model = whisper.load_model(model_name)
+
+
+def workerReady():
+    """No-op task; submitting one per worker starts the workers (and loads their models) up front"""
+    return os.getpid()
+
+
+def transcribeSegment(samples):
+    """
+    Transcribe one segment in a worker process
+
+    Args:
+        samples (np.ndarray): float32 16 kHz mono audio
+
+    Returns:
+        dict: Whisper result (text, segments with timestamps relative to the segment, language)
+    """
+    return _worker_model.transcribe(samples)
+
+
+def frameEnergy(samples, frame_samples):
+    """
+    Energy of consecutive frames in dB
+
+    Args:
+        samples (np.ndarray): float32 audio
+        frame_samples (int): Samples per frame
+
+    Returns:
+        np.ndarray: One dB value per whole frame
+    """
+    count = len(samples) // frame_samples
+    frames = samples[: count * frame_samples].reshape(count, frame_samples)
+    power = np.einsum("ij,ij->i", frames, frames) / frame_samples
+    return 10 * np.log10(power + 1e-10)
+
+
+def silenceThreshold(energy):
+    """
+    Frames below this dB level count as silence: a margin above the noise floor, or well
+    below the loud parts when the quiet parts are digital silence, but always under the
+    loud parts (audio without pauses has none)
+    """
+    if not len(energy):
+        return QUIET_DB
+    floor, loud = np.percentile(energy, [10, 95])
+    relative = max(floor + SILENCE_MARGIN_DB, loud - SPEECH_DROP_DB)
+    return max(min(relative, loud - SILENCE_MARGIN_DB), QUIET_DB)
+
+
+def findSilences(energy, threshold, min_frames):
+    """
+    Runs of silent frames
+
+    Args:
+        energy (np.ndarray): Frame energies in dB
+        threshold (float): Silence level in dB
+        min_frames (int): Shortest run that counts as a pause
+
+    Returns:
+        tuple: (starts, ends) frame indices of each run, end exclusive
+    """
+    silent = np.concatenate(([False], energy < threshold, [False]))
+    changes = np.flatnonzero(silent[1:] != silent[:-1])
+    starts, ends = changes[::2], changes[1::2]
+    keep = ends - starts >= min_frames
+    return starts[keep], ends[keep]
+
+
+def splitAtSilences(samples, segment_seconds):
+    """
+    Split audio into segments of at most segment_seconds, cutting in pauses
+
+    Each cut is made in the middle of the longest pause found in the second half of the
+    allowed length, or at the quietest frame there when there is no pause. Segments that
+    are silence throughout are left out (Whisper tends to invent text for them).
+
+    Args:
+        samples (np.ndarray): float32 16 kHz mono audio
+        segment_seconds (float): Longest segment
+
+    Returns:
+        list: (start_sample, end_sample) of each segment to transcribe, in order
+    """
+    frame_samples = int(SAMPLE_RATE * FRAME_SECONDS)
+    energy = frameEnergy(samples, frame_samples)
+    threshold = silenceThreshold(energy)
+    starts, ends = findSilences(energy, threshold, int(MIN_SILENCE_SECONDS / FRAME_SECONDS))
+    middles, lengths = (starts + ends) // 2, ends - starts
+
+    max_frames = max(2, int(segment_seconds / FRAME_SECONDS))
+    cuts = [0]
+    while len(energy) - cuts[-1] > max_frames:
+        low, high = cuts[-1] + max_frames // 2, cuts[-1] + max_frames
+        first, last = np.searchsorted(middles, [low, high])
+        if last > first:
+            cuts.append(int(middles[first + np.argmax(lengths[first:last])]))
+        else:
+            cuts.append(low + int(np.argmin(energy[low:high])))
+
+    bounds = [cut * frame_samples for cut in cuts] + [len(samples)]
+    segments = []
+    for i in range(len(cuts)):
+        segment_energy = energy[cuts[i] : cuts[i + 1] if i + 1 < len(cuts) else len(energy)]
+        if not len(segment_energy) or segment_energy.max() < threshold:
+            continue
+        segments.append((bounds[i], bounds[i + 1]))
+    return segments
+
+
+def stitchResults(results, offsets):
+    """
+    Join segment transcriptions back into one Whisper-style result
+
+    Args:
+        results (list): Whisper result of each segment, in order
+        offsets (list): Start of each segment in seconds
+
+    Returns:
+        dict: text, segments (timestamps relative to the whole audio, renumbered) and language
+    """
+    segments = []
+    for result, offset in zip(results, offsets):
+        for segment in result["segments"]:
+            segments.append(
+                {
+                    **segment,
+                    "id": len(segments),
+                    "seek": segment["seek"] + int(offset * 100),  # mel frames, 100 per second
+                    "start": segment["start"] + offset,
+                    "end": segment["end"] + offset,
+                }
+            )
+    languages = Counter(result["language"] for result in results if result.get("language"))
+    return {
+        "text": "".join(result["text"] for result in results),
+        "segments": segments,
+        "language": languages.most_common(1)[0][0] if languages else None,
+    }
+
+
+class TranscriptionPool:
+    """
+    Worker processes that each hold a preloaded Whisper model, for transcribing the
+    segments of long audio in parallel
+
+    Workers are spawned (not forked, which is unsafe once torch has run in this process).
+    Spawned workers re-import the main module as __mp_main__, so it must not load its own
+    models under that name.
+    """
+
+    def __init__(self, model_name="base", workers=2, segment_seconds=60.0, long_audio_seconds=120.0):
+        self.model_name = model_name
+        self.workers = workers
+        self.segment_seconds = segment_seconds
+        self.long_audio_seconds = long_audio_seconds
+        # Split the cores between the workers instead of every worker using all of them
+        self.threads = max(1, (os.cpu_count() or 1) // workers)
+        self._lock = threading.Lock()
+        self._executor = self._start()
+
+    def _start(self):
+        executor = ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=loadWorkerModel,
+            initargs=(self.model_name, self.threads),
+        )
+        # Start every worker now, so the models are loaded before the first long video arrives
+        for _ in range(self.workers):
+            executor.submit(workerReady)
+        return executor
+
+    def isLong(self, samples):
+        return len(samples) > self.long_audio_seconds * SAMPLE_RATE
+
+    def transcribe(self, samples):
+        """
+        Transcribe long audio: split at pauses, transcribe the segments in parallel, stitch
+
+        Args:
+            samples (np.ndarray): float32 16 kHz mono audio
+
+        Returns:
+            dict: Whisper-style result with timestamps relative to the whole audio
+
+        Raises:
+            BrokenProcessPool: A worker died; the pool is restarted for the next call
+        """
+        pieces = splitAtSilences(samples, self.segment_seconds)
+        with self._lock:
+            executor = self._executor
+        try:
+            futures = [executor.submit(transcribeSegment, samples[start:end]) for start, end in pieces]
+            results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = self._start()
+            executor.shutdown(wait=False)
+            raise
+        print(f"Transcribed {len(pieces)} segments on {self.workers} workers")
+        return stitchResults(results, [start / SAMPLE_RATE for start, _ in pieces])
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
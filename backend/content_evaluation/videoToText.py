@@ -1,6 +1,8 @@
 
 from moviepy.editor import VideoFileClip
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
+import whisper
 import requests
 import tempfile
 import os
@@ -57,8 +59,19 @@ def extractAudio(video_path):
         print(f"Error during audio extraction: {str(e)}")
         return False
 
-def videoToText(whisper_model, url):
-    """Main function for video to audio conversion"""
+def videoToText(whisper_model, url, transcription_pool=None):
+    """
+    Main function for video to audio conversion
+
+    Args:
+        whisper_model: Whisper model for short clips
+        url (str): Video URL
+        transcription_pool (TranscriptionPool): If given, audio longer than its
+            long_audio_seconds is split at pauses and transcribed in parallel on it
+
+    Returns:
+        str: Transcript, or None if the audio could not be extracted
+    """
 
     video_file = downloadVideo(url)
 
@@ -69,8 +82,17 @@ def videoToText(whisper_model, url):
         print(f"Failed to extract audio from '{url}'")
         return
     
-    # Transcribe audio file with English language specification
-    result = whisper_model.transcribe(audio)  
+    # Decode once: 16 kHz mono float32, what Whisper transcribes
+    samples = whisper.load_audio(audio)
+
+    if transcription_pool is not None and transcription_pool.isLong(samples):
+        try:
+            result = transcription_pool.transcribe(samples)
+        except BrokenProcessPool as e:
+            print(f"Transcription worker failed ({e}), transcribing in this process")
+            result = whisper_model.transcribe(samples)
+    else:
+        result = whisper_model.transcribe(samples)
     print("Transcription complete")
 
     # Get cleaned transcript
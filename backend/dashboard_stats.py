@@ -0,0 +1,296 @@
+"""
+Pre-aggregated counters for /stats/summary, maintained on write.
+
+Every series (suspicious logins in one country, flags raised for one reason,
+users at one trust score, ...) is kept as hourly running totals, so the count
+over any hour range is the difference of two entries: a summary costs the
+same for the last hour as for the last year, and no raw rows are read.
+
+Write paths report what they wrote (record_logins, record_flags, ...). On
+startup the counters are warmed once from the stored rows of the retention
+window; rows written after the warm-up cutoff are only counted live.
+
+Rows can also change after they are written (a login marked safe, a flag
+resolved, a user's trust score). Such changes reported while warm-up is still
+reading are held until it is done, then applied only to the rows it counted
+in their old state; it saw the others already changed.
+"""
+
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+from transaction_checks import parse_epoch
+
+HOUR = 3600
+
+# flagged_transaction.reason prefixes -> rule name (see transaction_rules)
+REASON_PREFIXES = (
+    ("Circular money flow", "circular_flow"),
+    ("Huge transaction amount", "huge_amount"),
+    ("Multiple pending transactions", "pending_burst"),
+)
+
+
+def reason_category(reason):
+    for prefix, category in REASON_PREFIXES:
+        if (reason or "").startswith(prefix):
+            return category
+    return "other"
+
+
+def hour_of(value):
+    """Hour index (epoch hours) of a timestamp string, datetime or epoch seconds."""
+    seconds = value if isinstance(value, (int, float)) else parse_epoch(value)
+    return int(seconds // HOUR)
+
+
+class HourlyTotals:
+    """
+    Running totals of one series by hour: totals[i] is the sum of every
+    count added for hours first_hour .. first_hour + i. Adding to the latest
+    hour is O(1); adding to an older hour updates the totals after it.
+    """
+
+    __slots__ = ("first_hour", "totals")
+
+    def __init__(self):
+        self.first_hour = None
+        self.totals = []
+
+    def add(self, hour, count=1):
+        if self.first_hour is None:
+            self.first_hour, self.totals = hour, [0]
+        elif hour < self.first_hour:
+            self.totals[:0] = [0] * (self.first_hour - hour)
+            self.first_hour = hour
+        index = hour - self.first_hour
+        if index >= len(self.totals):
+            self.totals.extend([self.totals[-1]] * (index + 1 - len(self.totals)))
+        for i in range(index, len(self.totals)):
+            self.totals[i] += count
+
+    def through(self, hour):
+        """Sum of every count up to and including this hour."""
+        if self.first_hour is None or hour < self.first_hour:
+            return 0
+        return self.totals[min(hour - self.first_hour, len(self.totals) - 1)]
+
+    def between(self, start_hour, end_hour):
+        """Sum over hours start_hour <= h < end_hour."""
+        return self.through(end_hour - 1) - self.through(start_hour - 1)
+
+
+class DashboardStats:
+    """
+    Series, each keyed by a label:
+
+    - logins / suspicious_logins: by country
+    - flags / unresolved_flags: by reason category, at the flag's creation hour
+    - trust_users: users at each trust score (+1 entering, -1 leaving), so the
+      total through an hour is the trust histogram at that time
+    - trust_changes: trust log entries by added_trust
+    """
+
+    SERIES = ("logins", "suspicious_logins", "flags", "unresolved_flags", "trust_users", "trust_changes")
+
+    def __init__(self, live_since=None):
+        self._lock = threading.Lock()
+        self._series = {name: defaultdict(HourlyTotals) for name in self.SERIES}
+        self.live_since = live_since  # epoch seconds; older inserts are left to warm-up
+        self.warm_since = None  # epoch seconds; start of the window warm-up counted
+
+        # Until the warm-up of rows (finish_warm) and of trust scores (record_trust_scores)
+        # is done, changes to stored rows are held
+        self._warming_rows = self._warming_trust = live_since is not None
+        self._held_changes = []  # (series, row id, key, epoch seconds of the row)
+        self._held_moves = []  # (user_id, old score, new score, hour)
+        # IDs of the rows warm-up counted as suspicious / unresolved
+        self._warm_counted = {"suspicious_logins": set(), "unresolved_flags": set()}
+
+    def _add(self, series, key, hour, count=1):
+        self._series[series][str(key)].add(hour, count)
+
+    def _is_live(self, seconds):
+        return self.live_since is None or seconds >= self.live_since
+
+    def _remove(self, series, row_id, key, value):
+        """Take a changed row out of a series, if it is counted there."""
+        seconds = parse_epoch(value)
+        if self._is_live(seconds):
+            self._add(series, key, hour_of(seconds), -1)
+        elif self._warming_rows:
+            self._held_changes.append((series, row_id, key, seconds))
+        elif self.warm_since is not None and seconds >= self.warm_since:
+            # Warm-up counted it, in its old state, as it changed only now
+            self._add(series, key, hour_of(seconds), -1)
+
+    def _move(self, old, new, hour, users):
+        self._add("trust_users", old, hour, -users)
+        self._add("trust_users", new, hour, users)
+
+    # ------------------------------
+    # Write paths
+    # ------------------------------
+
+    def record_logins(self, rows, warm=False):
+        """ip_logs rows as inserted (checked_at, country, is_suspicious)."""
+        with self._lock:
+            for row in rows:
+                seconds = parse_epoch(row["checked_at"])
+                if not warm and not self._is_live(seconds):
+                    continue
+                hour = hour_of(seconds)
+                country = row.get("country") or "Unknown"
+                self._add("logins", country, hour)
+                if row.get("is_suspicious"):
+                    self._add("suspicious_logins", country, hour)
+                    if warm and self._warming_rows:
+                        self._warm_counted["suspicious_logins"].add(row["id"])
+
+    def record_login_marked_safe(self, row):
+        """An ip_logs row (id, checked_at, country) that was suspicious and no longer is."""
+        with self._lock:
+            self._remove("suspicious_logins", row["id"], row.get("country") or "Unknown", row["checked_at"])
+
+    def record_flags(self, flags, warm=False):
+        """flagged_transaction rows as inserted (created_at, reason, is_resolved)."""
+        with self._lock:
+            for flag in flags:
+                seconds = parse_epoch(flag["created_at"])
+                if not warm and not self._is_live(seconds):
+                    continue
+                hour = hour_of(seconds)
+                category = reason_category(flag["reason"])
+                self._add("flags", category, hour)
+                if not flag.get("is_resolved"):
+                    self._add("unresolved_flags", category, hour)
+                    if warm and self._warming_rows:
+                        self._warm_counted["unresolved_flags"].add(flag["flagged_transaction_id"])
+
+    def record_flags_resolved(self, flags):
+        """Flags (flagged_transaction_id, created_at, reason) that went from unresolved to resolved."""
+        with self._lock:
+            for flag in flags:
+                self._remove(
+                    "unresolved_flags", flag["flagged_transaction_id"], reason_category(flag["reason"]), flag["created_at"]
+                )
+
+    def finish_warm(self, since):
+        """
+        Warm-up has counted the stored logins and flags from since (epoch
+        seconds) to live_since: apply the changes held meanwhile to the rows
+        it counted in their old state.
+        """
+        with self._lock:
+            for series, row_id, key, seconds in self._held_changes:
+                if row_id in self._warm_counted[series]:
+                    self._add(series, key, hour_of(seconds), -1)
+            self._held_changes = []
+            self._warm_counted = {series: set() for series in self._warm_counted}
+            self.warm_since = since
+            self._warming_rows = False
+
+    def record_trust_scores(self, profiles, at):
+        """
+        Warm-up: (user_id, trust_score) of every user, in user_id order, as of
+        the given time. Read while no trust job runs, so the job's moves
+        reported until then are already in the scores. Moves of single users
+        held meanwhile are applied if the read saw their old score.
+        """
+        user_ids, scores, histogram = array("q"), array("h"), Counter()
+        try:
+            for user_id, score in profiles:
+                user_ids.append(user_id)
+                scores.append(score)
+                histogram[score] += 1
+        finally:
+            hour = hour_of(at)
+            with self._lock:
+                for score, users in histogram.items():
+                    self._add("trust_users", score, hour, users)
+                for user_id, old, new, move_hour in self._held_moves:
+                    i = bisect_left(user_ids, user_id)
+                    if i < len(user_ids) and user_ids[i] == user_id and scores[i] == old:
+                        scores[i] = new
+                        self._move(old, new, move_hour, 1)
+                self._held_moves = []
+                self._warming_trust = False
+
+    def record_trust_moves(self, moves, at):
+        """
+        moves: {(old_score, new_score): users} for profiles whose score
+        changed (the trust job). Dropped until trust scores are warmed.
+        """
+        hour = hour_of(at)
+        with self._lock:
+            if self._warming_trust:
+                return
+            for (old, new), users in moves.items():
+                if old != new:
+                    self._move(old, new, hour, users)
+
+    def record_trust_move(self, user_id, old, new, at):
+        """One user's trust score changed (e.g. verification)."""
+        if old == new:
+            return
+        hour = hour_of(at)
+        with self._lock:
+            if self._warming_trust:
+                self._held_moves.append((user_id, old, new, hour))
+            else:
+                self._move(old, new, hour, 1)
+
+    def record_trust_changes(self, added, at):
+        """added: {added_trust: trust_logs rows written} at the given time."""
+        hour = hour_of(at)
+        with self._lock:
+            for change, logs in added.items():
+                self._add("trust_changes", change, hour, logs)
+
+    # ------------------------------
+    # Reads
+    # ------------------------------
+
+    def _between(self, series, start_hour, end_hour):
+        counts = {key: totals.between(start_hour, end_hour) for key, totals in self._series[series].items()}
+        return {key: count for key, count in sorted(counts.items()) if count}
+
+    def _through(self, series, hour):
+        counts = {key: totals.through(hour) for key, totals in self._series[series].items()}
+        return {key: count for key, count in sorted(counts.items()) if count}
+
+    def summary(self, start, end):
+        """Aggregates for hours [hour_of(start), hour_of(end)), whatever the length of the range."""
+        start_hour, end_hour = hour_of(start), hour_of(end)
+        with self._lock:
+            logins = self._between("logins", start_hour, end_hour)
+            suspicious = self._between("suspicious_logins", start_hour, end_hour)
+            flags = self._between("flags", start_hour, end_hour)
+            unresolved = self._between("unresolved_flags", start_hour, end_hour)
+            all_unresolved = self._through("unresolved_flags", end_hour - 1)
+            trust_histogram = self._through("trust_users", end_hour - 1)
+            trust_changes = self._between("trust_changes", start_hour, end_hour)
+        return {
+            "from": datetime.fromtimestamp(start_hour * HOUR, timezone.utc).isoformat(),
+            "to": datetime.fromtimestamp(end_hour * HOUR, timezone.utc).isoformat(),
+            "hours": end_hour - start_hour,
+            "logins": {
+                "total": sum(logins.values()),
+                "suspicious": sum(suspicious.values()),
+                "suspicious_by_country": suspicious,
+            },
+            "flagged_transactions": {
+                "total": sum(flags.values()),
+                "by_reason": flags,
+                "unresolved": sum(unresolved.values()),
+                "unresolved_by_reason": unresolved,
+                "unresolved_all_time": sum(all_unresolved.values()),
+            },
+            "trust": {
+                "histogram": trust_histogram,
+                "changes": trust_changes,
+            },
+        }
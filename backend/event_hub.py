@@ -0,0 +1,175 @@
+"""
+In-process fan-out of dashboard events (new suspicious logins, flagged
+transactions, trust changes, ...) to /events/stream clients, so the
+dashboard does not have to re-fetch whole lists to find what is new.
+
+publish() stamps every event with an increasing id and keeps the last
+`history` events, so a client reconnecting with Last-Event-ID is sent what
+it missed. Each client has its own bounded queue: one that falls that far
+behind is disconnected instead of holding memory or slowing publishers,
+and catches up from its last id when it reconnects.
+
+Ids are "<hub epoch>-<sequence>". An id from before a restart (or from
+another process), or one that has fallen out of the history, cannot be
+resumed; the client gets a "reset" event and should re-fetch its lists.
+"""
+
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, NamedTuple
+
+
+class Event(NamedTuple):
+    seq: int
+    id: str
+    kind: str
+    data: Any
+
+
+class Subscription:
+    def __init__(self, hub, kinds, max_pending):
+        self.hub = hub
+        self.kinds = kinds  # None = every kind
+        self.max_pending = max_pending
+        self.overflowed = False
+        self._pending = deque()
+        self._ready = threading.Condition(threading.Lock())
+
+    def _put(self, event):
+        if self.kinds is not None and event.kind not in self.kinds:
+            return
+        with self._ready:
+            if self.overflowed:
+                return
+            if len(self._pending) >= self.max_pending:
+                self.overflowed = True  # the stream ends; the client resumes from its last id
+            else:
+                self._pending.append(event)
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Every pending event, waiting up to timeout seconds for one; [] on timeout."""
+        with self._ready:
+            if not self._pending and not self.overflowed:
+                self._ready.wait(timeout)
+            events = list(self._pending)
+            self._pending.clear()
+            return events
+
+    def close(self):
+        self.hub._unsubscribe(self)
+
+
+class EventHub:
+    def __init__(self, history=10000, client_buffer=1000, max_clients=100):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.client_buffer = client_buffer
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history)
+        self._subscribers = []
+        self._seq = 0
+        self._published = 0
+        self._dropped_clients = 0
+
+    @property
+    def last_id(self):
+        return f"{self.epoch}-{self._seq}"
+
+    def publish(self, kind, data):
+        with self._lock:
+            self._seq += 1
+            self._published += 1
+            event = Event(self._seq, f"{self.epoch}-{self._seq}", kind, data)
+            self._history.append(event)
+            # Under the hub lock so every client sees ids in order (each put is O(1))
+            for subscription in self._subscribers:
+                subscription._put(event)
+        return event
+
+    def publish_many(self, kind, items):
+        for data in items:
+            self.publish(kind, data)
+
+    def subscribe(self, kinds=None, last_event_id=None):
+        """
+        Returns (subscription, missed, reset), or None when max_clients are
+        already connected. missed are the events after last_event_id; reset
+        means it could not be resumed from.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            missed, reset = [], False
+            if last_event_id:
+                after = self._resume_seq(last_event_id)
+                if after is None:
+                    reset = True
+                else:
+                    missed = [e for e in self._history if e.seq > after and (kinds is None or e.kind in kinds)]
+            subscription = Subscription(self, kinds, self.client_buffer)
+            # Registered under the same lock as the history read: nothing is missed or sent twice
+            self._subscribers.append(subscription)
+        return subscription, missed, reset
+
+    def _resume_seq(self, last_event_id):
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        seq = int(seq)
+        oldest = self._history[0].seq if self._history else self._seq + 1
+        if seq < oldest - 1:
+            return None  # events after it have been evicted from the history
+        return seq
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+                if subscription.overflowed:
+                    self._dropped_clients += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._subscribers),
+                "published": self._published,
+                "dropped_clients": self._dropped_clients,
+                "history": len(self._history),
+            }
+
+
+def format_event(event):
+    """One text/event-stream message."""
+    data = json.dumps(event.data, default=str)
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {data}\n\n"
+
+
+def stream(subscription, missed, reset, keepalive_seconds=15.0):
+    """
+    The text/event-stream body for one client: the reset notice or missed
+    events first, then live events, with a comment line whenever the stream
+    has been quiet for keepalive_seconds (which also detects disconnects).
+    """
+    try:
+        yield "retry: 3000\n\n"
+        if reset:
+            yield f"id: {subscription.hub.last_id}\nevent: reset\ndata: {{}}\n\n"
+        for event in missed:
+            yield format_event(event)
+        quiet_since = time.monotonic()
+        while True:
+            events = subscription.get(keepalive_seconds)
+            if events:
+                yield "".join(format_event(event) for event in events)
+                quiet_since = time.monotonic()
+            elif subscription.overflowed:
+                return  # what was queued has been sent; the client resumes from there
+            elif time.monotonic() - quiet_since >= keepalive_seconds:
+                yield ": keepalive\n\n"
+                quiet_since = time.monotonic()
+    finally:
+        subscription.close()
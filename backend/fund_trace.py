@@ -0,0 +1,351 @@
+"""
+In-memory transaction index for /transaction/trace: where did a user's
+money go (forward), or where did it come from (backward), over a few hops.
+
+Edges are kept in CSR segments (as in transaction_graph), in both
+directions, with each user's edges sorted by time, so the edges of one user
+inside a time window are a contiguous slice found by binary search. A trace
+is a hop-bounded BFS that only touches the slices it needs: its cost
+depends on the size of the subgraph it returns, not of the whole graph.
+
+The index is loaded once (the last TRACE_INDEX_DAYS) and then refreshed
+with the transactions added since. New edges go into a small "recent"
+segment rebuilt on each refresh; it is merged into the base segment when it
+grows past a fraction of it. Segments are immutable and swapped in whole,
+so traces never wait on a refresh.
+
+Transactions are indexed with the status they had when loaded.
+"""
+
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from transaction_columns import STATUS_CODES, TransactionColumns
+
+FAILED = STATUS_CODES["failed"]
+
+
+def _iso(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+class Segment:
+    """Immutable CSR over one batch of transactions, indexed by sender and by receiver."""
+
+    def __init__(self, cols):
+        n = len(cols)
+        users, inverse = np.unique(np.concatenate([cols.from_user, cols.to_user]), return_inverse=True)
+        src, dst = inverse[:n].astype(np.int32), inverse[n:].astype(np.int32)
+        order = np.lexsort((cols.tx_id, cols.ts, src))
+
+        self.users = users
+        # Edge columns, sorted by (sender, time)
+        self.src = src[order]
+        self.dst = dst[order]
+        self.ts = cols.ts[order]
+        self.amount = cols.amount[order]
+        self.tx_id = cols.tx_id[order]
+        self.status = cols.status[order]
+        self.out_offsets = self._offsets(self.src, len(users))
+        # Receiver view: positions of the same edges sorted by (receiver, time)
+        self.in_order = np.lexsort((self.tx_id, self.ts, self.dst))
+        self.in_ts = self.ts[self.in_order]
+        self.in_offsets = self._offsets(self.dst, len(users))
+
+    @staticmethod
+    def _offsets(nodes, count):
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(nodes, minlength=count), out=offsets[1:])
+        return offsets
+
+    def __len__(self):
+        return len(self.tx_id)
+
+    def node(self, user_id):
+        pos = int(np.searchsorted(self.users, user_id))
+        if pos < len(self.users) and self.users[pos] == user_id:
+            return pos
+        return None
+
+    def edges(self, node, forward, lo, hi, lo_inclusive=True, hi_inclusive=True):
+        """Positions of the node's out (forward) or in edges with lo <= ts <= hi (bounds as given)."""
+        lo_side = "left" if lo_inclusive else "right"
+        hi_side = "right" if hi_inclusive else "left"
+        if forward:
+            start, end = self.out_offsets[node], self.out_offsets[node + 1]
+            times = self.ts[start:end]
+            return np.arange(
+                start + np.searchsorted(times, lo, lo_side), start + np.searchsorted(times, hi, hi_side)
+            )
+        start, end = self.in_offsets[node], self.in_offsets[node + 1]
+        times = self.in_ts[start:end]
+        positions = slice(start + np.searchsorted(times, lo, lo_side), start + np.searchsorted(times, hi, hi_side))
+        return self.in_order[positions]
+
+    def columns(self, keep=None):
+        """The segment's transactions as TransactionColumns (optionally only the rows in mask keep)."""
+        rows = slice(None) if keep is None else keep
+        return TransactionColumns(
+            self.tx_id[rows], self.users[self.src[rows]], self.users[self.dst[rows]],
+            self.ts[rows], self.amount[rows], self.status[rows],
+        )
+
+
+def _concat(parts):
+    parts = [part for part in parts if len(part)]
+    return TransactionColumns(*(
+        np.concatenate([getattr(part, name) for part in parts])
+        for name in ("tx_id", "from_user", "to_user", "ts", "amount", "status")
+    ))
+
+
+def _group(peers, user_count):
+    """
+    Group edges by counterparty node: (unique nodes, group of each edge,
+    edges per group, first and last edge position of each group). Edges are
+    in time order, so those are a counterparty's first and last transaction.
+    """
+    n = len(peers)
+    if n * 8 < user_count:
+        order = np.argsort(peers, kind="stable")
+        ordered = peers[order]
+        starts = np.flatnonzero(np.concatenate([[True], ordered[1:] != ordered[:-1]]))
+        ends = np.append(starts[1:], n)
+        inverse = np.empty(n, np.int64)
+        inverse[order] = np.repeat(np.arange(len(starts)), ends - starts)
+        return ordered[starts], inverse, ends - starts, order[starts], order[ends - 1]
+    # Hub-sized slices: count straight into per-node slots instead of sorting
+    all_counts = np.bincount(peers, minlength=user_count)
+    unique = np.flatnonzero(all_counts)
+    slot = np.zeros(user_count, np.int64)
+    slot[unique] = np.arange(len(unique))
+    inverse = slot[peers]
+    positions = np.arange(n)
+    first = np.full(len(unique), n, np.int64)
+    np.minimum.at(first, inverse, positions)
+    last = np.zeros(len(unique), np.int64)
+    np.maximum.at(last, inverse, positions)
+    return unique, inverse, all_counts[unique], first, last
+
+
+def _samples(tx_ids, inverse, counts, kept, sample_ids):
+    """The first sample_ids transaction ids of each kept group (kept sorted)."""
+    selected = np.zeros(len(counts), bool)
+    selected[kept] = True
+    rows = np.flatnonzero(selected[inverse])
+    rows = rows[np.argsort(inverse[rows], kind="stable")]
+    grouped = tx_ids[rows].tolist()
+    samples = []
+    start = 0
+    for count in counts[kept].tolist():
+        samples.append(grouped[start: start + min(count, sample_ids)])
+        start += count
+    return samples
+
+
+class FundTraceIndex:
+    def __init__(self, retention_seconds=None, merge_ratio=0.1, min_merge_edges=50_000):
+        self.retention_seconds = retention_seconds  # None = keep everything loaded
+        self.merge_ratio = merge_ratio
+        self.min_merge_edges = min_merge_edges
+        self.segments = ()  # (base, recent); replaced, never mutated
+        self.max_transaction_id = None
+        self.ready = False
+        self.last_refresh = None
+        self._lock = threading.Lock()  # one load/refresh at a time
+
+    def load(self, pages):
+        """Replace the index with the given pages of transaction rows."""
+        with self._lock:
+            cols = TransactionColumns.from_pages(pages)
+            self.segments = (Segment(cols),) if len(cols) else ()
+            self.max_transaction_id = int(cols.tx_id.max()) if len(cols) else None
+            self.ready = True
+            self.last_refresh = time.time()
+
+    def add(self, pages):
+        """Index transactions added since the last load/add. Returns the number indexed."""
+        with self._lock:
+            cols = TransactionColumns.from_pages(pages)
+            self.last_refresh = time.time()
+            if not len(cols):
+                return 0
+            base = self.segments[0] if self.segments else None
+            recent = self.segments[1] if len(self.segments) > 1 else None
+            recent_cols = _concat([recent.columns(), cols]) if recent is not None else cols
+            if base is None:
+                self.segments = (Segment(recent_cols),)
+            elif len(recent_cols) >= max(self.min_merge_edges, len(base) * self.merge_ratio):
+                # Merge, dropping edges past the retention window
+                self.segments = (Segment(_concat([base.columns(self._live(base)), recent_cols])),)
+            else:
+                self.segments = (base, Segment(recent_cols))
+            self.max_transaction_id = max(self.max_transaction_id or 0, int(cols.tx_id.max()))
+            return len(cols)
+
+    def _live(self, segment):
+        if self.retention_seconds is None:
+            return None
+        return segment.ts >= time.time() - self.retention_seconds
+
+    def stats(self):
+        segments = self.segments
+        return {
+            "ready": self.ready,
+            "edges": sum(len(segment) for segment in segments),
+            "segments": len(segments),
+            "max_transaction_id": self.max_transaction_id,
+            "last_refresh": self.last_refresh,
+        }
+
+    # ------------------------------
+    # Tracing
+    # ------------------------------
+
+    def trace(self, user_id, forward=True, hops=3, since=None, until=None, min_amount=0.0,
+              include_failed=False, time_ordered=True, max_nodes=500, sample_ids=5):
+        """
+        Hop-bounded BFS from user_id over transactions in [since, until]
+        (epoch seconds) of at least min_amount.
+
+        With time_ordered, a hop only follows transactions after (forward) or
+        before (backward) the money reached that user: each user keeps the
+        earliest arrival (latest departure backward) found within the hop
+        limit, and is expanded again for the extra edges when it improves.
+
+        Each user's transactions to one counterparty are aggregated into a
+        flow. At most max_nodes users are returned; the largest flows of a
+        user are followed first.
+        """
+        segments = self.segments
+        since = -np.inf if since is None else since
+        until = np.inf if until is None else until
+        # bound[user]: money is at user from this time on (forward) / up to this time (backward)
+        bound = {user_id: since if forward else until}
+        hop_of = {user_id: 0}
+        expanded = {}  # user -> bound used for the edges already followed
+        flows = {}  # (from_user, to_user) -> [transactions, amount, first_ts, last_ts, sample ids]
+        truncated = False
+        frontier = [user_id]
+
+        for hop in range(1, hops + 1):
+            improved = {}
+            # Bounds as of the previous hop: a user improved during this hop is expanded again in the next
+            frontier = [(user, bound[user]) for user in frontier]
+            for user, at in frontier:
+                if not time_ordered:
+                    at = since if forward else until
+                previous = expanded.get(user)
+                expanded[user] = at
+                for segment in segments:
+                    node = segment.node(user)
+                    if node is None:
+                        continue
+                    # Only the edges the previous expansion of this user did not cover
+                    if forward:
+                        hi, hi_inclusive = (until, True) if previous is None else (previous, False)
+                        edges = segment.edges(node, True, at, hi, True, hi_inclusive)
+                    else:
+                        lo, lo_inclusive = (since, True) if previous is None else (previous, False)
+                        edges = segment.edges(node, False, lo, at, lo_inclusive, True)
+                    if not len(edges):
+                        continue
+                    keep = segment.amount[edges] >= min_amount
+                    if not include_failed:
+                        keep &= segment.status[edges] != FAILED
+                    edges = edges[keep]
+                    if not len(edges):
+                        continue
+                    truncated |= self._follow(
+                        segment, user, edges, forward, time_ordered, hop, bound, hop_of, flows, improved,
+                        max_nodes, sample_ids,
+                    )
+            frontier = list(improved)
+            if not frontier:
+                break
+
+        return self._result(user_id, forward, hop_of, bound, flows, truncated)
+
+    @staticmethod
+    def _follow(segment, user, edges, forward, time_ordered, hop, bound, hop_of, flows, improved,
+                max_nodes, sample_ids):
+        """Aggregate one user's matching edges by counterparty and move the money on. Returns truncated."""
+        peers = (segment.dst if forward else segment.src)[edges]
+        unique, inverse, counts, first, last = _group(peers, len(segment.users))
+        totals = np.bincount(inverse, weights=segment.amount[edges], minlength=len(unique))
+        peer_ids = segment.users[unique]
+
+        # Counterparties already in the trace, then the largest new ones while there is room
+        known = np.isin(peer_ids, np.fromiter(hop_of, np.int64, len(hop_of)))
+        new = np.flatnonzero(~known)
+        room = max(0, max_nodes - len(hop_of))
+        truncated = len(new) > room
+        if truncated:
+            new = new[np.argpartition(-totals[new], room - 1)[:room]] if room else new[:0]
+        kept = np.sort(np.concatenate([np.flatnonzero(known), new]))
+        samples = _samples(segment.tx_id[edges], inverse, counts, kept, sample_ids)
+
+        ts = segment.ts[edges]
+        rows = zip(
+            peer_ids[kept].tolist(), counts[kept].tolist(), totals[kept].tolist(),
+            ts[first[kept]].tolist(), ts[last[kept]].tolist(), samples,
+        )
+        for peer, count, total, first_ts, last_ts, sample in rows:
+            hop_of.setdefault(peer, hop)
+            key = (user, peer) if forward else (peer, user)
+            flow = flows.get(key)
+            if flow is None:
+                flows[key] = [count, total, first_ts, last_ts, sample]
+            else:
+                flow[0] += count
+                flow[1] += total
+                flow[2] = min(flow[2], first_ts)
+                flow[3] = max(flow[3], last_ts)
+                flow[4] = sorted(set(flow[4] + sample))[:sample_ids]
+            # Earliest arrival forward, latest departure backward; without time
+            # ordering, a user is only expanded the first time it is reached
+            reached = first_ts if forward else last_ts
+            current = bound.get(peer)
+            if current is None or (time_ordered and (reached < current if forward else reached > current)):
+                bound[peer] = reached
+                improved[peer] = reached
+        return truncated
+
+    @staticmethod
+    def _result(user_id, forward, hop_of, bound, flows, truncated):
+        amount_in, amount_out = {}, {}
+        flow_list = []
+        for (from_user, to_user), (count, total, first_ts, last_ts, sample) in flows.items():
+            amount_out[from_user] = amount_out.get(from_user, 0.0) + total
+            amount_in[to_user] = amount_in.get(to_user, 0.0) + total
+            flow_list.append({
+                "from_user_id": from_user,
+                "to_user_id": to_user,
+                "transactions": count,
+                "amount": round(total, 2),
+                "first_at": _iso(first_ts),
+                "last_at": _iso(last_ts),
+                "transaction_ids": sample,
+            })
+        flow_list.sort(key=lambda flow: -flow["amount"])
+        nodes = [
+            {
+                "user_id": user,
+                "hop": hop,
+                # When the money reached this user (forward) / last left it (backward) on the traced paths
+                "reached_at": _iso(bound[user]) if hop else None,
+                "amount_in": round(amount_in.get(user, 0.0), 2),
+                "amount_out": round(amount_out.get(user, 0.0), 2),
+            }
+            for user, hop in sorted(hop_of.items(), key=lambda item: (item[1], item[0]))
+        ]
+        return {
+            "user_id": user_id,
+            "direction": "forward" if forward else "backward",
+            "nodes": nodes,
+            "flows": flow_list,
+            "truncated": truncated,
+        }
@@ -0,0 +1,223 @@
+"""
+GeoIP lookup layer for the anti-fraud service.
+
+Opens the GeoLite2 City database memory-mapped and keeps a bounded LRU of
+compact per-IP results (country, region, city, lat, lon) so repeated logins
+from the same address never touch the database again. A new mmdb dropped in
+place of the old one (via rename) is picked up and swapped in atomically.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional
+
+import maxminddb
+
+
+class GeoResult(NamedTuple):
+    country: Optional[str]
+    region: Optional[str]
+    city: Optional[str]
+    latitude: Optional[float]
+    longitude: Optional[float]
+
+    def to_dict(self):
+        return self._asdict()
+
+
+EMPTY_RESULT = GeoResult(None, None, None, None, None)
+
+
+def _name(record):
+    if not record:
+        return None
+    return record.get("names", {}).get("en")
+
+
+def _compact(record) -> GeoResult:
+    """Reduce a raw City record to the five fields we store in ip_logs."""
+    if not record:
+        return EMPTY_RESULT
+    subdivisions = record.get("subdivisions") or [{}]
+    location = record.get("location") or {}
+    return GeoResult(
+        country=_name(record.get("country")),
+        region=_name(subdivisions[-1]),  # most specific subdivision
+        city=_name(record.get("city")),
+        latitude=location.get("latitude"),
+        longitude=location.get("longitude"),
+    )
+
+
+def _open_mmap(path):
+    try:
+        return maxminddb.open_database(path, maxminddb.MODE_MMAP_EXT)
+    except ValueError:
+        # C extension not available, fall back to the pure Python mmap reader
+        return maxminddb.open_database(path, maxminddb.MODE_MMAP)
+
+
+class GeoIPResolver:
+    """
+    Thread-safe, memory-mapped GeoIP resolver with an LRU result cache.
+
+    Lookups that fail (unknown or malformed address, missing database) resolve
+    to EMPTY_RESULT, matching the previous behaviour of log_ip.
+
+    The database is opened by reload(force=True), or else by the first lookup,
+    so creating a resolver opens no files.
+    """
+
+    def __init__(self, db_path, cache_size=100_000, reload_check_interval=30.0):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.reload_check_interval = reload_check_interval
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._reader = None
+        self._db_signature = None
+        self._generation = 0
+        self._last_check = 0.0
+        self._opened = False
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    # ------------------------------
+    # Database lifecycle
+    # ------------------------------
+
+    def _signature(self):
+        try:
+            st = os.stat(self.db_path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def reload(self, force=False) -> bool:
+        """
+        Open the mmdb again if it changed on disk and swap it in.
+
+        The new reader is fully opened before the swap, so lookups never see a
+        half-loaded database. The old reader is not closed explicitly: in-flight
+        lookups may still hold it and its mapping stays valid after a rename.
+        """
+        self._opened = True
+        signature = self._signature()
+        if not force and signature == self._db_signature:
+            return False
+        if signature is None:
+            new_reader = None
+        else:
+            try:
+                new_reader = _open_mmap(self.db_path)
+            except (OSError, maxminddb.InvalidDatabaseError) as e:
+                print(f"GeoIP reload failed, keeping current database: {e}")
+                return False
+
+        with self._lock:
+            self._reader = new_reader
+            self._db_signature = signature
+            self._generation += 1
+            self._cache.clear()
+            if new_reader is not None:
+                self.reloads += 1
+        return True
+
+    def _maybe_reload(self):
+        if not self._opened:
+            self.reload(force=True)
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.reload_check_interval:
+            return
+        self._last_check = now
+        self.reload()
+
+    # ------------------------------
+    # Lookups
+    # ------------------------------
+
+    def _lookup(self, reader, ip_address) -> GeoResult:
+        if reader is None:
+            return EMPTY_RESULT
+        try:
+            return _compact(reader.get(ip_address))
+        except (ValueError, TypeError):
+            # Malformed address or closed reader
+            return EMPTY_RESULT
+
+    def resolve(self, ip_address) -> GeoResult:
+        """Resolve one IP, serving repeats from the LRU."""
+        self._maybe_reload()
+
+        with self._lock:
+            cached = self._cache.get(ip_address)
+            if cached is not None:
+                self._cache.move_to_end(ip_address)
+                self.hits += 1
+                return cached
+            self.misses += 1
+            reader = self._reader
+            generation = self._generation
+
+        result = self._lookup(reader, ip_address)
+
+        with self._lock:
+            # Drop results read from a database that was swapped out meanwhile
+            if generation == self._generation:
+                self._cache[ip_address] = result
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def resolve_many(self, ip_addresses: Iterable[str], use_cache=False) -> Dict[str, GeoResult]:
+        """
+        Resolve a batch of IPs, e.g. for backfilling ip_logs.
+
+        Duplicates are looked up once. By default results are not inserted into
+        the LRU so a large backfill does not evict the hot login addresses;
+        already-cached entries are still reused.
+        """
+        self._maybe_reload()
+
+        results = {}
+        pending = []
+        with self._lock:
+            for ip in ip_addresses:
+                if ip in results:
+                    continue
+                cached = self._cache.get(ip)
+                if cached is not None:
+                    results[ip] = cached
+                else:
+                    results[ip] = EMPTY_RESULT
+                    pending.append(ip)
+            reader = self._reader
+
+        for ip in pending:
+            results[ip] = self._lookup(reader, ip)
+
+        if use_cache and pending:
+            with self._lock:
+                for ip in pending:
+                    self._cache[ip] = results[ip]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "db_path": self.db_path,
+                "db_loaded": self._reader is not None,
+                "cache_size": len(self._cache),
+                "cache_capacity": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+            }
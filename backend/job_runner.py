@@ -0,0 +1,360 @@
+"""
+Background job runner for the long batch jobs (trust recalculation, fraud
+checks), so they no longer live and die with a single HTTP request.
+
+A job splits its keyspace into shards. Shards run on a process pool (or
+inline for jobs that need the service's in-memory state) and checkpoint
+their own progress to a JSON file after every page of work. A run that
+was interrupted, by a crash or a restart, is resumed from those
+checkpoints the next time the job starts; finished shards are not run
+again.
+
+Only one run of a job is active at a time, across every process sharing
+the state directory: starting a job takes a non-blocking file lock on
+<state_dir>/<job>.lock. An internal scheduler starts each job on its
+interval and resumes runs whose process died.
+
+Each job keeps its keep_runs most recent finished runs on disk; older run
+directories are deleted when a run finishes. <state_dir>/<job>/latest.json
+holds the id of the newest run, so finding it needs no directory listing.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+import metrics
+from background import start_periodic
+
+try:
+    import fcntl
+except ImportError:  # Windows: the in-process lock still applies
+    fcntl = None
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _write_json(path, data):
+    """Write atomically so a crash mid-save keeps the previous checkpoint."""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, default=str)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class JobCheckpoint:
+    """Files of one run: run.json plus shard-<index>.json per shard. Picklable, for workers."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def save_run(self, run):
+        _write_json(os.path.join(self.directory, "run.json"), run)
+
+    def load_run(self):
+        return _read_json(os.path.join(self.directory, "run.json"))
+
+    def save_shard(self, shard):
+        _write_json(os.path.join(self.directory, f"shard-{shard['index']}.json"), shard)
+
+    def load_shards(self):
+        run = self.load_run()
+        return [
+            _read_json(os.path.join(self.directory, f"shard-{index}.json"))
+            for index in range(run["shard_count"])
+        ]
+
+
+class Job:
+    """
+    plan(params) -> list of shard dicts (keyspace bounds etc.), called once per run
+    run_shard(checkpoint, shard) -> shard, a picklable top-level function when
+        in_process is False; it must checkpoint.save_shard() as it goes, and
+        may add {phase: seconds} to shard["timings"] for the job metrics
+    finish(run, shards) -> summary dict, called in the service process afterwards
+    """
+
+    def __init__(self, name, plan, run_shard, finish=None, interval_seconds=0, in_process=False):
+        self.name = name
+        self.plan = plan
+        self.run_shard = run_shard
+        self.finish = finish
+        self.interval_seconds = interval_seconds
+        self.in_process = in_process
+
+
+class JobRunner:
+    def __init__(self, state_dir, workers=4, retry_seconds=300, keep_runs=100):
+        self.state_dir = state_dir
+        self.workers = workers
+        self.retry_seconds = retry_seconds
+        self.keep_runs = keep_runs
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._running = {}  # job name -> (run_id, lock file, done event)
+
+    def register(self, job):
+        self.jobs[job.name] = job
+
+    # ------------------------------
+    # Runs on disk
+    # ------------------------------
+
+    def _run_dirs(self, name):
+        directory = os.path.join(self.state_dir, name)
+        if not os.path.isdir(directory):
+            return []
+        # Run ids start with a sortable timestamp
+        return [os.path.join(directory, d) for d in sorted(os.listdir(directory), reverse=True)
+                if os.path.isfile(os.path.join(directory, d, "run.json"))]
+
+    def _find(self, run_id):
+        for name in self.jobs:
+            path = os.path.join(self.state_dir, name, run_id)
+            if os.path.isfile(os.path.join(path, "run.json")):
+                return JobCheckpoint(path)
+        return None
+
+    def status(self, run_id):
+        """Run with its shards' progress, or None if unknown."""
+        checkpoint = self._find(run_id)
+        if checkpoint is None:
+            return None
+        run = checkpoint.load_run()
+        shards = checkpoint.load_shards()
+        run["shards"] = [{k: v for k, v in shard.items() if k != "pending"} for shard in shards]
+        run["shards_done"] = sum(shard["status"] == "done" for shard in shards)
+        return run
+
+    def runs(self, name, limit=10):
+        return [JobCheckpoint(path).load_run() for path in self._run_dirs(name)[:limit]]
+
+    def latest_run(self, name):
+        directory = os.path.join(self.state_dir, name)
+        try:
+            run_id = _read_json(os.path.join(directory, "latest.json"))["run_id"]
+            return JobCheckpoint(os.path.join(directory, run_id)).load_run()
+        except (OSError, ValueError, KeyError):
+            # No pointer yet (or it names a run being created): fall back to the listing
+            runs = self.runs(name, limit=1)
+            return runs[0] if runs else None
+
+    def _prune(self, name):
+        """Delete the run directories of all but the keep_runs newest finished runs."""
+        finished = 0
+        for path in self._run_dirs(name):
+            try:
+                status = JobCheckpoint(path).load_run()["status"]
+            except (OSError, ValueError):
+                continue
+            if status not in ("done", "failed"):
+                continue
+            finished += 1
+            if finished > self.keep_runs:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def is_running(self, name):
+        with self._lock:
+            return name in self._running
+
+    @contextmanager
+    def hold(self, name, poll_seconds=1.0):
+        """
+        Keep the job from running for the duration of the block, first
+        waiting for a running one to end. Meanwhile it counts as running:
+        start() returns (None, False) and the scheduler skips it.
+        """
+        while self._acquire(name) is None:
+            time.sleep(poll_seconds)
+        try:
+            yield
+        finally:
+            self._release(name)
+
+    # ------------------------------
+    # Starting and resuming
+    # ------------------------------
+
+    def _acquire(self, name):
+        """Single-runner lock for a job: in-process first, then across processes."""
+        with self._lock:
+            if name in self._running:
+                return None
+            os.makedirs(self.state_dir, exist_ok=True)
+            lock_file = open(os.path.join(self.state_dir, f"{name}.lock"), "w")
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    return None
+            self._running[name] = (None, lock_file, threading.Event())
+            return lock_file
+
+    def _release(self, name):
+        with self._lock:
+            _, lock_file, done = self._running.pop(name)
+        lock_file.close()  # also releases the flock
+        done.set()
+
+    def start(self, name, params=None, wait=False):
+        """
+        Start the job, or resume its latest run if that one did not finish.
+        Returns (run, resumed), or (None, False) if the job is already running
+        here or in another process. With wait=True, blocks until the run ends.
+        """
+        job = self.jobs[name]
+        if self._acquire(name) is None:
+            return None, False
+        try:
+            latest = self.latest_run(name)
+            if latest is not None and latest["status"] != "done":
+                checkpoint = self._find(latest["run_id"])
+                run, resumed = latest, True
+                run["status"] = "pending"
+                checkpoint.save_run(run)
+            else:
+                run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+                checkpoint = JobCheckpoint(os.path.join(self.state_dir, name, run_id))
+                os.makedirs(checkpoint.directory)
+                params = dict(params or {})
+                with metrics.job_phase(name, "plan"):
+                    shards = job.plan(params)
+                run = {
+                    "run_id": run_id,
+                    "job": name,
+                    "status": "pending",
+                    "params": params,
+                    "shard_count": len(shards),
+                    "created_at": _utcnow(),
+                    "started_at": None,
+                    "finished_at": None,
+                    "summary": None,
+                    "error": None,
+                }
+                for index, shard in enumerate(shards):
+                    checkpoint.save_shard(
+                        {"index": index, "status": "pending", "params": params, "cursor": None,
+                         "pending": None, "error": None, **shard}
+                    )
+                checkpoint.save_run(run)
+                _write_json(os.path.join(self.state_dir, name, "latest.json"), {"run_id": run_id})
+                resumed = False
+        except BaseException:
+            self._release(name)
+            raise
+
+        with self._lock:
+            _, lock_file, done = self._running[name]
+            self._running[name] = (run["run_id"], lock_file, done)
+        thread = threading.Thread(
+            target=self._execute, args=(job, checkpoint), name=f"job-{name}", daemon=True
+        )
+        thread.start()
+        if wait:
+            done.wait()
+            run = checkpoint.load_run()
+        return run, resumed
+
+    def _execute(self, job, checkpoint):
+        run = checkpoint.load_run()
+        run.update(status="running", started_at=run["started_at"] or _utcnow(), error=None)
+        checkpoint.save_run(run)
+        try:
+            shards = [shard for shard in checkpoint.load_shards() if shard["status"] != "done"]
+            for shard in shards:
+                shard.update(status="running", error=None)
+                checkpoint.save_shard(shard)
+
+            failures = []
+            started = time.perf_counter()
+            if job.in_process or self.workers <= 1:
+                for shard in shards:
+                    failures += self._finish_shard(job, checkpoint, shard, lambda s=shard: job.run_shard(checkpoint, s))
+            else:
+                # Spawned, not forked: the service process has threads holding locks
+                with ProcessPoolExecutor(self.workers, mp_context=get_context("spawn")) as pool:
+                    futures = {pool.submit(job.run_shard, checkpoint, shard): shard for shard in shards}
+                    for future in as_completed(futures):
+                        failures += self._finish_shard(job, checkpoint, futures[future], future.result)
+            metrics.observe_job_phase(job.name, "shards", time.perf_counter() - started)
+
+            all_shards = checkpoint.load_shards()
+            if failures:
+                run.update(status="failed", error="; ".join(failures))
+            else:
+                with metrics.job_phase(job.name, "finish"):
+                    summary = job.finish(run, all_shards) if job.finish else None
+                run.update(status="done", summary=summary)
+        except Exception as e:
+            run.update(status="failed", error=str(e))
+        finally:
+            try:
+                run["finished_at"] = _utcnow()
+                checkpoint.save_run(run)
+                self._prune(job.name)
+            finally:
+                self._release(job.name)
+
+    @staticmethod
+    def _finish_shard(job, checkpoint, shard, result):
+        try:
+            done = result()
+        except Exception as e:
+            # Keep whatever progress the worker checkpointed, so a resume continues from there
+            latest = next(s for s in checkpoint.load_shards() if s["index"] == shard["index"])
+            latest.update(status="failed", error=str(e))
+            checkpoint.save_shard(latest)
+            print(f"[job {checkpoint.directory}] shard {shard['index']} failed: {e}")
+            return [f"shard {shard['index']}: {e}"]
+        done.update(status="done", error=None)
+        checkpoint.save_shard(done)
+        for phase, seconds in (done.get("timings") or {}).items():
+            metrics.observe_job_phase(job.name, f"shard {phase}", seconds)
+        return []
+
+    # ------------------------------
+    # Scheduler
+    # ------------------------------
+
+    def _due(self, job):
+        latest = self.latest_run(job.name)
+        if latest is None:
+            return True
+        if latest["status"] in ("pending", "running"):
+            # Interrupted: its runner is gone, or starting will fail on the lock
+            return True
+        elapsed = (datetime.now(timezone.utc) - datetime.fromisoformat(latest["finished_at"])).total_seconds()
+        if latest["status"] == "failed":
+            return elapsed >= min(self.retry_seconds, job.interval_seconds)
+        return elapsed >= job.interval_seconds
+
+    def tick(self):
+        for job in self.jobs.values():
+            if job.interval_seconds and not self.is_running(job.name) and self._due(job):
+                run, resumed = self.start(job.name)
+                if run is not None:
+                    print(f"[job-scheduler] {'resumed' if resumed else 'started'} {job.name} run {run['run_id']}")
+
+    def start_scheduler(self, poll_seconds=30):
+        return start_periodic("job-scheduler", poll_seconds, self.tick)
@@ -0,0 +1,139 @@
+"""
+In-process recent-login history for /ip/ipcheck.
+
+Keeps each user's logins from the last 30 minutes in per-minute buckets so the
+"different IP and country within 30 mins" check is answered from memory
+instead of a select on ip_logs.
+"""
+
+import threading
+from collections import deque
+from datetime import datetime
+
+
+def _to_epoch(ts):
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        # naive datetimes in this service are UTC (datetime.utcnow)
+        return (ts - datetime(1970, 1, 1)).total_seconds()
+    return ts.timestamp()
+
+
+class RecentLogins:
+    """
+    Per-user sliding window of (ip_address, country) pairs.
+
+    Each user maps to a deque of [bucket, {(ip, country), ...}] ordered by
+    bucket, where a bucket is bucket_seconds wide. Only distinct pairs are kept
+    per bucket, so a user hammering login from one address costs one entry a
+    minute.
+    """
+
+    def __init__(self, window_seconds=1800, bucket_seconds=60, sweep_every=10_000):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.sweep_every = sweep_every
+
+        self._lock = threading.Lock()
+        self._users = {}
+        self._ops = 0
+
+    def _oldest_bucket(self, now):
+        return int((now - self.window_seconds) // self.bucket_seconds)
+
+    def _prune(self, buckets, oldest):
+        # A bucket is kept if any part of it may fall inside the window
+        while buckets and buckets[0][0] < oldest:
+            buckets.popleft()
+
+    def _sweep(self, now):
+        oldest = self._oldest_bucket(now)
+        idle = [
+            user_id
+            for user_id, buckets in self._users.items()
+            if not buckets or buckets[-1][0] < oldest
+        ]
+        for user_id in idle:
+            del self._users[user_id]
+
+    def record(self, user_id, ip_address, country, ts):
+        """Add a login to the user's history."""
+        now = _to_epoch(ts)
+        with self._lock:
+            self._record(str(user_id), ip_address, country, now)
+
+    def find_anomaly(self, user_id, ip_address, country, ts):
+        """
+        Return True if the user logged in from a different IP *and* a
+        different country within the window.
+        """
+        now = _to_epoch(ts)
+        with self._lock:
+            return self._find_anomaly(str(user_id), ip_address, country, now)
+
+    def check_and_record(self, user_id, ip_address, country, ts):
+        """
+        Check for an anomaly against previous logins, then record this one,
+        under one lock acquisition: of two concurrent logins by the same user,
+        the second always sees the first.
+        """
+        now = _to_epoch(ts)
+        key = str(user_id)
+        with self._lock:
+            is_anomaly = self._find_anomaly(key, ip_address, country, now)
+            self._record(key, ip_address, country, now)
+        return is_anomaly
+
+    # Callers hold self._lock
+
+    def _record(self, key, ip_address, country, now):
+        bucket = int(now // self.bucket_seconds)
+        buckets = self._users.get(key)
+        if buckets is None:
+            buckets = self._users[key] = deque()
+        if buckets and buckets[-1][0] == bucket:
+            buckets[-1][1].add((ip_address, country))
+        elif buckets and buckets[-1][0] > bucket:
+            # Late row (e.g. warm-up out of order): insert in place
+            for entry in buckets:
+                if entry[0] == bucket:
+                    entry[1].add((ip_address, country))
+                    break
+            else:
+                buckets.append([bucket, {(ip_address, country)}])
+                ordered = sorted(buckets, key=lambda e: e[0])
+                buckets.clear()
+                buckets.extend(ordered)
+        else:
+            buckets.append([bucket, {(ip_address, country)}])
+        self._prune(buckets, self._oldest_bucket(now))
+
+        self._ops += 1
+        if self._ops % self.sweep_every == 0:
+            self._sweep(now)
+
+    def _find_anomaly(self, key, ip_address, country, now):
+        buckets = self._users.get(key)
+        if not buckets:
+            return False
+        self._prune(buckets, self._oldest_bucket(now))
+        for _, pairs in buckets:
+            for seen_ip, seen_country in pairs:
+                if seen_ip != ip_address and seen_country != country:
+                    return True
+        return False
+
+    def warm(self, rows):
+        """Load recent ip_logs rows (user_id, ip_address, country, checked_at)."""
+        count = 0
+        for row in rows:
+            self.record(row["user_id"], row["ip_address"], row["country"], row["checked_at"])
+            count += 1
+        return count
+
+    def __len__(self):
+        with self._lock:
+            return len(self._users)
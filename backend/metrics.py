@@ -0,0 +1,262 @@
+"""
+Request, storage, GeoIP and batch-job instrumentation, exposed at /metrics
+in the Prometheus text format (rendered here, no client library needed).
+
+- instrument(blueprint) times every request of a blueprint: latency
+  histogram and status counts per route
+- record_storage_call is a QueryStats listener: call counts, rows and
+  durations per table and operation
+- timed(...) times a block into a histogram, e.g. GeoIP lookups and
+  batch-job phases (job_phase)
+
+While a request runs, the storage calls and timed blocks it triggers are also
+collected per stage. With SLOW_REQUEST_MS set, requests slower than that are
+logged with this per-stage breakdown.
+"""
+
+import bisect
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+_slow_ms = os.getenv("SLOW_REQUEST_MS")
+SLOW_REQUEST_MS = float(_slow_ms) if _slow_ms else None
+
+
+# ------------------------------
+# Metric types
+# ------------------------------
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> count
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, seconds, *labels):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += seconds
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(entry)) for labels, entry in self._values.items())
+        for labels, entry in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), entry[:-1]):
+                cumulative += count
+                le = _labels(self.labelnames, labels, [("le", _number(bound))])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(entry[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # fn() -> [(name, kind, help, [(labels dict, value)])], read at scrape time
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for collect in self.collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels, labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    "antifraud_http_requests_total", "Requests handled, by route and status", ("blueprint", "route", "method", "status")
+)
+REQUEST_SECONDS = registry.histogram(
+    "antifraud_http_request_duration_seconds", "Request latency by route", ("blueprint", "route", "method")
+)
+STORAGE_CALLS = registry.counter(
+    "antifraud_storage_calls_total", "Storage queries by table and operation", ("table", "operation")
+)
+STORAGE_ROWS = registry.counter(
+    "antifraud_storage_rows_total", "Rows returned by storage queries", ("table", "operation")
+)
+STORAGE_SECONDS = registry.histogram(
+    "antifraud_storage_call_duration_seconds", "Storage query latency by table and operation", ("table", "operation")
+)
+GEOIP_SECONDS = registry.histogram(
+    "antifraud_geoip_lookup_duration_seconds", "GeoIP lookup time (single IP or batch)", ("kind",)
+)
+JOB_PHASE_SECONDS = registry.histogram(
+    "antifraud_job_phase_duration_seconds", "Batch job phase durations", ("job", "phase"), buckets=JOB_BUCKETS
+)
+
+
+# ------------------------------
+# Per-request stages
+# ------------------------------
+
+# Stage -> [calls, seconds] of the request being handled; copied into storage worker threads
+_stages = contextvars.ContextVar("request_stages", default=None)
+_stages_lock = threading.Lock()  # gathered queries of one request finish on different threads
+
+
+def record_stage(stage, seconds):
+    stages = _stages.get()
+    if stages is not None:
+        with _stages_lock:
+            entry = stages.setdefault(stage, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+
+@contextmanager
+def timed(histogram, *labels, stage=None):
+    """Observe the block's duration, and count it as a stage of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, *labels)
+        if stage is not None:
+            record_stage(stage, elapsed)
+
+
+def job_phase(job, phase):
+    return timed(JOB_PHASE_SECONDS, job, phase, stage=f"{job} {phase}")
+
+
+def observe_job_phase(job, phase, seconds):
+    """For phases timed elsewhere, e.g. in a job worker process."""
+    JOB_PHASE_SECONDS.observe(seconds, job, phase)
+
+
+def record_storage_call(table, op, seconds, rows):
+    """QueryStats listener."""
+    STORAGE_CALLS.inc(table, op)
+    STORAGE_ROWS.inc(table, op, amount=rows)
+    STORAGE_SECONDS.observe(seconds, table, op)
+    record_stage(f"storage {table}.{op}", seconds)
+
+
+# ------------------------------
+# Blueprint middleware
+# ------------------------------
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_stages = {}
+    g.metrics_stages_token = _stages.set(g.metrics_stages)
+
+
+def _after_request(response):
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    stages = g.pop("metrics_stages")
+    try:
+        _stages.reset(g.pop("metrics_stages_token"))
+    except ValueError:
+        _stages.set(None)  # reset from another context (e.g. an async view's thread)
+
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    blueprint = request.blueprint or ""
+    REQUESTS.inc(blueprint, route, request.method, str(response.status_code))
+    REQUEST_SECONDS.observe(elapsed, blueprint, route, request.method)
+    if SLOW_REQUEST_MS is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+        log_slow_request(request.method, request.full_path.rstrip("?"), response.status_code, elapsed, stages)
+    return response
+
+
+def log_slow_request(method, path, status, elapsed, stages):
+    accounted = sum(seconds for _, seconds in stages.values())
+    parts = [
+        f"{stage} {seconds * 1000:.1f} ms" + (f" x{calls}" if calls > 1 else "")
+        for stage, (calls, seconds) in sorted(stages.items(), key=lambda item: -item[1][1])
+    ]
+    # Concurrent storage calls can add up to more than the request took
+    parts.append(f"other {max(0.0, elapsed - accounted) * 1000:.1f} ms")
+    print(f"[slow-request] {method} {path} {status} {elapsed * 1000:.1f} ms: {', '.join(parts)}")
+
+
+def instrument(blueprint):
+    """Time every request of the blueprint."""
+    blueprint.before_request(_before_request)
+    blueprint.after_request(_after_request)
+    return blueprint
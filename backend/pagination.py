@@ -0,0 +1,147 @@
+"""
+Keyset pagination, column projection and NDJSON streaming for the list
+endpoints of the anti-fraud service.
+
+Each list endpoint describes its table with a ListQuery: the key column used
+as the cursor, the columns callers may project, and the query parameters that
+map to server-side filters. Pages are fetched with
+`key > after_id ORDER BY key LIMIT n`, so the cost of a page does not grow
+with how deep into the table it is.
+"""
+
+import json
+from datetime import datetime
+
+from flask import Response, jsonify, stream_with_context
+
+# PostgREST caps responses at 1000 rows by default, which is also what the
+# unpaginated endpoints effectively returned before.
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 1000
+
+NEXT_CURSOR_HEADER = "X-Next-After-Id"
+
+
+def parse_bool(value):
+    lowered = value.lower()
+    if lowered not in ("true", "false"):
+        raise ValueError(f"expected true or false, got {value!r}")
+    return lowered == "true"
+
+
+def parse_timestamp(value):
+    # Validate and normalise, PostgREST accepts ISO 8601
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).isoformat()
+
+
+class ListQuery:
+    """
+    filters maps a query parameter to (column, operator, parser), where
+    operator is one of "eq", "gte", "lte" and parser turns the raw string
+    into the value sent to Supabase (raising ValueError if invalid).
+    """
+
+    def __init__(self, table, key, columns, filters=None, transform=None):
+        self.table = table
+        self.key = key
+        self.columns = tuple(columns)
+        self.filters = filters or {}
+        self.transform = transform
+
+    def parse(self, args):
+        columns = args.get("columns")
+        if columns:
+            selected = [c.strip() for c in columns.split(",") if c.strip()]
+            unknown = [c for c in selected if c not in self.columns]
+            if unknown:
+                raise ValueError(f"unknown columns: {', '.join(unknown)}")
+            if self.key not in selected:
+                selected.insert(0, self.key)  # the cursor column is always returned
+        else:
+            selected = list(self.columns)
+
+        after_id = args.get("after_id")
+        if after_id is not None:
+            after_id = int(after_id)
+
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+        filters = []
+        for param, (column, op, parser) in self.filters.items():
+            raw = args.get(param)
+            if raw is None or raw == "":
+                continue
+            try:
+                filters.append((column, op, parser(raw)))
+            except ValueError as e:
+                raise ValueError(f"invalid {param}: {e}")
+
+        fmt = args.get("format", "json")
+        if fmt not in ("json", "ndjson"):
+            raise ValueError("format must be json or ndjson")
+
+        return {
+            "columns": selected,
+            "filters": filters,
+            "after_id": after_id,
+            "limit": limit,
+            "format": fmt,
+        }
+
+    def fetch_page(self, client, columns, filters, after_id, limit):
+        query = client.table(self.table).select(",".join(columns))
+        for column, op, value in filters:
+            query = getattr(query, op)(column, value)
+        if after_id is not None:
+            query = query.gt(self.key, after_id)
+        rows = query.order(self.key).limit(limit).execute().data or []
+        if self.transform:
+            rows = [self.transform(row) for row in rows]
+        return rows
+
+    def iter_pages(self, client, columns, filters, after_id=None, page_size=MAX_PAGE_SIZE):
+        """Yield every matching row page by page, following the key cursor."""
+        while True:
+            rows = self.fetch_page(client, columns, filters, after_id, page_size)
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            after_id = rows[-1][self.key]
+
+    def iter_rows(self, client, columns, filters, after_id=None, page_size=MAX_PAGE_SIZE):
+        """Yield every matching row, one page in memory at a time."""
+        for rows in self.iter_pages(client, columns, filters, after_id, page_size):
+            yield from rows
+
+    def respond(self, client, args):
+        """
+        Build the Flask response for a list request.
+
+        JSON mode returns one page as an array and sets X-Next-After-Id when
+        there may be more rows. NDJSON mode streams every matching row,
+        fetching page by page.
+        """
+        try:
+            params = self.parse(args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if params["format"] == "ndjson":
+            def generate():
+                for row in self.iter_rows(
+                    client, params["columns"], params["filters"], params["after_id"], params["limit"]
+                ):
+                    yield json.dumps(row, default=str) + "\n"
+
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        rows = self.fetch_page(
+            client, params["columns"], params["filters"], params["after_id"], params["limit"]
+        )
+        response = jsonify(rows)
+        if len(rows) == params["limit"]:
+            response.headers[NEXT_CURSOR_HEADER] = str(rows[-1][self.key])
+        return response
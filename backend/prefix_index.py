@@ -0,0 +1,209 @@
+"""
+CIDR prefix index over active IPs for subnet-level shared-access detection.
+
+A multibit radix trie per address family. Each level of the trie is one of
+the tracked prefix lengths (e.g. /8, /16, /20, /24 ... /32 for IPv4), and every
+node keeps the distinct users active anywhere under its prefix (with a
+refcount of how many of their IPs fall under it) and the number of active IPs.
+"How many users under 10.1.2.0/24" is a walk of a few dict lookups, and
+lengths between two tracked levels are answered from the next level down.
+
+Fed incrementally by SharedIPIndex: add() when a user is first seen on an IP,
+remove() when that (ip, user) pair expires.
+"""
+
+import heapq
+import ipaddress
+import threading
+
+DEFAULT_V4_LENGTHS = (8, 16, 20, 24, 28, 32)
+DEFAULT_V6_LENGTHS = (16, 32, 40, 48, 56, 64, 128)
+
+
+class _Node:
+    __slots__ = ("children", "users", "ip_count")
+
+    def __init__(self):
+        self.children = {}  # full prefix value at the next level -> _Node
+        self.users = {}  # user_id -> number of that user's active IPs under this prefix
+        self.ip_count = 0
+
+
+class PrefixIndex:
+    def __init__(self, v4_lengths=DEFAULT_V4_LENGTHS, v6_lengths=DEFAULT_V6_LENGTHS):
+        self._bits = {4: 32, 6: 128}
+        self._lengths = {
+            4: tuple(sorted(set(v4_lengths) | {32})),
+            6: tuple(sorted(set(v6_lengths) | {128})),
+        }
+        self._roots = {4: _Node(), 6: _Node()}
+        self._lock = threading.Lock()
+
+    @property
+    def lengths(self):
+        return dict(self._lengths)
+
+    # ------------------------------
+    # Updates
+    # ------------------------------
+
+    def _parse(self, ip_address):
+        try:
+            addr = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None, None
+        if addr.version == 6 and addr.ipv4_mapped is not None:
+            addr = addr.ipv4_mapped
+        return addr.version, int(addr)
+
+    def _walk(self, family, value, create):
+        bits = self._bits[family]
+        node = self._roots[family]
+        path = [node]
+        for depth in self._lengths[family]:
+            key = value >> (bits - depth)
+            child = node.children.get(key)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[key] = _Node()
+            path.append(child)
+            node = child
+        return path
+
+    def add(self, ip_address, user_id):
+        family, value = self._parse(ip_address)
+        if family is None:
+            return
+        with self._lock:
+            path = self._walk(family, value, create=True)
+            leaf = path[-1]
+            if user_id in leaf.users:
+                return
+            new_ip = not leaf.users
+            for node in path:
+                node.users[user_id] = node.users.get(user_id, 0) + 1
+                if new_ip:
+                    node.ip_count += 1
+
+    def remove(self, ip_address, user_id):
+        family, value = self._parse(ip_address)
+        if family is None:
+            return
+        with self._lock:
+            path = self._walk(family, value, create=False)
+            if path is None or user_id not in path[-1].users:
+                return
+            ip_gone = len(path[-1].users) == 1
+            for node in path:
+                remaining = node.users[user_id] - 1
+                if remaining:
+                    node.users[user_id] = remaining
+                else:
+                    del node.users[user_id]
+                if ip_gone:
+                    node.ip_count -= 1
+            # Prune empty branches bottom-up
+            bits = self._bits[family]
+            lengths = self._lengths[family]
+            for i in range(len(path) - 1, 0, -1):
+                if path[i].ip_count:
+                    break
+                del path[i - 1].children[value >> (bits - lengths[i - 1])]
+
+    # ------------------------------
+    # Queries
+    # ------------------------------
+
+    def _format(self, family, key, length):
+        bits = self._bits[family]
+        network_cls = ipaddress.IPv4Network if family == 4 else ipaddress.IPv6Network
+        return str(network_cls((key << (bits - length), length)))
+
+    def _nodes_at(self, family, depth):
+        """All (key, node) pairs at a tracked depth."""
+        level = [(0, self._roots[family])]
+        for d in self._lengths[family]:
+            if d > depth:
+                break
+            level = [item for _, node in level for item in node.children.items()]
+        return level
+
+    def prefix_stats(self, prefix):
+        """Distinct users and active IPs under a CIDR prefix, e.g. "10.1.2.0/23"."""
+        network = ipaddress.ip_network(prefix, strict=False)
+        family = network.version
+        bits = self._bits[family]
+        length = network.prefixlen
+        target = int(network.network_address) >> (bits - length)
+
+        with self._lock:
+            node = self._roots[family]
+            depth = 0
+            for d in self._lengths[family]:
+                if d > length:
+                    break
+                node = node.children.get(int(network.network_address) >> (bits - d))
+                depth = d
+                if node is None:
+                    return {"prefix": str(network), "user_count": 0, "ip_count": 0}
+
+            if depth == length:
+                users = len(node.users)
+                ip_count = node.ip_count
+            else:
+                # Between two tracked levels: union the children that fall inside
+                next_depth = next(d for d in self._lengths[family] if d > length)
+                shift = next_depth - length
+                users = set()
+                ip_count = 0
+                for key, child in node.children.items():
+                    if key >> shift == target:
+                        users.update(child.users)
+                        ip_count += child.ip_count
+                users = len(users)
+
+        return {"prefix": str(network), "user_count": users, "ip_count": ip_count}
+
+    def heaviest(self, length, family=4, top=10, min_users=2):
+        """Prefixes of the given length with the most distinct users."""
+        lengths = self._lengths[family]
+        if not 0 < length <= self._bits[family]:
+            raise ValueError(f"prefix length must be between 1 and {self._bits[family]}")
+
+        with self._lock:
+            if length in lengths:
+                candidates = (
+                    (len(node.users), node.ip_count, key)
+                    for key, node in self._nodes_at(family, length)
+                    if len(node.users) >= min_users
+                )
+                best = heapq.nlargest(top, candidates)
+            else:
+                next_depth = next(d for d in lengths if d > length)
+                shift = next_depth - length
+                groups = {}
+                for key, node in self._nodes_at(family, next_depth):
+                    users, ip_count = groups.setdefault(key >> shift, (set(), [0]))
+                    users.update(node.users)
+                    ip_count[0] += node.ip_count
+                best = heapq.nlargest(
+                    top,
+                    (
+                        (len(users), ip_count[0], key)
+                        for key, (users, ip_count) in groups.items()
+                        if len(users) >= min_users
+                    ),
+                )
+
+        return [
+            {"prefix": self._format(family, key, length), "user_count": users, "ip_count": ip_count}
+            for users, ip_count, key in best
+        ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                f"ipv{family}": {"active_ips": root.ip_count, "active_users": len(root.users)}
+                for family, root in self._roots.items()
+            }
@@ -0,0 +1,253 @@
+"""
+Shared in-process cache of the user_profiles fields the anti-fraud handlers
+read: trust_score, transaction_limit and is_verified.
+
+One compact record per user (a 4-tuple, expiry included) instead of full
+profile rows, so every profile fits in memory. It is bulk-warmed on startup
+from paged reads; misses are loaded in chunked `in` queries, either by the
+caller (get_many) or, for callers that must not wait on the database
+(cached_transaction_limits), by a background refresh thread.
+
+Writers in this process update it in place (write-through) after their
+database write succeeds. The TTL only bounds how long a change made
+elsewhere (another process, the Supabase dashboard) can go unseen.
+
+A load that was reading while a user was written may hold the old row;
+such rows are returned to the caller but not cached.
+"""
+
+import threading
+import time
+from typing import NamedTuple
+
+COLUMNS = ["user_id", "trust_score", "transaction_limit", "is_verified"]
+
+
+class CachedProfile(NamedTuple):
+    trust_score: int
+    transaction_limit: int
+    is_verified: bool
+    expires_at: float
+
+
+class ProfileCache:
+    """
+    load(user_ids) returns user_profiles rows (COLUMNS) for those users; it
+    is called outside the lock, in chunks of chunk_size ids.
+    """
+
+    def __init__(self, load, ttl=600.0, chunk_size=500):
+        self.load = load
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._profiles = {}  # user_id -> CachedProfile
+        # Writes seen while loads are in flight: user_id -> write sequence number
+        self._seq = 0
+        self._written = {}
+        self._cleared_at = 0
+        self._loads = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Background refresh: user_ids to load, and the thread loading them (started on first use)
+        self._refresh_cond = threading.Condition()
+        self._to_refresh = set()
+        self._refresh_thread = None
+        self.refresh_errors = 0
+
+    # ------------------------------
+    # Writes
+    # ------------------------------
+
+    def update(self, user_id, **fields):
+        """
+        Write-through after a successful update of these fields. A user that
+        is not cached stays uncached (its other fields are unknown here).
+        """
+        user_id = int(user_id)
+        with self._lock:
+            self._wrote(user_id)
+            cached = self._profiles.get(user_id)
+            if cached is not None:
+                self._profiles[user_id] = cached._replace(**fields)
+
+    def invalidate(self, user_id=None):
+        """Forget one user, or everyone when user_id is None."""
+        with self._lock:
+            if user_id is None:
+                self._seq += 1
+                self._cleared_at = self._seq
+                self._written.clear()
+                self._profiles.clear()
+            else:
+                self._wrote(int(user_id))
+                self._profiles.pop(int(user_id), None)
+
+    def _wrote(self, user_id):
+        self._seq += 1
+        if self._loads:
+            self._written[user_id] = self._seq
+
+    # ------------------------------
+    # Loads
+    # ------------------------------
+
+    def _begin_load(self):
+        with self._lock:
+            self._loads += 1
+            return self._seq
+
+    def _end_load(self):
+        with self._lock:
+            self._loads -= 1
+            if not self._loads:
+                self._written.clear()
+
+    def _put(self, rows, started):
+        """Cache rows read by a load that started at write sequence `started`; returns them by user_id."""
+        expires_at = time.monotonic() + self.ttl
+        records = {
+            int(row["user_id"]): CachedProfile(
+                row["trust_score"], row["transaction_limit"], bool(row["is_verified"]), expires_at
+            )
+            for row in rows
+        }
+        with self._lock:
+            if self._cleared_at <= started:
+                for user_id, record in records.items():
+                    if self._written.get(user_id, 0) <= started:
+                        self._profiles[user_id] = record
+        return records
+
+    def warm(self, pages):
+        """Cache pages of user_profiles rows (COLUMNS), e.g. a paged read of the whole table."""
+        pages = iter(pages)
+        while True:
+            started = self._begin_load()
+            try:
+                rows = next(pages, None)
+                if rows is None:
+                    return
+                self._put(rows, started)
+            finally:
+                self._end_load()
+
+    # ------------------------------
+    # Reads
+    # ------------------------------
+
+    def peek(self, user_id):
+        """The user's CachedProfile if cached and fresh, without loading; None otherwise."""
+        with self._lock:
+            cached = self._profiles.get(int(user_id))
+            if cached is None or cached.expires_at <= time.monotonic():
+                return None
+            self.hits += 1
+            return cached
+
+    def get(self, user_id):
+        """The user's CachedProfile, loading it on a miss; None if there is no such profile."""
+        return self.get_many([user_id]).get(int(user_id))
+
+    def get_many(self, user_ids):
+        """{user_id: CachedProfile} for the given users that exist, loading misses in chunks."""
+        now = time.monotonic()
+        found, missing = {}, set()
+        with self._lock:
+            for user_id in user_ids:
+                user_id = int(user_id)
+                cached = self._profiles.get(user_id)
+                if cached is not None and cached.expires_at > now:
+                    found[user_id] = cached
+                else:
+                    missing.add(user_id)
+            self.hits += len(found)
+            self.misses += len(missing)
+        if missing:
+            found.update(self._load_many(missing))
+        return found
+
+    def _load_many(self, user_ids):
+        user_ids = sorted(user_ids)
+        found = {}
+        started = self._begin_load()
+        try:
+            for i in range(0, len(user_ids), self.chunk_size):
+                found.update(self._put(self.load(user_ids[i : i + self.chunk_size]), started))
+        finally:
+            self._end_load()
+        return found
+
+    def transaction_limits(self, user_ids):
+        """transaction_limit of the given users that exist, keyed by user_id."""
+        return {user_id: profile.transaction_limit for user_id, profile in self.get_many(user_ids).items()}
+
+    def cached_transaction_limits(self, user_ids):
+        """
+        transaction_limit of the given users from the cache alone, never
+        waiting on the database: an expired record still answers with the
+        last known limit. Users missing or expired are loaded in the
+        background, so a later call sees them; until then they are left out.
+        """
+        now = time.monotonic()
+        limits, stale = {}, []
+        with self._lock:
+            for user_id in user_ids:
+                user_id = int(user_id)
+                cached = self._profiles.get(user_id)
+                if cached is not None:
+                    limits[user_id] = cached.transaction_limit
+                if cached is None or cached.expires_at <= now:
+                    stale.append(user_id)
+            self.hits += len(limits)
+            self.misses += len(stale)
+        if stale:
+            self.refresh(stale)
+        return limits
+
+    # ------------------------------
+    # Background refresh
+    # ------------------------------
+
+    def refresh(self, user_ids):
+        """Load these users in the background; returns right away."""
+        with self._refresh_cond:
+            self._to_refresh.update(user_ids)
+            if self._refresh_thread is None:
+                self._refresh_thread = threading.Thread(
+                    target=self._refresh_loop, name="profile-cache-refresh", daemon=True
+                )
+                self._refresh_thread.start()
+            self._refresh_cond.notify()
+
+    def _refresh_loop(self):
+        while True:
+            with self._refresh_cond:
+                while not self._to_refresh:
+                    self._refresh_cond.wait()
+                user_ids, self._to_refresh = self._to_refresh, set()
+            try:
+                self._load_many(user_ids)
+            except Exception as e:
+                self.refresh_errors += 1
+                print(f"[profile-cache] failed to refresh {len(user_ids)} users: {e}")
+
+    def sweep(self):
+        """Drop expired records (they would be reloaded on the next read anyway)."""
+        now = time.monotonic()
+        with self._lock:
+            self._profiles = {user_id: p for user_id, p in self._profiles.items() if p.expires_at > now}
+
+    def stats(self):
+        with self._lock:
+            size = len(self._profiles)
+        with self._refresh_cond:
+            refreshing = len(self._to_refresh)
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshing": refreshing,
+            "refresh_errors": self.refresh_errors,
+        }
@@ -0,0 +1,549 @@
+"""
+Data access layer for the anti-fraud service.
+
+Handlers talk to a backend through the PostgREST-style query builder they
+already use (table().select().eq()...execute().data), so the same code runs
+against:
+
+- SupabaseBackend: the Supabase project over a pooled, keep-alive HTTP client
+- SQLiteBackend: a local SQLite file or in-memory database with the same
+  tables and indexes, for development and load tests without the live project
+
+Both record the count, rows and time of every query per (table, operation),
+and offer chunked bulk_insert / bulk_upsert. STORAGE_BACKEND picks the
+backend ("supabase" by default, or "sqlite"). AsyncBackend makes either one
+awaitable for async views.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, List, NamedTuple
+
+BULK_CHUNK_SIZE = 500
+
+
+# ------------------------------
+# Tables
+# ------------------------------
+
+
+class Table(NamedTuple):
+    name: str
+    key: str
+    columns: dict  # column -> "int" | "float" | "text" | "bool" | "timestamp" | "int[]"
+    indexes: tuple = ()  # tuples of columns
+    unique: tuple = ()  # columns with a unique constraint (upsert targets)
+    generated_key: bool = True
+
+
+TABLES = {
+    table.name: table
+    for table in (
+        Table(
+            "ip_logs",
+            key="id",
+            columns={
+                "id": "int", "user_id": "int", "ip_address": "text", "is_suspicious": "bool",
+                "country": "text", "region": "text", "city": "text", "latitude": "float",
+                "longitude": "float", "checked_at": "timestamp", "remarks": "text",
+            },
+            indexes=(("user_id", "checked_at"), ("checked_at",), ("ip_address",), ("is_suspicious",)),
+        ),
+        Table(
+            "current_connected_ip",
+            key="id",
+            columns={"id": "int", "ip_address": "text", "user_ids": "int[]", "is_suspicious": "bool"},
+            indexes=(("is_suspicious",),),
+            unique=("ip_address",),
+        ),
+        Table(
+            "user_profiles",
+            key="user_id",
+            columns={
+                "user_id": "int", "created_at": "timestamp", "is_verified": "bool", "last_ip": "text",
+                "last_login": "timestamp", "trust_score": "int", "transaction_limit": "float",
+            },
+            indexes=(("trust_score",), ("is_verified",)),
+            generated_key=False,
+        ),
+        Table(
+            "trust_logs",
+            key="id",
+            columns={
+                "id": "int", "user_id": "int", "added_trust": "int", "remarks": "text", "created_at": "timestamp",
+            },
+            indexes=(("user_id", "created_at"), ("created_at",)),
+        ),
+        Table(
+            "transactions",
+            key="transaction_id",
+            columns={
+                "transaction_id": "int", "from_user_id": "int", "to_user_id": "int", "amount": "float",
+                "status": "text", "created_at": "timestamp",
+            },
+            indexes=(("created_at",), ("from_user_id", "to_user_id"), ("to_user_id",), ("status",)),
+        ),
+        Table(
+            "flagged_transaction",
+            key="flagged_transaction_id",
+            columns={
+                "flagged_transaction_id": "int", "created_at": "timestamp", "transaction_ids": "int[]",
+                "is_resolved": "bool", "reason": "text",
+            },
+            indexes=(("created_at",), ("is_resolved",)),
+        ),
+    )
+}
+
+
+# ------------------------------
+# Query timing
+# ------------------------------
+
+
+class QueryStats:
+    """
+    Count, rows and time per (table, operation); queries over slow_ms are
+    printed. Listeners are called with (table, op, seconds, rows) per query.
+    """
+
+    def __init__(self, slow_ms=None):
+        self.slow_ms = slow_ms
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._stats = {}  # (table, op) -> [count, rows, seconds, max_seconds]
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def record(self, table, op, seconds, rows):
+        with self._lock:
+            entry = self._stats.setdefault((table, op), [0, 0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += rows
+            entry[2] += seconds
+            entry[3] = max(entry[3], seconds)
+        for listener in self.listeners:
+            listener(table, op, seconds, rows)
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            print(f"[storage] slow {op} on {table}: {seconds * 1000:.1f} ms, {rows} rows")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                f"{table}.{op}": {
+                    "count": count,
+                    "rows": rows,
+                    "total_ms": round(seconds * 1000, 3),
+                    "max_ms": round(max_seconds * 1000, 3),
+                }
+                for (table, op), (count, rows, seconds, max_seconds) in sorted(self._stats.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class Backend:
+    # Whether other processes (job runner workers) see the same data
+    shared_across_processes = True
+    # Queries that can usefully be in flight at once
+    pool_size = 4
+
+    def __init__(self, slow_ms=None):
+        self.stats = QueryStats(slow_ms)
+
+    def table(self, name):
+        raise NotImplementedError
+
+    def bulk_insert(self, table, rows, chunk_size=BULK_CHUNK_SIZE):
+        """Insert rows in chunks; returns the inserted rows."""
+        inserted = []
+        for i in range(0, len(rows), chunk_size):
+            inserted.extend(self.table(table).insert(rows[i : i + chunk_size]).execute().data or [])
+        return inserted
+
+    def bulk_upsert(self, table, rows, on_conflict, chunk_size=BULK_CHUNK_SIZE):
+        """Insert-or-update rows on the on_conflict column in chunks; returns the written rows."""
+        written = []
+        for i in range(0, len(rows), chunk_size):
+            written.extend(
+                self.table(table).upsert(rows[i : i + chunk_size], on_conflict=on_conflict).execute().data or []
+            )
+        return written
+
+
+# ------------------------------
+# Supabase
+# ------------------------------
+
+_OPERATIONS = ("select", "insert", "upsert", "update", "delete")
+
+
+class _TimedQuery:
+    """Wraps a postgrest request builder and times its execute()."""
+
+    def __init__(self, builder, table, stats, op=None):
+        self._builder = builder
+        self._table = table
+        self._stats = stats
+        self._op = op
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+        op = self._op or (name if name in _OPERATIONS else None)
+
+        def call(*args, **kwargs):
+            return _TimedQuery(attr(*args, **kwargs), self._table, self._stats, op)
+
+        return call
+
+    def execute(self):
+        started = time.perf_counter()
+        rows = 0
+        try:
+            result = self._builder.execute()
+            rows = len(result.data or [])
+            return result
+        finally:
+            self._stats.record(self._table, self._op or "select", time.perf_counter() - started, rows)
+
+
+class SupabaseBackend(Backend):
+    def __init__(self, url, key, pool_size=20, timeout=30.0, slow_ms=None):
+        import httpx
+        from supabase import ClientOptions, create_client
+
+        super().__init__(slow_ms)
+        self.pool_size = pool_size
+        # One keep-alive connection pool shared by every request thread
+        self.http = httpx.Client(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=timeout,
+        )
+        self.client = create_client(
+            url, key, options=ClientOptions(httpx_client=self.http, postgrest_client_timeout=timeout)
+        )
+
+    def table(self, name):
+        return _TimedQuery(self.client.table(name), name, self.stats)
+
+
+# ------------------------------
+# SQLite
+# ------------------------------
+
+_SQL_TYPES = {"int": "INTEGER", "float": "REAL", "text": "TEXT", "bool": "INTEGER", "timestamp": "TEXT", "int[]": "TEXT"}
+
+
+def normalize_timestamp(value):
+    """ISO string or datetime -> UTC ISO string, so text order is time order (naive values are UTC)."""
+    ts = value if isinstance(value, datetime) else datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+class QueryResult(NamedTuple):
+    data: List[Any]
+
+
+class _SQLiteQuery:
+    """The subset of the postgrest builder the service uses, compiled to SQL."""
+
+    def __init__(self, backend, table):
+        self._backend = backend
+        self._table = table
+        self._op = "select"
+        self._columns = None
+        self._payload = None
+        self._on_conflict = None
+        self._where = []
+        self._params = []
+        self._order = []
+        self._limit = None
+        self._offset = None
+
+    def _encode(self, column, value):
+        kind = self._table.columns.get(column)
+        if value is None or kind is None:
+            return value
+        if kind == "bool":
+            return int(bool(value))
+        if kind == "timestamp":
+            return normalize_timestamp(value)
+        if kind == "int[]":
+            return json.dumps([int(v) for v in value])
+        return value
+
+    def _decode(self, row):
+        for column, value in row.items():
+            if value is None:
+                continue
+            kind = self._table.columns.get(column)
+            if kind == "bool":
+                row[column] = bool(value)
+            elif kind == "int[]":
+                row[column] = json.loads(value)
+        return row
+
+    def _column(self, column):
+        if column not in self._table.columns:
+            raise ValueError(f"unknown column {self._table.name}.{column}")
+        return f'"{column}"'
+
+    # Operations
+
+    def select(self, columns="*", **kwargs):
+        self._op = "select"
+        columns = [c.strip() for c in columns.split(",") if c.strip()]
+        self._columns = None if columns == ["*"] else [self._column(c) for c in columns]
+        return self
+
+    def insert(self, rows, **kwargs):
+        self._op, self._payload = "insert", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict=None, **kwargs):
+        self._op, self._payload = "upsert", rows if isinstance(rows, list) else [rows]
+        self._on_conflict = on_conflict or self._table.key
+        return self
+
+    def update(self, values, **kwargs):
+        self._op, self._payload = "update", values
+        return self
+
+    def delete(self, **kwargs):
+        self._op = "delete"
+        return self
+
+    # Filters and modifiers
+
+    def _filter(self, column, sql_op, value):
+        self._where.append(f"{self._column(column)} {sql_op} ?")
+        self._params.append(self._encode(column, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "=", value)
+
+    def neq(self, column, value):
+        return self._filter(column, "!=", value)
+
+    def gt(self, column, value):
+        return self._filter(column, ">", value)
+
+    def gte(self, column, value):
+        return self._filter(column, ">=", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "<", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "<=", value)
+
+    def like(self, column, pattern):
+        # Case-sensitive like Postgres LIKE, which SQLite's LIKE is not
+        self._where.append(f"{self._column(column)} GLOB ?")
+        self._params.append(pattern.replace("%", "*").replace("_", "?"))
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            self._where.append("0")
+            return self
+        self._where.append(f"{self._column(column)} IN ({', '.join('?' * len(values))})")
+        self._params.extend(self._encode(column, v) for v in values)
+        return self
+
+    def order(self, column, desc=False, **kwargs):
+        self._order.append(f"{self._column(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, size, **kwargs):
+        self._limit = size
+        return self
+
+    def range(self, start, end, **kwargs):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    # SQL
+
+    def _where_sql(self):
+        return f" WHERE {' AND '.join(self._where)}" if self._where else ""
+
+    def _rows_sql(self):
+        name = f'"{self._table.name}"'
+        if self._op == "select":
+            sql = f"SELECT {', '.join(self._columns) if self._columns else '*'} FROM {name}{self._where_sql()}"
+            if self._order:
+                sql += f" ORDER BY {', '.join(self._order)}"
+            if self._limit is not None:
+                sql += f" LIMIT {int(self._limit)}"
+                if self._offset:
+                    sql += f" OFFSET {int(self._offset)}"
+            return [(sql, self._params)]
+        if self._op == "update":
+            columns = list(self._payload)
+            assignments = ", ".join(f"{self._column(c)} = ?" for c in columns)
+            params = [self._encode(c, self._payload[c]) for c in columns] + self._params
+            return [(f"UPDATE {name} SET {assignments}{self._where_sql()} RETURNING *", params)]
+        if self._op == "delete":
+            return [(f"DELETE FROM {name}{self._where_sql()} RETURNING *", self._params)]
+
+        # insert / upsert: one statement per distinct column set
+        statements = []
+        for row in self._payload:
+            columns = list(row)
+            sql = (
+                f"INSERT INTO {name} ({', '.join(self._column(c) for c in columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})"
+            )
+            if self._op == "upsert":
+                updates = [c for c in columns if c != self._on_conflict]
+                conflict = self._column(self._on_conflict)
+                if updates:
+                    sets = ", ".join(f"{self._column(c)} = excluded.{self._column(c)}" for c in updates)
+                    sql += f" ON CONFLICT ({conflict}) DO UPDATE SET {sets}"
+                else:
+                    sql += f" ON CONFLICT ({conflict}) DO NOTHING"
+            statements.append((sql + " RETURNING *", [self._encode(c, row[c]) for c in columns]))
+        return statements
+
+    def execute(self):
+        backend = self._backend
+        started = time.perf_counter()
+        rows = []
+        with backend.lock:
+            conn = backend.conn
+            with conn:  # one transaction per query, like one PostgREST request
+                for sql, params in self._rows_sql():
+                    cursor = conn.execute(sql, params)
+                    rows.extend(dict(row) for row in cursor.fetchall())
+        data = [self._decode(row) for row in rows]
+        backend.stats.record(self._table.name, self._op, time.perf_counter() - started, len(data))
+        return QueryResult(data)
+
+
+class SQLiteBackend(Backend):
+    def __init__(self, path=":memory:", tables=TABLES, slow_ms=None):
+        super().__init__(slow_ms)
+        self.path = path
+        self.shared_across_processes = path != ":memory:"
+        self.tables = tables
+        # One connection serialised by a lock: SQLite allows a single writer anyway
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        if self.shared_across_processes:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA busy_timeout=5000")
+        self.create_schema()
+
+    def create_schema(self):
+        with self.lock, self.conn:
+            for table in self.tables.values():
+                columns = []
+                for column, kind in table.columns.items():
+                    definition = f'"{column}" {_SQL_TYPES[kind]}'
+                    if column == table.key:
+                        definition += " PRIMARY KEY" + (" AUTOINCREMENT" if table.generated_key else "")
+                    elif column in table.unique:
+                        definition += " UNIQUE"
+                    columns.append(definition)
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{table.name}" ({", ".join(columns)})')
+                for index in table.indexes:
+                    index_name = f"idx_{table.name}_{'_'.join(index)}"
+                    index_columns = ", ".join(f'"{column}"' for column in index)
+                    self.conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table.name}" ({index_columns})'
+                    )
+
+    def table(self, name):
+        return _SQLiteQuery(self, self.tables[name])
+
+
+# ------------------------------
+# Async access
+# ------------------------------
+
+
+class AsyncBackend:
+    """
+    Awaitable queries for async views. Builders are made as usual with
+    table(); execute() runs them on a thread pool as large as the backend's
+    connection pool, so the event loop never waits on storage and gather()
+    puts independent queries in flight together.
+    """
+
+    def __init__(self, backend, max_concurrency=None):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(
+            max_concurrency or backend.pool_size, thread_name_prefix="storage"
+        )
+
+    def table(self, name):
+        return self.backend.table(name)
+
+    async def _run(self, fn, *args):
+        # Carry the caller's context (e.g. per-request instrumentation) into the pool thread
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, fn, *args)
+
+    async def execute(self, query):
+        return await self._run(query.execute)
+
+    async def gather(self, *queries):
+        return await asyncio.gather(*(self.execute(query) for query in queries))
+
+    async def call(self, fn, *args):
+        """Run another blocking backend call, e.g. bulk_insert, off the event loop."""
+        return await self._run(fn, *args)
+
+
+# ------------------------------
+# Factory
+# ------------------------------
+
+
+def open_backend():
+    """Backend configured by env: STORAGE_BACKEND, SUPABASE_URL/KEY or SQLITE_PATH."""
+    slow_ms = os.getenv("STORAGE_SLOW_QUERY_MS")
+    slow_ms = float(slow_ms) if slow_ms else None
+    kind = os.getenv("STORAGE_BACKEND", "supabase")
+    if kind == "sqlite":
+        return SQLiteBackend(os.getenv("SQLITE_PATH", ":memory:"), slow_ms=slow_ms)
+    if kind == "supabase":
+        return SupabaseBackend(
+            os.getenv("SUPABASE_URL"),
+            os.getenv("SUPABASE_KEY"),
+            pool_size=int(os.getenv("SUPABASE_POOL_SIZE", "20")),
+            timeout=float(os.getenv("SUPABASE_TIMEOUT_SECONDS", "30")),
+            slow_ms=slow_ms,
+        )
+    raise ValueError(f"unknown STORAGE_BACKEND {kind!r}, expected supabase or sqlite")
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_backend():
+    """This process's backend, opened on first use and shared by every caller in it."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = open_backend()
+        return _default
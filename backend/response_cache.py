@@ -0,0 +1,120 @@
+"""
+Short-TTL response cache with ETag / If-None-Match support for the read
+endpoints polled by the admin dashboard.
+
+Entries are keyed by path + query string and tagged with the tables they read.
+Write paths call invalidate(table) so a moderator never sees a stale page
+after their own change; otherwise a page is served from memory for ttl
+seconds. Every cached response carries a content hash ETag, and a matching
+If-None-Match gets a 304 with no body, even after the entry has expired and
+been rebuilt, as long as the data did not change.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import make_response, request
+
+# Response headers worth replaying from a cached entry
+_KEPT_HEADERS = ("Content-Type", "X-Next-After-Id")
+
+
+class ResponseCache:
+    def __init__(self, default_ttl=5.0, max_entries=1024):
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, etag, body, status, headers, tables)
+        self._versions = {}  # table -> invalidation counter
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def invalidate(self, *tables):
+        tables = set(tables)
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            stale = [key for key, entry in self._entries.items() if entry[5] & tables]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _not_modified(self, etag, ttl):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = f"private, max-age={int(ttl)}"
+        return response
+
+    def cached(self, tables, ttl=None):
+        """Decorator for GET views that only read the given tables."""
+        tables = frozenset(tables)
+        ttl = self.default_ttl if ttl is None else ttl
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # Streams are not buffered, they are what keeps memory flat
+                if request.method != "GET" or request.args.get("format") == "ndjson":
+                    return view(*args, **kwargs)
+
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                now = time.monotonic()
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None and entry[0] <= now:
+                        del self._entries[key]
+                        entry = None
+                    if entry is not None:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+                    versions = tuple(self._versions.get(t, 0) for t in sorted(tables))
+
+                if entry is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    etag = hashlib.sha1(body).hexdigest()
+                    headers = {h: response.headers[h] for h in _KEPT_HEADERS if h in response.headers}
+                    entry = (now + ttl, etag, body, response.status_code, headers, tables)
+                    with self._lock:
+                        # Skip storing if a write invalidated these tables meanwhile
+                        if versions == tuple(self._versions.get(t, 0) for t in sorted(tables)):
+                            self._entries[key] = entry
+                            while len(self._entries) > self.max_entries:
+                                self._entries.popitem(last=False)
+
+                _, etag, body, status, headers, _ = entry
+                if etag in request.if_none_match:
+                    with self._lock:
+                        self.not_modified += 1
+                    return self._not_modified(etag, ttl)
+
+                response = make_response(body, status)
+                response.headers.update(headers)
+                response.set_etag(etag)
+                response.headers["Cache-Control"] = f"private, max-age={int(ttl)}"
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+            }
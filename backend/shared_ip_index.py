@@ -0,0 +1,219 @@
+"""
+Expiring IP -> users index for shared-IP detection.
+
+Replaces the read-modify-write of current_connected_ip.user_ids in
+/ip/ipcheck. Each IP keeps the last time every user was seen on it; users not
+seen within the sliding window drop out. Updates take a per-shard lock so
+concurrent logins on the same IP cannot lose each other, and the table is
+brought in line by a periodic compact() instead of one write per login.
+
+Listeners (e.g. PrefixIndex) get add(ip, user_id) when a user first appears
+on an IP and remove(ip, user_id) when that pair expires.
+
+An IP a moderator marked safe (mark_reviewed) is not suspicious however many
+users it has, until a user who was not on it at the review shows up.
+"""
+
+import threading
+import time
+import zlib
+
+
+class _Shard:
+    __slots__ = ("lock", "ips", "multi", "dirty", "reviewed")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ips = {}  # ip -> {user_id: last_seen_epoch}
+        self.multi = set()  # ips with 2+ active users, the only candidates for threshold queries
+        self.dirty = set()  # ips changed since the last compaction
+        self.reviewed = {}  # ip -> users on it when a moderator marked it safe
+
+
+class SharedIPIndex:
+    def __init__(self, window_seconds=3600, shards=64, suspicious_threshold=5, listeners=()):
+        self.window_seconds = window_seconds
+        self.suspicious_threshold = suspicious_threshold
+        self.listeners = list(listeners)
+        self._shards = [_Shard() for _ in range(shards)]
+
+    def _shard(self, ip_address):
+        return self._shards[zlib.crc32(ip_address.encode()) % len(self._shards)]
+
+    def _expire(self, shard, ip_address, users, cutoff):
+        expired = [uid for uid, seen in users.items() if seen < cutoff]
+        for uid in expired:
+            del users[uid]
+            for listener in self.listeners:
+                listener.remove(ip_address, uid)
+        if expired:
+            shard.dirty.add(ip_address)
+        if len(users) < 2:
+            shard.multi.discard(ip_address)
+        return expired
+
+    # ------------------------------
+    # Updates
+    # ------------------------------
+
+    def touch(self, ip_address, user_id, now=None):
+        """Record user_id on ip_address and return the number of active users on it."""
+        now = time.time() if now is None else now
+        user_id = int(user_id)
+        shard = self._shard(ip_address)
+        with shard.lock:
+            users = shard.ips.get(ip_address)
+            if users is None:
+                users = shard.ips[ip_address] = {}
+            self._expire(shard, ip_address, users, now - self.window_seconds)
+            if user_id not in users:
+                shard.dirty.add(ip_address)
+                reviewed = shard.reviewed.get(ip_address)
+                if reviewed is not None and user_id not in reviewed:
+                    del shard.reviewed[ip_address]  # someone new: the review no longer covers it
+                for listener in self.listeners:
+                    listener.add(ip_address, user_id)
+            users[user_id] = now
+            if len(users) >= 2:
+                shard.multi.add(ip_address)
+            return len(users)
+
+    def warm(self, rows, now=None):
+        """
+        Seed from current_connected_ip rows. The table has no per-user
+        timestamps, so existing users are treated as seen now and age out
+        after one window unless they log in again. A row over the threshold
+        but not suspicious was marked safe, and stays reviewed.
+        """
+        now = time.time() if now is None else now
+        count = 0
+        for row in rows:
+            ip_address = row["ip_address"]
+            shard = self._shard(ip_address)
+            with shard.lock:
+                users = shard.ips.setdefault(ip_address, {})
+                for uid in row.get("user_ids") or []:
+                    uid = int(uid)
+                    if uid not in users:
+                        users[uid] = now
+                        for listener in self.listeners:
+                            listener.add(ip_address, uid)
+                if len(users) >= 2:
+                    shard.multi.add(ip_address)
+                elif not users:
+                    shard.dirty.add(ip_address)  # stale empty row, delete on compaction
+                if row.get("is_suspicious") is False and len(users) > self.suspicious_threshold:
+                    shard.reviewed[ip_address] = frozenset(users)
+            count += 1
+        return count
+
+    def mark_reviewed(self, ip_addresses):
+        """
+        A moderator marked these IPs safe: not suspicious while only the
+        users now on them are seen. Returns how many are in the index.
+        """
+        count = 0
+        for ip_address in ip_addresses:
+            shard = self._shard(ip_address)
+            with shard.lock:
+                users = shard.ips.get(ip_address)
+                if users:
+                    shard.reviewed[ip_address] = frozenset(users)
+                    shard.dirty.add(ip_address)
+                    count += 1
+        return count
+
+    # ------------------------------
+    # Queries
+    # ------------------------------
+
+    def is_reviewed(self, ip_address):
+        shard = self._shard(ip_address)
+        with shard.lock:
+            return ip_address in shard.reviewed
+
+    def users(self, ip_address, now=None):
+        now = time.time() if now is None else now
+        shard = self._shard(ip_address)
+        with shard.lock:
+            users = shard.ips.get(ip_address)
+            if not users:
+                return []
+            self._expire(shard, ip_address, users, now - self.window_seconds)
+            return sorted(users)
+
+    def ips_with_more_than(self, min_users, within_seconds=None, now=None):
+        """
+        IPs with more than min_users distinct users seen in the last
+        within_seconds (default: the whole window), largest first.
+
+        Only IPs with 2+ active users are examined, so single-user addresses,
+        which are the vast majority, cost nothing; min_users must be 1 or more.
+        """
+        now = time.time() if now is None else now
+        within = self.window_seconds if within_seconds is None else min(within_seconds, self.window_seconds)
+        cutoff = now - within
+        results = []
+        for shard in self._shards:
+            with shard.lock:
+                for ip_address in list(shard.multi):
+                    users = shard.ips[ip_address]
+                    count = sum(1 for seen in users.values() if seen >= cutoff)
+                    if count > min_users:
+                        results.append((ip_address, count))
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results
+
+    def __len__(self):
+        return sum(len(shard.ips) for shard in self._shards)
+
+    # ------------------------------
+    # Compaction
+    # ------------------------------
+
+    def compact(self, upsert_fn, delete_fn, now=None, chunk_size=500):
+        """
+        Expire stale users everywhere and write changed IPs back.
+
+        upsert_fn receives lists of current_connected_ip rows for IPs that
+        still have active users; delete_fn receives lists of IP addresses
+        whose user set became empty. Returns (upserted, deleted).
+        """
+        now = time.time() if now is None else now
+        cutoff = now - self.window_seconds
+        upserts = []
+        deletes = []
+        for shard in self._shards:
+            with shard.lock:
+                for ip_address in list(shard.ips):
+                    self._expire(shard, ip_address, shard.ips[ip_address], cutoff)
+                dirty, shard.dirty = shard.dirty, set()
+                for ip_address in dirty:
+                    users = shard.ips.get(ip_address)
+                    if users:
+                        upserts.append(
+                            {
+                                "ip_address": ip_address,
+                                "user_ids": sorted(users),
+                                "is_suspicious": len(users) > self.suspicious_threshold
+                                and ip_address not in shard.reviewed,
+                            }
+                        )
+                    else:
+                        shard.ips.pop(ip_address, None)
+                        shard.reviewed.pop(ip_address, None)
+                        deletes.append(ip_address)
+
+        try:
+            for i in range(0, len(upserts), chunk_size):
+                upsert_fn(upserts[i : i + chunk_size])
+            for i in range(0, len(deletes), chunk_size):
+                delete_fn(deletes[i : i + chunk_size])
+        except Exception:
+            # Put everything back so the next compaction retries it
+            for ip_address in [row["ip_address"] for row in upserts] + deletes:
+                shard = self._shard(ip_address)
+                with shard.lock:
+                    shard.dirty.add(ip_address)
+            raise
+        return len(upserts), len(deletes)
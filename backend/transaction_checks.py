@@ -0,0 +1,299 @@
+"""
+Incremental fraud checks for /transaction/check_transactions.
+
+Instead of reloading the last 24 hours on every run, the checker keeps a
+high-water mark (the last transaction_id processed) plus the rolling state the
+rules need:
+
+- a rolling 24 hour transaction graph, searched for cycles closed by each
+  new transaction (Rule A)
+- per directed pair: pending transactions in the last 30 minutes (Rule C)
+- the IDs that are already part of a flag
+
+Each run feeds only transactions above the watermark through that state, so
+its cost follows the number of new transactions rather than the window size.
+The state is pickled to disk after every run so a restart resumes where it
+stopped.
+"""
+
+import os
+import pickle
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+
+from transaction_graph import CycleConstraints, RollingGraph
+
+# Rule thresholds, shared by the batch, incremental and real-time checks
+WINDOW_SECONDS = 24 * 3600
+CYCLE_CONSTRAINTS = CycleConstraints(
+    min_length=int(os.getenv("CYCLE_MIN_LENGTH", "3")),
+    max_length=int(os.getenv("CYCLE_MAX_LENGTH", "5")),
+    max_span_seconds=WINDOW_SECONDS,
+    min_amount_ratio=float(os.getenv("CYCLE_MIN_AMOUNT_RATIO", "0.8")),
+    max_amount_ratio=float(os.getenv("CYCLE_MAX_AMOUNT_RATIO", "1.05")),
+    max_cycles=int(os.getenv("CYCLE_MAX_RESULTS", "10000")),
+    max_expansions=int(os.getenv("CYCLE_MAX_EXPANSIONS", "1000000")),
+)
+# Per-transaction searches (incremental and real-time) get a smaller budget
+CLOSING_CYCLE_CONSTRAINTS = CYCLE_CONSTRAINTS._replace(
+    max_expansions=int(os.getenv("CYCLE_MAX_EXPANSIONS_PER_TRANSACTION", "10000")),
+)
+HUGE_LIMIT_MULTIPLIER = float(os.getenv("HUGE_LIMIT_MULTIPLIER", "10"))
+HUGE_ABSOLUTE_AMOUNT = float(os.getenv("HUGE_ABSOLUTE_AMOUNT", "1000000"))
+DEFAULT_TRANSACTION_LIMIT = 1000
+PENDING_BURST_COUNT = int(os.getenv("PENDING_BURST_COUNT", "5"))
+PENDING_BURST_SECONDS = int(os.getenv("PENDING_BURST_SECONDS", "1800"))
+
+
+def parse_epoch(value):
+    """Supabase timestamp string or datetime -> epoch seconds (naive values are UTC)."""
+    ts = value if isinstance(value, datetime) else datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        return (ts - datetime(1970, 1, 1)).total_seconds()
+    return ts.timestamp()
+
+
+# ------------------------------
+# Rule definitions, shared by the batch, incremental and real-time paths
+# ------------------------------
+
+
+def is_huge_amount(amount, limit, multiplier=HUGE_LIMIT_MULTIPLIER, absolute=HUGE_ABSOLUTE_AMOUNT):
+    """Rule B: amount way above the sender's limit. Works on scalars and NumPy arrays."""
+    return (amount > limit * multiplier) | (amount > absolute)
+
+
+def new_pending_window():
+    """(epoch, tx_id) of one pair's pending transfers within the last PENDING_BURST_SECONDS."""
+    return deque()
+
+
+def record_pending(window, ts, tx_id):
+    """
+    Rule C: add a pending transfer to its pair's window and return the
+    transaction IDs of the whole window once it holds PENDING_BURST_COUNT or
+    more, else None. Transfers must arrive in time order; older ones than
+    PENDING_BURST_SECONDS are dropped.
+
+    As in the batch pending_bursts, a window is only a new burst if none of
+    its transactions is flagged already; callers check that against their
+    flagged IDs, so one burst is not flagged again as it keeps growing.
+    """
+    while window and ts - window[0][0] > PENDING_BURST_SECONDS:
+        window.popleft()
+    window.append((ts, tx_id))
+    if len(window) >= PENDING_BURST_COUNT:
+        return [b[1] for b in window]
+    return None
+
+
+class FlaggedIdSet:
+    """
+    Set of transaction IDs that already belong to a flag.
+
+    Stored as a sorted int64 array (8 bytes per ID) with a small Python set
+    for recent additions that is merged in on compact(). IDs that fell out of
+    every rolling window can be dropped with prune(), since the incremental
+    checker will never see them again.
+    """
+
+    def __init__(self, ids=()):
+        self._sorted = array("q", sorted(set(ids)))
+        self._recent = set()
+
+    def __contains__(self, tx_id):
+        if tx_id in self._recent:
+            return True
+        i = bisect_left(self._sorted, tx_id)
+        return i < len(self._sorted) and self._sorted[i] == tx_id
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    def add(self, tx_id):
+        if tx_id not in self:
+            self._recent.add(tx_id)
+
+    def update(self, tx_ids):
+        for tx_id in tx_ids:
+            self.add(tx_id)
+
+    def intersects(self, tx_ids):
+        return any(tx_id in self for tx_id in tx_ids)
+
+    def compact(self):
+        if self._recent:
+            merged = sorted(set(self._sorted).union(self._recent))
+            self._sorted = array("q", merged)
+            self._recent = set()
+
+    def prune(self, min_live_id):
+        self.compact()
+        start = bisect_left(self._sorted, min_live_id)
+        self._sorted = self._sorted[start:]
+
+    def __getstate__(self):
+        self.compact()
+        return {"ids": self._sorted.tobytes()}
+
+    def __setstate__(self, state):
+        self._sorted = array("q")
+        self._sorted.frombytes(state["ids"])
+        self._recent = set()
+
+
+class IncrementalTransactionChecker:
+    # Bump when the pickled layout or its meaning changes; older state files are discarded
+    STATE_VERSION = 4
+
+    def __init__(self):
+        self.version = self.STATE_VERSION
+        self.watermark = None  # last transaction_id processed
+        self.graph = RollingGraph()  # last 24h of transactions
+        self.pending = {}  # (from_user, to_user) -> new_pending_window()
+        self.flagged = FlaggedIdSet()
+        self.last_run_at = None
+        self.truncated_searches = 0  # cycle searches that ran out of budget
+
+    # ------------------------------
+    # Persistence
+    # ------------------------------
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return cls()
+        if getattr(state, "version", None) != cls.STATE_VERSION:
+            print(f"Discarding incremental check state from an older version: {path}")
+            return cls()
+        return state
+
+    def save(self, path):
+        """Write atomically so a crash mid-save keeps the previous state."""
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    # ------------------------------
+    # Processing
+    # ------------------------------
+
+    def _evict(self, now_epoch):
+        """Drop windows that no longer hold anything and forget their flag IDs."""
+        self.graph.prune(now_epoch - WINDOW_SECONDS)
+        horizon = now_epoch - PENDING_BURST_SECONDS
+        empty = []
+        for key, window in self.pending.items():
+            while window and window[0][0] < horizon:
+                window.popleft()
+            if not window:
+                empty.append(key)
+        for key in empty:
+            del self.pending[key]
+
+        # Every pending transaction is also in the graph, so its oldest ID bounds both
+        min_live_id = self.graph.min_transaction_id()
+        if min_live_id is not None:
+            self.flagged.prune(min_live_id)
+        elif self.watermark is not None:
+            self.flagged.prune(self.watermark + 1)
+
+    def process(self, transactions, user_limits, now):
+        """
+        Run the rules over new transactions (ordered by transaction_id).
+
+        user_limits maps str(user_id) -> transaction_limit for at least the
+        senders in this batch. Returns flagged_transaction rows to insert.
+        """
+        new_flags = []
+        created_at = now.isoformat()
+        # IDs flagged in this run, per rule. Like the batch check, a rule skips
+        # IDs flagged by earlier runs or by itself, but not by another rule
+        # in the same run.
+        run_flags = {"A": set(), "B": set(), "C": set()}
+
+        def already_flagged(rule, tx_ids):
+            own = run_flags[rule]
+            return any(tx_id in own for tx_id in tx_ids) or self.flagged.intersects(tx_ids)
+
+        for tx in transactions:
+            tx_id = tx["transaction_id"]
+            if self.watermark is not None and tx_id <= self.watermark:
+                continue
+            ts = parse_epoch(tx["created_at"])
+            from_id, to_id = tx["from_user_id"], tx["to_user_id"]
+
+            # Rule A: circular money flow closed by this transaction
+            self.graph.add(from_id, to_id, ts, tx["amount"], tx_id)
+            cycles = self.graph.cycles_closed_by(from_id, to_id, ts, tx["amount"], tx_id, CLOSING_CYCLE_CONSTRAINTS)
+            self.truncated_searches += cycles.truncated
+            for cycle in cycles:
+                if not already_flagged("A", cycle.transaction_ids):
+                    run_flags["A"].update(cycle.transaction_ids)
+                    new_flags.append(
+                        {
+                            "transaction_ids": cycle.transaction_ids,
+                            "created_at": created_at,
+                            "is_resolved": False,
+                            "reason": f"Circular money flow between users {cycle.describe()}",
+                        }
+                    )
+
+            # Rule B: huge transaction way above trust limit
+            limit = user_limits.get(str(from_id), DEFAULT_TRANSACTION_LIMIT)
+            if not already_flagged("B", [tx_id]) and is_huge_amount(tx["amount"], limit):
+                run_flags["B"].add(tx_id)
+                new_flags.append(
+                    {
+                        "transaction_ids": [tx_id],
+                        "created_at": created_at,
+                        "is_resolved": False,
+                        "reason": f"Huge transaction amount ({tx['amount']})",
+                    }
+                )
+
+            # Rule C: burst of pending transfers A -> B within 30 mins
+            if tx["status"] == "pending":
+                window = self.pending.setdefault((from_id, to_id), new_pending_window())
+                tx_ids = record_pending(window, ts, tx_id)
+                if tx_ids and not already_flagged("C", tx_ids):
+                    run_flags["C"].update(tx_ids)
+                    new_flags.append(
+                        {
+                            "transaction_ids": tx_ids,
+                            "created_at": created_at,
+                            "is_resolved": False,
+                            "reason": f"Multiple pending transactions from user {from_id} to {to_id}",
+                        }
+                    )
+
+            self.watermark = tx_id
+
+        for tx_ids in run_flags.values():
+            self.flagged.update(tx_ids)
+        self._evict(parse_epoch(now))
+        self.last_run_at = created_at
+        return new_flags
+
+    def stats(self):
+        return {
+            "watermark": self.watermark,
+            "graph_edges": len(self.graph),
+            "tracked_pending_pairs": len(self.pending),
+            "flagged_ids": len(self.flagged),
+            "truncated_cycle_searches": self.truncated_searches,
+            "last_run_at": self.last_run_at,
+        }
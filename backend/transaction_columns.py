@@ -0,0 +1,153 @@
+"""
+Columnar view of a transaction window for the batch fraud check.
+
+The 24h window is loaded once into NumPy arrays (int64 ids, float64 epoch
+seconds, float64 amounts, uint8 status codes), and the rules run as
+vectorized group-by / sliding-window operations instead of loops over dicts
+that re-parse created_at each time.
+"""
+
+import numpy as np
+
+from transaction_checks import parse_epoch
+
+STATUS_CODES = {"pending": 0, "completed": 1, "failed": 2}
+UNKNOWN_STATUS = 255
+
+
+def _parse_timestamps(values):
+    """ISO strings -> float64 epoch seconds, vectorized for the UTC strings PostgREST returns."""
+    cleaned = []
+    for value in values:
+        if value.endswith("+00:00"):
+            value = value[:-6]
+        elif value.endswith("Z"):
+            value = value[:-1]
+        elif "+" in value[10:] or "-" in value[10:]:
+            # Non-UTC offset somewhere, fall back to the exact parser
+            return np.array([parse_epoch(v) for v in values], dtype=np.float64)
+        cleaned.append(value)
+    micros = np.array(cleaned, dtype="datetime64[us]").astype(np.int64)
+    return micros / 1e6
+
+
+class TransactionColumns:
+    def __init__(self, tx_id, from_user, to_user, ts, amount, status):
+        self.tx_id = tx_id
+        self.from_user = from_user
+        self.to_user = to_user
+        self.ts = ts
+        self.amount = amount
+        self.status = status
+
+    def __len__(self):
+        return len(self.tx_id)
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls.from_pages([rows])
+
+    @classmethod
+    def from_pages(cls, pages):
+        """Build from pages of transaction dicts, converting one page at a time."""
+        parts = {name: [] for name in ("tx_id", "from_user", "to_user", "ts", "amount", "status")}
+        for rows in pages:
+            if not rows:
+                continue
+            parts["tx_id"].append(np.fromiter((r["transaction_id"] for r in rows), np.int64, len(rows)))
+            parts["from_user"].append(np.fromiter((r["from_user_id"] for r in rows), np.int64, len(rows)))
+            parts["to_user"].append(np.fromiter((r["to_user_id"] for r in rows), np.int64, len(rows)))
+            parts["ts"].append(_parse_timestamps([r["created_at"] for r in rows]))
+            parts["amount"].append(np.fromiter((r["amount"] for r in rows), np.float64, len(rows)))
+            parts["status"].append(
+                np.fromiter((STATUS_CODES.get(r["status"], UNKNOWN_STATUS) for r in rows), np.uint8, len(rows))
+            )
+        dtypes = {"tx_id": np.int64, "from_user": np.int64, "to_user": np.int64,
+                  "ts": np.float64, "amount": np.float64, "status": np.uint8}
+        return cls(**{
+            name: np.concatenate(chunks) if chunks else np.empty(0, dtypes[name])
+            for name, chunks in parts.items()
+        })
+
+    def flagged_mask(self, flagged_ids):
+        """Boolean mask of rows whose transaction_id is already part of a flag."""
+        if not flagged_ids:
+            return np.zeros(len(self), dtype=bool)
+        return np.isin(self.tx_id, np.fromiter(flagged_ids, np.int64, len(flagged_ids)))
+
+    def sender_limits(self, user_limits, default_limit):
+        """transaction_limit of each row's sender, looked up with one searchsorted."""
+        if not user_limits:
+            return np.full(len(self), float(default_limit))
+        users = np.fromiter((int(u) for u in user_limits), np.int64, len(user_limits))
+        limits = np.fromiter(user_limits.values(), np.float64, len(user_limits))
+        order = np.argsort(users)
+        users, limits = users[order], limits[order]
+        pos = np.minimum(np.searchsorted(users, self.from_user), len(users) - 1)
+        found = users[pos] == self.from_user
+        return np.where(found, limits[pos], float(default_limit))
+
+
+class PairTimeline:
+    """
+    Rows sorted by directed user pair, then time. Consecutive rows with the
+    same (from, to) share a pair index, so window rules over a pair become
+    searches over one sorted array.
+    """
+
+    def __init__(self, cols, rows):
+        from_user = cols.from_user[rows]
+        to_user = cols.to_user[rows]
+        ts = cols.ts[rows]
+        order = np.lexsort((cols.tx_id[rows], ts, to_user, from_user))
+        self.cols = cols
+        self.rows = rows[order]
+        self.from_user, self.to_user, self.ts = from_user[order], to_user[order], ts[order]
+
+        changed = (self.from_user[1:] != self.from_user[:-1]) | (self.to_user[1:] != self.to_user[:-1])
+        pair_start = np.concatenate([[True], changed])
+        self.pair_idx = np.cumsum(pair_start) - 1
+
+    @classmethod
+    def with_status(cls, cols, status):
+        return cls(cols, np.flatnonzero(cols.status == STATUS_CODES[status]))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def window_starts(self, window_seconds):
+        """Index of the first row within window_seconds before each row, in the same pair."""
+        # Composite key keeps pairs apart: one pair's window never reaches into the previous pair
+        rel = self.ts - self.ts.min()
+        span = rel.max() + window_seconds + 1
+        composite = self.pair_idx * span + rel
+        return np.searchsorted(composite, composite - window_seconds, side="left")
+
+
+def pending_bursts(timeline, already_flagged, min_count, window_seconds):
+    """
+    First burst of min_count+ transactions within window_seconds per directed
+    user pair of the timeline (pending transactions for Rule C) whose
+    transactions are not already flagged. Every row's window start comes from
+    one vectorized two-pointer pass. Returns [(from_user, to_user, tx_ids)].
+    """
+    if len(timeline) < min_count:
+        return []
+
+    rows = timeline.rows
+    start = timeline.window_starts(window_seconds)
+    count = np.arange(len(rows)) - start + 1
+
+    flagged_cumsum = np.concatenate([[0], np.cumsum(already_flagged[rows])])
+    window_flagged = flagged_cumsum[np.arange(len(rows)) + 1] - flagged_cumsum[start]
+    hits = np.flatnonzero((count >= min_count) & (window_flagged == 0))
+    if len(hits) == 0:
+        return []
+
+    # First qualifying window per pair
+    _, first = np.unique(timeline.pair_idx[hits], return_index=True)
+    bursts = []
+    tx_id = timeline.cols.tx_id
+    for i in hits[first]:
+        bursts.append((int(timeline.from_user[i]), int(timeline.to_user[i]), tx_id[rows[start[i] : i + 1]].tolist()))
+    return bursts
@@ -0,0 +1,328 @@
+"""
+Transaction graph engine for circular money flow detection.
+
+Two views of the same windowed transactions:
+
+- TransactionGraph: an immutable CSR (compressed sparse row) graph built for
+  the full 24h batch check. Users are mapped to dense indices, and edges are
+  sorted by (source, time) with NumPy and kept in flat typed arrays, 8 bytes
+  per field, so millions of edges fit comfortably in memory. It finds strongly connected
+  components (iterative Tarjan) and enumerates bounded-length cycles inside
+  them.
+- RollingGraph: per-sender deques of recent edges for the incremental check,
+  which looks for cycles closed by each new transaction.
+
+A cycle is a simple path of transactions x0 -> x1 -> ... -> x0 where
+- each transaction happens after the previous one,
+- the whole cycle fits within max_span_seconds,
+- each hop carries between min_amount_ratio and max_amount_ratio of the
+  previous hop's amount, i.e. the same money is moving on.
+Normal back-and-forth payments rarely satisfy all three; a ring of accounts
+passing the same funds around does. A loan and its repayment (A -> B -> A)
+can, so cycles need at least three users by default (min_length).
+
+Both searches are bounded: they stop after max_cycles cycles or after
+examining max_expansions edges, whichever comes first, and say so with
+CycleList.truncated. A dense component cannot stall a check run.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import deque
+from typing import List, NamedTuple
+
+import numpy as np
+
+
+class Cycle(NamedTuple):
+    users: List[int]  # x0, x1, ..., x0
+    transaction_ids: List[int]
+
+    def describe(self):
+        return " -> ".join(str(u) for u in self.users)
+
+
+class CycleConstraints(NamedTuple):
+    min_length: int = 3  # a 2-cycle is a payment and its repayment, not a ring
+    max_length: int = 5
+    max_span_seconds: float = 24 * 3600
+    min_amount_ratio: float = 0.8
+    max_amount_ratio: float = 1.05
+    max_cycles: int = 10_000
+    max_expansions: int = 1_000_000  # edges examined per search
+
+    def amount_ok(self, previous, amount):
+        return previous * self.min_amount_ratio <= amount <= previous * self.max_amount_ratio
+
+
+class CycleList(list):
+    """Cycles found by one search; truncated if it stopped at max_cycles or max_expansions."""
+
+    truncated = False
+
+
+def _typed(typecode, values):
+    """NumPy array -> array.array, which is much faster to index from Python loops."""
+    out = array(typecode)
+    out.frombytes(np.ascontiguousarray(values, dtype="q" if typecode == "q" else "d").tobytes())
+    return out
+
+
+class TransactionGraph:
+    def __init__(self, from_users, to_users, timestamps, amounts, transaction_ids):
+        """Build from parallel sequences or arrays (one entry per transaction)."""
+        from_users = np.asarray(from_users, dtype=np.int64)
+        to_users = np.asarray(to_users, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        amounts = np.asarray(amounts, dtype=np.float64)
+        transaction_ids = np.asarray(transaction_ids, dtype=np.int64)
+
+        n = len(transaction_ids)
+        users, inverse = np.unique(np.concatenate([from_users, to_users]), return_inverse=True)
+        src, dst = inverse[:n], inverse[n:]
+        order = np.lexsort((transaction_ids, timestamps, src))
+
+        offsets = np.zeros(len(users) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(users)), out=offsets[1:])
+
+        self.users = users.tolist()
+        self.src = _typed("q", src[order])
+        self.dst = _typed("q", dst[order])
+        self.ts = _typed("d", timestamps[order])
+        self.amount = _typed("d", amounts[order])
+        self.tx_ids = _typed("q", transaction_ids[order])
+        self.offsets = _typed("q", offsets)
+
+    @classmethod
+    def from_columns(cls, cols):
+        return cls(cols.from_user, cols.to_user, cols.ts, cols.amount, cols.tx_id)
+
+    @classmethod
+    def from_transactions(cls, transactions, parse_ts):
+        return cls(
+            [tx["from_user_id"] for tx in transactions],
+            [tx["to_user_id"] for tx in transactions],
+            [parse_ts(tx["created_at"]) for tx in transactions],
+            [tx["amount"] for tx in transactions],
+            [tx["transaction_id"] for tx in transactions],
+        )
+
+    @property
+    def node_count(self):
+        return len(self.users)
+
+    @property
+    def edge_count(self):
+        return len(self.tx_ids)
+
+    # ------------------------------
+    # Strongly connected components
+    # ------------------------------
+
+    def strongly_connected_components(self):
+        """
+        Tarjan's algorithm without recursion. Returns a component id per node
+        and the list of components (lists of node indices).
+        """
+        n = self.node_count
+        offsets, dst = self.offsets, self.dst
+        order = array("q", [-1]) * n
+        low = array("q", [0]) * n
+        on_stack = bytearray(n)
+        component = array("q", [-1]) * n
+        components = []
+        stack = []
+        counter = 0
+
+        for root in range(n):
+            if order[root] != -1:
+                continue
+            work = [(root, offsets[root])]
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            while work:
+                node, edge = work[-1]
+                if edge < offsets[node + 1]:
+                    work[-1] = (node, edge + 1)
+                    nxt = dst[edge]
+                    if order[nxt] == -1:
+                        order[nxt] = low[nxt] = counter
+                        counter += 1
+                        stack.append(nxt)
+                        on_stack[nxt] = 1
+                        work.append((nxt, offsets[nxt]))
+                    elif on_stack[nxt]:
+                        low[node] = min(low[node], order[nxt])
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == order[node]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component[member] = len(components)
+                        members.append(member)
+                        if member == node:
+                            break
+                    components.append(members)
+        return component, components
+
+    # ------------------------------
+    # Cycle enumeration
+    # ------------------------------
+
+    def find_cycles(self, constraints=CycleConstraints()):
+        """
+        Enumerate time-ordered, amount-preserving simple cycles.
+
+        Each cycle is reported once, starting from its earliest transaction:
+        every transaction inside a non-trivial SCC is tried as a first hop and
+        extended only with later transactions. Stops after max_cycles cycles
+        or max_expansions edges examined, with truncated set.
+        """
+        component, components = self.strongly_connected_components()
+        offsets, src, dst, ts, amount, tx_ids = (
+            self.offsets, self.src, self.dst, self.ts, self.amount, self.tx_ids
+        )
+        c = constraints
+        cycles = CycleList()
+        budget = c.max_expansions
+
+        def extend(start, start_ts, comp, node, last, path_nodes, path_edges, on_path):
+            nonlocal budget
+            lo, hi = offsets[node], offsets[node + 1]
+            last_ts, last_tx, last_amount = ts[last], tx_ids[last], amount[last]
+            for e in range(bisect_left(ts, last_ts, lo, hi), hi):
+                budget -= 1
+                if budget < 0:
+                    cycles.truncated = True
+                    return True
+                if ts[e] - start_ts > c.max_span_seconds:
+                    break  # edges are sorted by time within a node
+                if ts[e] == last_ts and tx_ids[e] <= last_tx:
+                    continue
+                nxt = dst[e]
+                if component[nxt] != comp or not c.amount_ok(last_amount, amount[e]):
+                    continue
+                depth = len(path_edges) + 1
+                if nxt == start:
+                    if depth >= c.min_length:
+                        cycles.append(
+                            Cycle(
+                                [self.users[u] for u in path_nodes] + [self.users[start]],
+                                [tx_ids[x] for x in path_edges] + [tx_ids[e]],
+                            )
+                        )
+                        if len(cycles) >= c.max_cycles:
+                            cycles.truncated = True
+                            return True
+                    continue
+                if depth >= c.max_length or nxt in on_path:
+                    continue
+                path_nodes.append(nxt)
+                path_edges.append(e)
+                on_path.add(nxt)
+                if extend(start, start_ts, comp, nxt, e, path_nodes, path_edges, on_path):
+                    return True
+                on_path.discard(nxt)
+                path_edges.pop()
+                path_nodes.pop()
+            return False
+
+        for members in components:
+            if len(members) < 2:
+                continue
+            comp = component[members[0]]
+            for node in members:
+                for e in range(offsets[node], offsets[node + 1]):
+                    nxt = dst[e]
+                    if nxt == node or component[nxt] != comp:
+                        continue
+                    if extend(node, ts[e], comp, nxt, e, [node, nxt], [e], {node, nxt}):
+                        return cycles
+        return cycles
+
+
+class RollingGraph:
+    """
+    Sliding-window adjacency for the incremental check: sender -> deque of
+    (timestamp, transaction_id, receiver, amount) in arrival order.
+    """
+
+    def __init__(self):
+        self.out = {}
+
+    def add(self, from_user, to_user, ts, amount, tx_id):
+        self.out.setdefault(from_user, deque()).append((ts, tx_id, to_user, amount))
+
+    def prune(self, cutoff):
+        empty = []
+        for user, edges in self.out.items():
+            while edges and edges[0][0] < cutoff:
+                edges.popleft()
+            if not edges:
+                empty.append(user)
+        for user in empty:
+            del self.out[user]
+
+    def min_transaction_id(self):
+        return min((edges[0][1] for edges in self.out.values() if edges), default=None)
+
+    def __len__(self):
+        return sum(len(edges) for edges in self.out.values())
+
+    def cycles_closed_by(self, from_user, to_user, ts, amount, tx_id, constraints=CycleConstraints()):
+        """
+        Cycles in which the given (already added) transaction is the latest
+        hop: time-ordered paths to_user -> ... -> from_user that it closes.
+        Bounded like find_cycles.
+        """
+        c = constraints
+        cycles = CycleList()
+        if from_user == to_user:
+            return cycles
+        start = to_user
+        earliest = ts - c.max_span_seconds
+        budget = c.max_expansions
+
+        def extend(node, last_ts, last_tx, last_amount, path_nodes, path_edges, on_path):
+            nonlocal budget
+            for e_ts, e_tx, nxt, e_amount in self.out.get(node, ()):
+                budget -= 1
+                if budget < 0:
+                    cycles.truncated = True
+                    return True
+                if e_ts < earliest or (e_ts, e_tx) >= (ts, tx_id):
+                    continue
+                if last_tx is not None:
+                    if (e_ts, e_tx) <= (last_ts, last_tx) or not c.amount_ok(last_amount, e_amount):
+                        continue
+                depth = len(path_edges) + 1
+                if nxt == from_user:
+                    # Closing hop is the new transaction
+                    if depth + 1 >= c.min_length and c.amount_ok(e_amount, amount):
+                        cycles.append(Cycle(path_nodes + [nxt, start], path_edges + [e_tx, tx_id]))
+                        if len(cycles) >= c.max_cycles:
+                            cycles.truncated = True
+                            return True
+                    continue
+                if depth + 1 >= c.max_length or nxt in on_path:
+                    continue
+                path_nodes.append(nxt)
+                path_edges.append(e_tx)
+                on_path.add(nxt)
+                if extend(nxt, e_ts, e_tx, e_amount, path_nodes, path_edges, on_path):
+                    return True
+                on_path.discard(nxt)
+                path_edges.pop()
+                path_nodes.pop()
+            return False
+
+        extend(start, None, None, None, [start], [], {start, from_user})
+        return cycles
@@ -0,0 +1,223 @@
+"""
+Rule engine for the batch transaction check.
+
+A rule declares the groupings of the transaction window it needs (the
+transaction graph, per-sender limits, per-pair timelines, ...) and its
+thresholds. The engine builds every grouping the enabled rules need once per
+run, on top of the columns loaded once, and then evaluates the rules
+against them. Adding a rule that reuses an existing grouping costs only its
+own evaluation, not another pass over the data.
+
+Default thresholds come from transaction_checks (and so from the same env
+vars the incremental and real-time checks read). A run can override them per
+rule, which together with dry_run lets a new rule or threshold be tried on
+historical data without writing flags.
+"""
+
+import threading
+import time
+from typing import List, NamedTuple
+
+import numpy as np
+
+from transaction_checks import (
+    CYCLE_CONSTRAINTS,
+    DEFAULT_TRANSACTION_LIMIT,
+    HUGE_ABSOLUTE_AMOUNT,
+    HUGE_LIMIT_MULTIPLIER,
+    PENDING_BURST_COUNT,
+    PENDING_BURST_SECONDS,
+    is_huge_amount,
+)
+from transaction_columns import PairTimeline, pending_bursts
+from transaction_graph import CycleConstraints, TransactionGraph
+
+
+class RuleHit(NamedTuple):
+    rule: str
+    transaction_ids: List[int]
+    reason: str
+
+
+def format_amount(amount):
+    # Amounts come back from NumPy as floats; keep "(50000)" rather than "(50000.0)"
+    amount = float(amount)
+    return int(amount) if amount.is_integer() else amount
+
+
+# ------------------------------
+# Shared groupings
+# ------------------------------
+
+
+class RuleContext:
+    """
+    One transaction window plus the groupings built on it. Groupings are
+    built on first use and shared by every rule that asks for them.
+
+    already_flagged_ids: transaction IDs that are already part of a flag
+    limit_loader(user_ids): {str(user_id): transaction_limit}
+    """
+
+    GROUPINGS = {
+        "graph": lambda ctx: TransactionGraph.from_columns(ctx.cols),
+        "sender_limits": lambda ctx: ctx.cols.sender_limits(
+            ctx.limit_loader(ctx.cols.from_user.tolist()), DEFAULT_TRANSACTION_LIMIT
+        ),
+        "pending_by_pair": lambda ctx: PairTimeline.with_status(ctx.cols, "pending"),
+        "already_flagged": lambda ctx: ctx.cols.flagged_mask(ctx.already_flagged_ids),
+    }
+
+    def __init__(self, cols, already_flagged_ids, limit_loader):
+        self.cols = cols
+        self.already_flagged_ids = already_flagged_ids
+        self.limit_loader = limit_loader
+        self._groupings = {}
+        self.timings = {}  # grouping -> seconds to build
+
+    def __getitem__(self, name):
+        if name not in self._groupings:
+            started = time.perf_counter()
+            self._groupings[name] = self.GROUPINGS[name](self)
+            self.timings[name] = time.perf_counter() - started
+        return self._groupings[name]
+
+
+# ------------------------------
+# Rules
+# ------------------------------
+
+
+class Rule:
+    name = None
+    description = ""
+    requires = ()  # names of RuleContext groupings
+    defaults = {}  # threshold name -> default value
+    truncated = False  # set by evaluate() when it stopped early and may have missed hits
+
+    def __init__(self, **params):
+        unknown = set(params) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"unknown parameters for {self.name}: {', '.join(sorted(unknown))}")
+        self.params = {
+            key: type(default)(params.get(key, default)) for key, default in self.defaults.items()
+        }
+
+    def evaluate(self, ctx):
+        """Return a list of RuleHit for transactions not already flagged."""
+        raise NotImplementedError
+
+
+class CircularFlowRule(Rule):
+    name = "circular_flow"
+    description = "Time-ordered cycles (A -> B -> ... -> A) passing on roughly the same amount"
+    requires = ("graph",)
+    defaults = CYCLE_CONSTRAINTS._asdict()
+
+    def evaluate(self, ctx):
+        flagged_ids = ctx.already_flagged_ids
+        hit_ids = set()
+        hits = []
+        cycles = ctx["graph"].find_cycles(CycleConstraints(**self.params))
+        self.truncated = cycles.truncated
+        for cycle in cycles:
+            tx_ids = cycle.transaction_ids
+            if flagged_ids.intersection(tx_ids) or hit_ids.intersection(tx_ids):
+                continue
+            hit_ids.update(tx_ids)
+            hits.append(RuleHit(self.name, tx_ids, f"Circular money flow between users {cycle.describe()}"))
+        return hits
+
+
+class HugeAmountRule(Rule):
+    name = "huge_amount"
+    description = "Huge transaction amount way higher than the sender's trust limit"
+    requires = ("sender_limits", "already_flagged")
+    defaults = {"limit_multiplier": HUGE_LIMIT_MULTIPLIER, "absolute_amount": HUGE_ABSOLUTE_AMOUNT}
+
+    def evaluate(self, ctx):
+        cols = ctx.cols
+        matches = is_huge_amount(
+            cols.amount, ctx["sender_limits"], self.params["limit_multiplier"], self.params["absolute_amount"]
+        )
+        return [
+            RuleHit(self.name, [int(cols.tx_id[i])], f"Huge transaction amount ({format_amount(cols.amount[i])})")
+            for i in np.flatnonzero(matches & ~ctx["already_flagged"])
+        ]
+
+
+class PendingBurstRule(Rule):
+    name = "pending_burst"
+    description = "Multiple pending transactions from user A to B within a short window"
+    requires = ("pending_by_pair", "already_flagged")
+    defaults = {"min_count": PENDING_BURST_COUNT, "window_seconds": PENDING_BURST_SECONDS}
+
+    def evaluate(self, ctx):
+        return [
+            RuleHit(self.name, tx_ids, f"Multiple pending transactions from user {from_id} to {to_id}")
+            for from_id, to_id, tx_ids in pending_bursts(
+                ctx["pending_by_pair"], ctx["already_flagged"], self.params["min_count"], self.params["window_seconds"]
+            )
+        ]
+
+
+RULES = {rule.name: rule for rule in (CircularFlowRule, HugeAmountRule, PendingBurstRule)}
+
+
+def build_rules(names, overrides=None):
+    """Instantiate rules by name, with optional {name: {param: value}} threshold overrides."""
+    overrides = overrides or {}
+    unknown = (set(names) | set(overrides)) - set(RULES)
+    if unknown:
+        raise ValueError(f"unknown rules: {', '.join(sorted(unknown))}")
+    return [RULES[name](**overrides.get(name, {})) for name in names]
+
+
+# ------------------------------
+# Engine
+# ------------------------------
+
+
+class RuleEngine:
+    """Runs rules over a RuleContext and keeps cumulative per-rule timings and hit counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}  # rule -> {"runs", "hits", "seconds"}
+
+    def run(self, rules, ctx, record=True):
+        """
+        Returns (hits, report). Groupings are built up front so each rule's
+        time is its own evaluation. record=False (dry runs) leaves the
+        cumulative totals untouched.
+        """
+        for name in dict.fromkeys(g for rule in rules for g in rule.requires):
+            ctx[name]  # build once, shared by every rule that needs it
+
+        hits = []
+        report = {"groupings": {name: round(s * 1000, 3) for name, s in ctx.timings.items()}, "rules": {}}
+        for rule in rules:
+            started = time.perf_counter()
+            rule_hits = rule.evaluate(ctx)
+            elapsed = time.perf_counter() - started
+            hits.extend(rule_hits)
+            report["rules"][rule.name] = {
+                "hits": len(rule_hits),
+                "ms": round(elapsed * 1000, 3),
+                "params": rule.params,
+                "truncated": rule.truncated,
+            }
+            if record:
+                with self._lock:
+                    totals = self.totals.setdefault(rule.name, {"runs": 0, "hits": 0, "seconds": 0.0})
+                    totals["runs"] += 1
+                    totals["hits"] += len(rule_hits)
+                    totals["seconds"] += elapsed
+        return hits, report
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {"runs": t["runs"], "hits": t["hits"], "total_ms": round(t["seconds"] * 1000, 3)}
+                for name, t in self.totals.items()
+            }
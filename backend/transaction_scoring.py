@@ -0,0 +1,204 @@
+"""
+Real-time scoring for /transaction/score.
+
+Each incoming transaction is checked against rolling in-memory state, with
+no database round trip on the hot path:
+
+- the rolling 24h graph, for cycles the transaction closes (Rule A)
+- the sender's transaction_limit, for huge amounts (Rule B)
+- the pair's pending transfers of the last 30 minutes (Rule C)
+- the sender's recent amounts, for sudden spikes
+
+The rules are the same functions check_transactions uses, so a transaction
+scored "flag" here is one the batch job flags too. "review" marks softer
+signals (close to a limit or a burst) that no batch rule raises. Flags are
+still written to flagged_transaction by check_transactions.
+"""
+
+import os
+import threading
+from collections import deque
+
+from transaction_checks import (
+    CLOSING_CYCLE_CONSTRAINTS,
+    DEFAULT_TRANSACTION_LIMIT,
+    PENDING_BURST_COUNT,
+    PENDING_BURST_SECONDS,
+    WINDOW_SECONDS,
+    is_huge_amount,
+    new_pending_window,
+    parse_epoch,
+    record_pending,
+)
+from transaction_graph import RollingGraph
+
+ALLOW = "allow"
+REVIEW = "review"
+FLAG = "flag"
+
+# Soft signals that lead to "review"
+REVIEW_LIMIT_MULTIPLIER = float(os.getenv("SCORE_REVIEW_LIMIT_MULTIPLIER", "3"))
+REVIEW_PENDING_COUNT = int(os.getenv("SCORE_REVIEW_PENDING_COUNT", "3"))
+AMOUNT_SPIKE_MULTIPLIER = float(os.getenv("SCORE_AMOUNT_SPIKE_MULTIPLIER", "10"))
+RECENT_AMOUNTS = 20  # per sender
+MIN_RECENT_AMOUNTS = 3  # history needed before a spike counts
+# Resubmitting a transaction within this window returns its first decision
+REPEAT_WINDOW_SECONDS = 3600
+
+
+class TransactionScorer:
+    """
+    limit_lookup(user_ids) returns {user_id: transaction_limit} for the
+    senders it knows. It is called outside the state lock for every scored
+    transaction, so it must answer from memory and never wait on the
+    database (the service passes the profile cache's cached limits, which
+    loads unknown senders in the background); senders it leaves out are
+    scored with DEFAULT_TRANSACTION_LIMIT. warm_limit_lookup, used when
+    replaying stored transactions, may load (default: limit_lookup).
+    """
+
+    def __init__(self, limit_lookup, warm_limit_lookup=None, sweep_every=10000):
+        self.limit_lookup = limit_lookup
+        self.warm_limit_lookup = warm_limit_lookup or limit_lookup
+        self.sweep_every = sweep_every
+        self._lock = threading.Lock()
+
+        self.graph = RollingGraph()  # last 24h of transactions
+        self.pending = {}  # (from_user, to_user) -> new_pending_window()
+        self.burst_ids = {}  # (from_user, to_user) -> IDs of the pair's flagged bursts still in its window
+        self.recent_amounts = {}  # user_id -> deque of the latest amounts sent
+        self.decisions = {}  # transaction_id -> (epoch, result), for resubmissions
+        self.latest_ts = 0.0
+        self._since_sweep = 0
+
+        self.scored = 0
+        self.counts = {ALLOW: 0, REVIEW: 0, FLAG: 0}
+        self.truncated_searches = 0  # cycle searches that ran out of budget
+
+    # ------------------------------
+    # Scoring
+    # ------------------------------
+
+    def _record(self, from_id, to_id, ts, amount, tx_id, status):
+        """Add a transaction to the rolling state; returns what the rules need."""
+        self.graph.add(from_id, to_id, ts, amount, tx_id)
+        burst, pending_count = None, 0
+        if status == "pending":
+            pair = (from_id, to_id)
+            window = self.pending.setdefault(pair, new_pending_window())
+            burst = record_pending(window, ts, tx_id)
+            pending_count = len(window)
+            flagged = self.burst_ids.get(pair)
+            if flagged:
+                # Only what is still in the window can overlap a later burst
+                flagged.intersection_update(entry[1] for entry in window)
+            if burst and flagged:
+                burst = None  # part of a burst flagged already, as in the batch check
+            elif burst:
+                self.burst_ids[pair] = set(burst)
+        recent = self.recent_amounts.setdefault(from_id, deque(maxlen=RECENT_AMOUNTS))
+        previous_max = max(recent) if len(recent) >= MIN_RECENT_AMOUNTS else None
+        recent.append(amount)
+        return burst, pending_count, previous_max
+
+    def score(self, tx):
+        """
+        Score one transaction dict (transaction_id, from_user_id, to_user_id,
+        amount, status, created_at) and add it to the rolling state.
+        Transactions should arrive roughly in time order, as they happen.
+        """
+        from_id = int(tx["from_user_id"])
+        limit = self.limit_lookup([from_id]).get(from_id, DEFAULT_TRANSACTION_LIMIT)
+        with self._lock:
+            return self._score(tx, limit, count=True)
+
+    def warm(self, transactions):
+        """
+        Replay already stored transactions (in time order) into the rolling
+        state. Unknown senders get DEFAULT_TRANSACTION_LIMIT.
+        """
+        limits = self.warm_limit_lookup({int(tx["from_user_id"]) for tx in transactions})
+        with self._lock:
+            for tx in transactions:
+                limit = limits.get(int(tx["from_user_id"]), DEFAULT_TRANSACTION_LIMIT)
+                self._score(tx, limit, count=False)
+            self._sweep()
+
+    def _score(self, tx, limit, count):
+        tx_id = int(tx["transaction_id"])
+        repeated = self.decisions.get(tx_id)
+        if repeated is not None:
+            return repeated[1]
+
+        from_id, to_id = int(tx["from_user_id"]), int(tx["to_user_id"])
+        amount = float(tx["amount"])
+        ts = parse_epoch(tx["created_at"])
+        burst, pending_count, previous_max = self._record(
+            from_id, to_id, ts, amount, tx_id, tx.get("status")
+        )
+        reasons = []
+        signals = []
+
+        # Rule A: circular money flow closed by this transaction
+        cycles = self.graph.cycles_closed_by(from_id, to_id, ts, amount, tx_id, CLOSING_CYCLE_CONSTRAINTS)
+        self.truncated_searches += cycles.truncated
+        for cycle in cycles:
+            reasons.append(f"Circular money flow between users {cycle.describe()}")
+
+        # Rule B: huge transaction way above trust limit
+        if is_huge_amount(amount, limit):
+            reasons.append(f"Huge transaction amount ({tx['amount']})")
+        elif amount > limit * REVIEW_LIMIT_MULTIPLIER:
+            signals.append(f"Amount above {REVIEW_LIMIT_MULTIPLIER:g}x the transaction limit ({limit})")
+
+        # Rule C: burst of pending transfers A -> B within 30 mins
+        if burst:
+            reasons.append(f"Multiple pending transactions from user {from_id} to {to_id}")
+        elif pending_count >= REVIEW_PENDING_COUNT:
+            signals.append(
+                f"{pending_count} pending transactions from user {from_id} to {to_id} "
+                f"within {PENDING_BURST_SECONDS // 60} mins (flagged at {PENDING_BURST_COUNT})"
+            )
+
+        if previous_max and amount > previous_max * AMOUNT_SPIKE_MULTIPLIER:
+            signals.append(f"Amount over {AMOUNT_SPIKE_MULTIPLIER:g}x the sender's recent maximum")
+
+        decision = FLAG if reasons else REVIEW if signals else ALLOW
+        result = {"transaction_id": tx_id, "decision": decision, "reasons": reasons + signals}
+
+        if count:
+            self.scored += 1
+            self.counts[decision] += 1
+        self.decisions[tx_id] = (ts, result)
+        self.latest_ts = max(self.latest_ts, ts)
+        self._since_sweep += 1
+        if self._since_sweep >= self.sweep_every:
+            self._sweep()
+        return result
+
+    def _sweep(self):
+        """Drop state older than the rule windows."""
+        self._since_sweep = 0
+        self.graph.prune(self.latest_ts - WINDOW_SECONDS)
+        self.decisions = {
+            tx_id: entry for tx_id, entry in self.decisions.items()
+            if entry[0] >= self.latest_ts - REPEAT_WINDOW_SECONDS
+        }
+        horizon = self.latest_ts - PENDING_BURST_SECONDS
+        for pair in [p for p, w in self.pending.items() if not w or w[-1][0] < horizon]:
+            del self.pending[pair]
+            self.burst_ids.pop(pair, None)
+        # Senders with nothing left in the graph have no recent activity
+        for user_id in [u for u in self.recent_amounts if u not in self.graph.out]:
+            del self.recent_amounts[user_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scored": self.scored,
+                "decisions": dict(self.counts),
+                "graph_edges": len(self.graph),
+                "tracked_pending_pairs": len(self.pending),
+                "tracked_senders": len(self.recent_amounts),
+                "truncated_cycle_searches": self.truncated_searches,
+            }
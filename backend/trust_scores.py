@@ -0,0 +1,290 @@
+"""
+Trust score recalculation, shared by /trust_log/tabulate_trust and the
+sharded tabulate_trust job.
+
+Kept free of Flask and of the service module so job runner worker
+processes can import it and open their own storage backend.
+"""
+
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+PAGE_SIZE = int(os.getenv("TRUST_RECALC_CHUNK_SIZE", "500"))
+
+
+def calculate_transaction_limit(trust: int) -> int:
+    if trust <= 2:
+        return 500 * (2**trust)
+    elif 3 <= trust <= 5:
+        return 20000
+    else:
+        return 20000 * (2 ** ((trust - 5) // 2))
+
+
+def trust_change(user, last_log, now):
+    """Trust points to add for one user and the remarks explaining them."""
+    last_login = datetime.fromisoformat(user["last_login"].replace("Z", "+00:00"))
+    created_at = datetime.fromisoformat(user["created_at"].replace("Z", "+00:00"))
+    change = 0
+    remarks = []
+
+    # 1. Check 3 months inactivity
+    if (now - last_login).days >= 90:
+        change -= 1
+        remarks.append("No login for 3 months (-1)")
+
+    # 2. Check yearly age bonus (if no recent trust events except 0s)
+    account_age_years = (now - created_at).days // 365
+    if account_age_years >= 1:
+        if last_log and last_log["added_trust"] == 0:
+            change += 1
+            remarks.append("Account age yearly bonus (+1)")
+
+    # 3. If no change, log 0
+    if change == 0:
+        remarks.append("No change (0)")
+    return change, remarks
+
+
+def fetch_latest_trust_logs(client, user_ids, since=None, page_size=1000):
+    """
+    Latest trust_logs row per user, keyed by user_id.
+
+    With since, the time of the previous run (which logged every user it
+    scored), only logs from then on are read, about one per user instead of
+    the user's whole history. Users without one (new since, or skipped by
+    that run) fall back to paging through all of their logs.
+    """
+    latest = {}
+    if since is not None:
+        latest = _page_latest_logs(client, user_ids, since, page_size)
+        user_ids = [user_id for user_id in user_ids if user_id not in latest]
+        if not user_ids:
+            return latest
+    latest.update(_page_latest_logs(client, user_ids, None, page_size))
+    return latest
+
+
+def _page_latest_logs(client, user_ids, since, page_size):
+    latest = {}
+    start = 0
+    while True:
+        query = client.table("trust_logs").select("id, user_id, added_trust, created_at").in_("user_id", user_ids)
+        if since is not None:
+            query = query.gte("created_at", since)
+        rows = (
+            query.order("user_id")
+            .order("created_at", desc=True)
+            .order("id", desc=True)
+            .range(start, start + page_size - 1)
+            .execute()
+            .data
+        ) or []
+        for row in rows:
+            latest.setdefault(row["user_id"], row)  # newest first within each user
+        if len(rows) < page_size:
+            return latest
+        start += page_size
+
+
+def recalc_page(client, users, now, since=None):
+    """
+    New trust for one page of profiles. Returns (changed_profiles, new_logs):
+    the user_id, trust score read (old_trust), new trust score and new limit
+    of each profile whose score or limit changed, and one trust log per user
+    (even if no change). since is passed on to fetch_latest_trust_logs.
+    """
+    last_logs = fetch_latest_trust_logs(client, [user["user_id"] for user in users], since)
+    changed_profiles = []
+    new_logs = []
+    for user in users:
+        change, remarks = trust_change(user, last_logs.get(user["user_id"]), now)
+
+        # Ensure trust stays in [0, 10]
+        new_trust = max(0, min(10, user["trust_score"] + change))
+        new_limit = calculate_transaction_limit(new_trust)
+        if new_trust != user["trust_score"] or new_limit != user["transaction_limit"]:
+            changed_profiles.append(
+                {
+                    "user_id": user["user_id"],
+                    "old_trust": user["trust_score"],
+                    "trust_score": new_trust,
+                    "transaction_limit": new_limit,
+                }
+            )
+
+        new_logs.append(
+            {
+                "user_id": user["user_id"],
+                "added_trust": change,
+                "remarks": ", ".join(remarks),
+                "created_at": now.isoformat(),
+            }
+        )
+    return changed_profiles, new_logs
+
+
+def tally_page(changed_profiles, new_logs):
+    """
+    Dashboard counts of one written page: users moved between trust scores
+    ("old>new" -> users) and trust logs written per added_trust.
+    """
+    moves = Counter(
+        f"{profile['old_trust']}>{profile['trust_score']}"
+        for profile in changed_profiles
+        if profile["old_trust"] != profile["trust_score"]
+    )
+    added = Counter(str(log["added_trust"]) for log in new_logs)
+    return {"moves": dict(moves), "added": dict(added)}
+
+
+def add_tally(shard, tally):
+    for name in ("moves", "added"):
+        totals = shard.setdefault(f"trust_{name}", {})
+        for key, count in tally[name].items():
+            totals[key] = totals.get(key, 0) + count
+
+
+def update_profiles(client, changed_profiles, replay=False):
+    """
+    Write new trust scores and limits, and nothing else, one update per
+    (old_trust, trust_score, transaction_limit) group. Each update only
+    applies while the profile still has the trust score that was read, so a
+    verification or other rescoring since then is not overwritten. On replay
+    a profile already at its new score counts as written.
+
+    Returns the user_ids that were left alone because their score changed.
+    """
+    groups = defaultdict(list)
+    for profile in changed_profiles:
+        key = (profile["old_trust"], profile["trust_score"], profile["transaction_limit"])
+        groups[key].append(profile["user_id"])
+
+    written = set()
+    for (old_trust, new_trust, new_limit), user_ids in groups.items():
+        scores = [old_trust, new_trust] if replay else [old_trust]
+        rows = (
+            client.table("user_profiles")
+            .update({"trust_score": new_trust, "transaction_limit": new_limit})
+            .in_("user_id", user_ids)
+            .in_("trust_score", scores)
+            .execute()
+            .data
+        ) or []
+        written.update(row["user_id"] for row in rows)
+    return {profile["user_id"] for profile in changed_profiles} - written
+
+
+def write_page(client, changed_profiles, new_logs, replay=False):
+    """
+    Apply one page. Profiles whose trust score changed since the page was
+    read are skipped along with their trust logs; the next run rescores
+    them. On replay, logs already written for this run are skipped too.
+
+    Returns (written_profiles, written_logs).
+    """
+    skipped = update_profiles(client, changed_profiles, replay) if changed_profiles else set()
+    if skipped:
+        changed_profiles = [profile for profile in changed_profiles if profile["user_id"] not in skipped]
+        new_logs = [log for log in new_logs if log["user_id"] not in skipped]
+    logs_to_insert = new_logs
+    if replay and new_logs:
+        written = (
+            client.table("trust_logs")
+            .select("user_id")
+            .in_("user_id", [log["user_id"] for log in new_logs])
+            .eq("created_at", new_logs[0]["created_at"])
+            .execute()
+            .data
+        ) or []
+        done = {row["user_id"] for row in written}
+        logs_to_insert = [log for log in new_logs if log["user_id"] not in done]
+    if logs_to_insert:
+        client.bulk_insert("trust_logs", logs_to_insert)
+    return changed_profiles, new_logs
+
+
+def fetch_profiles_page(client, after_id=None, lo=None, hi=None, page_size=PAGE_SIZE):
+    """
+    Next page of profiles by user_id, after the after_id cursor, or from lo
+    (inclusive) on the first page, and below hi. Every bound is optional.
+    """
+    query = client.table("user_profiles").select("user_id, trust_score, transaction_limit, last_login, created_at")
+    if after_id is not None:
+        query = query.gt("user_id", after_id)
+    elif lo is not None:
+        query = query.gte("user_id", lo)
+    if hi is not None:
+        query = query.lt("user_id", hi)
+    return query.order("user_id").limit(page_size).execute().data or []
+
+
+# ------------------------------
+# Job runner shard
+# ------------------------------
+
+
+def make_client():
+    """
+    The storage backend of this process, from the same env vars as the
+    service: its own in a worker, the service's one for inline shards.
+    """
+    from repository import default_backend
+
+    return default_backend()
+
+
+def run_trust_shard(checkpoint, shard):
+    """
+    Recalculate one user_id range [shard["lo"], shard["hi"]) in a worker
+    process, checkpointing after every page.
+
+    Each page is computed first and saved in the checkpoint as pending
+    before it is written, so a resumed shard replays exactly the writes
+    it had planned instead of recalculating trust that may already have
+    changed.
+    """
+    client = make_client()
+    now = datetime.fromisoformat(shard["params"]["now"])
+    since = shard["params"].get("since")  # the previous run's now, if there was one
+    # Seconds per phase of this attempt, reported by the job runner
+    timings = shard["timings"] = {"fetch": 0.0, "recalc": 0.0, "write": 0.0}
+
+    pending = shard.get("pending")
+    if pending:
+        profiles, logs = write_page(client, pending["profiles"], pending["logs"], replay=True)
+        record_page(checkpoint, shard, pending["cursor"], len(pending["logs"]), profiles, logs)
+
+    after_id = shard["cursor"]
+    while True:
+        started = time.perf_counter()
+        users = fetch_profiles_page(client, after_id, shard["lo"], shard["hi"])
+        timings["fetch"] += time.perf_counter() - started
+        if not users:
+            break
+        started = time.perf_counter()
+        profiles, logs = recalc_page(client, users, now, since)
+        timings["recalc"] += time.perf_counter() - started
+        after_id = users[-1]["user_id"]
+        shard["pending"] = {"profiles": profiles, "logs": logs, "cursor": after_id}
+        checkpoint.save_shard(shard)
+
+        started = time.perf_counter()
+        profiles, logs = write_page(client, profiles, logs)
+        timings["write"] += time.perf_counter() - started
+        record_page(checkpoint, shard, after_id, len(users), profiles, logs)
+        if len(users) < PAGE_SIZE:
+            break
+    return shard
+
+
+def record_page(checkpoint, shard, cursor, page_users, profiles, logs):
+    """Count a written page into the shard and checkpoint past it."""
+    shard.update(cursor=cursor, pending=None)
+    shard["processed"] += len(logs)
+    shard["updated"] += len(profiles)
+    shard["skipped"] = shard.get("skipped", 0) + page_users - len(logs)
+    add_tally(shard, tally_page(profiles, logs))
+    checkpoint.save_shard(shard)
@@ -0,0 +1,161 @@
+"""
+Bounded write-behind buffer for append-only Supabase tables.
+
+Request handlers hand rows to the buffer and return immediately; a daemon
+thread, started with the first row, drains it and writes in bulk inserts.
+When the buffer is full, add() blocks until the flusher catches up, so
+memory stays bounded; offer() returns False instead, for callers that must
+not wait (e.g. views running on an event loop).
+"""
+
+import atexit
+import threading
+import time
+from collections import deque
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        flush_fn,
+        name="buffer",
+        max_rows=10_000,
+        batch_size=500,
+        flush_interval=1.0,
+        max_retries=3,
+    ):
+        self.flush_fn = flush_fn
+        self.name = name
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+
+        self._rows = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._in_flight = 0
+
+        self.flushed = 0
+        self.dropped = 0
+        self.flushes = 0
+
+        self._thread = None
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, row):
+        self._put(row, block=True)
+
+    def offer(self, row):
+        """Add the row unless the buffer is full; never waits. Returns whether it was added."""
+        return self._put(row, block=False)
+
+    def full(self):
+        with self._cond:
+            return len(self._rows) >= self.max_rows
+
+    def _put(self, row, block):
+        with self._cond:
+            if self._closed:
+                # Flusher is gone (interpreter shutdown), write through
+                self._write([row])
+                return True
+            if self._thread is None:
+                self._start()
+            while len(self._rows) >= self.max_rows and not self._closed:
+                self._cond.notify_all()
+                if not block:
+                    return False
+                self._cond.wait(self.flush_interval)
+            self._rows.append(row)
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify_all()
+            return True
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def _take_batch(self):
+        batch = []
+        while self._rows and len(batch) < self.batch_size:
+            batch.append(self._rows.popleft())
+        self._in_flight += len(batch)
+        return batch
+
+    def _write(self, batch):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.flush_fn(batch)
+                self.flushed += len(batch)
+                self.flushes += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.dropped += len(batch)
+                    print(f"[{self.name}] dropped {len(batch)} rows after {attempt} attempts: {e}")
+                    return
+                time.sleep(min(2 ** attempt * 0.1, 2.0))
+
+    def _drain(self):
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+                if not batch:
+                    self._cond.notify_all()
+                    return
+            try:
+                self._write(batch)
+            finally:
+                with self._cond:
+                    self._in_flight -= len(batch)
+                    self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._rows and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                elif len(self._rows) < self.batch_size and not self._closed:
+                    # Let a partial batch fill up for one interval before writing
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            self._drain()
+            if closed:
+                return
+
+    def flush(self, timeout=None):
+        """Block until everything added so far has been written (or dropped)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._rows or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else self.flush_interval)
+        return True
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._rows) + self._in_flight
+        return {
+            "name": self.name,
+            "pending": pending,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+        }